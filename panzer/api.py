@@ -0,0 +1,135 @@
+""" panzer as a library: convert documents from python
+
+    from panzer import api, const
+    result = api.convert(['a.md'], 'latex', ['--toc'], '/path/to/support')
+    if result.status == const.DONE:
+        latex = result.output.decode('utf8')
+
+`convert` never exits and never changes how logging is set up: messages
+are kept in the result, and sent to a logger only if one is given. It may
+be called again and again, and from many threads at once. Each call keeps
+its own options, log and run list; what calls share is only what panzer
+keeps between documents anyway (see `document` and `resident`).
+"""
+import asyncio
+import copy
+import os
+import subprocess
+import tempfile
+from . import cli
+from . import const
+from . import document
+from . import engine
+from . import error
+from . import info
+from . import panzer
+
+class Result(object):
+    """ outcome of a conversion
+    - output  : bytes of output, or None if panzer stopped with an error,
+                pandoc failed, or none was written
+    - status  : const.DONE, or const.FAILED if panzer stopped with an error,
+                pandoc failed, or any executable on the run list failed
+    - error   : message of error that stopped panzer or failure of pandoc,
+                or None
+    - runlist : run list of the document, with the status of each entry
+    - log     : list of messages logged, each {'level': LEVEL,
+                'sender': SENDER, 'message': TEXT}
+    """
+    def __init__(self, output, error_message, runlist, log):
+        """ new result """
+        self.output = output
+        self.error = error_message
+        self.runlist = runlist
+        self.log = log
+        failed = any(entry['status'] == const.FAILED for entry in runlist)
+        if error_message is None and not failed:
+            self.status = const.DONE
+        else:
+            self.status = const.FAILED
+
+def convert(inputs, writer=None, options=None, support_dir=None,
+            output=None, logger=None):
+    """ return Result of converting source documents inputs
+
+    inputs is a filename or list of filenames; stdin cannot be used.
+    writer is pandoc's writer, or None to choose as panzer does. options
+    is a list of other panzer and pandoc command line options. support_dir
+    is the panzer support directory, or None for the default one. The
+    output is written to file output if given, otherwise to a temporary
+    file, and returned. Messages are also sent to logger, a
+    logging.Logger, if given.
+
+    Relative filenames are taken from the process's working directory.
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    log = info.Log(logger)
+    log_token = info.CURRENT_LOG.set(log)
+    timing_token = info.TIMING.set(None)
+    temp_dir = tempfile.TemporaryDirectory(prefix='panzer-')
+    if output is None:
+        output = os.path.join(temp_dir.name, 'output')
+    arguments = list(options or list())
+    if support_dir is not None:
+        arguments += ['---panzer-support', os.path.expanduser(support_dir)]
+    if writer is not None:
+        arguments += ['--write', writer]
+    arguments += ['--output', output]
+    arguments += inputs
+    doc = document.Document()
+    output_bytes = None
+    error_message = None
+    try:
+        if '-' in inputs:
+            raise error.SetupError('cannot convert stdin---give source '
+                                   'documents as files')
+        doc = convert_arguments(doc, arguments)
+        if doc.pandoc_failed:
+            # - anything at output was not written by this conversion
+            error_message = 'pandoc failed'
+        else:
+            output_bytes = read_output(output)
+    except error.SetupError as err:
+        info.log('CRITICAL', 'panzer', err)
+        error_message = str(err)
+    except subprocess.CalledProcessError as err:
+        info.log('CRITICAL', 'panzer',
+                 'cannot continue because of fatal error')
+        error_message = str(err)
+    except panzer.FATAL_ERRORS as err:
+        info.log('CRITICAL', 'panzer', err)
+        error_message = str(err)
+    finally:
+        temp_dir.cleanup()
+        info.CURRENT_LOG.reset(log_token)
+        info.TIMING.reset(timing_token)
+    return Result(output_bytes, error_message, copy.deepcopy(doc.runlist),
+                  log.messages)
+
+def convert_arguments(doc, arguments):
+    """ return doc once converted with command line arguments
+
+    Raises error.SetupError if panzer cannot be run with arguments.
+    """
+    try:
+        doc.options = cli.parse_cli_options(doc.options, arguments)
+    except SystemExit:
+        # - argparse exits on arguments it cannot parse
+        raise error.SetupError('invalid arguments: %s' % ' '.join(arguments))
+    if doc.options['panzer']['watch']:
+        raise error.SetupError('cannot watch from python---call convert '
+                               'again instead')
+    support_dir = doc.options['panzer']['panzer_support']
+    if not os.path.isdir(support_dir):
+        raise error.SetupError('panzer support directory "%s" not found'
+                               % support_dir)
+    return asyncio.run(engine.convert(doc))
+
+def read_output(filename):
+    """ return bytes of file filename, or None if it cannot be read """
+    try:
+        with open(filename, 'rb') as output_file:
+            return output_file.read()
+    except OSError:
+        return None
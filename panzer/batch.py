@@ -0,0 +1,220 @@
+""" panzer-batch: convert many documents with one panzer
+
+syntax: panzer-batch MANIFEST [---workers N] [OPTIONS]
+
+MANIFEST is a json file holding a list of jobs, each an object:
+
+    {"input": "a.md" or ["a.md", "b.md"],
+     "output": "a.html",
+     "write": "html",                      (optional)
+     "arguments": ["---stream", "--toc"]}  (optional)
+
+OPTIONS are panzer and pandoc options given to every job, before the job's
+own arguments. Style definitions are loaded once. The ---jobs slots for
+external processes are split between a pool of N worker processes. Jobs
+are handed out in chunks of as many as a worker has slots, and each worker
+converts the jobs of a chunk at the same time with `engine.convert_all`.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import copy
+import json
+import subprocess
+import sys
+import time
+from . import cli
+from . import const
+from . import document
+from . import engine
+from . import error
+from . import info
+from . import load
+from . import panzer
+from . import util
+
+# state of a worker process, set by `start_worker`
+# - styledef : global style definitions loaded by the batch
+# - key      : options that the style definitions were loaded with
+# - jobs     : number of external processes the worker may run at once
+WORKER = dict()
+
+def main():
+    """ the main function of panzer-batch """
+    parser = argparse.ArgumentParser(
+        prog='panzer-batch',
+        description='Convert the documents listed in MANIFEST. Other '
+                    'arguments are passed to panzer for every document.')
+    parser.add_argument('manifest',
+                        help='json file listing documents to convert')
+    parser.add_argument('---workers',
+                        type=cli.job_count,
+                        default=const.DEFAULT_JOBS,
+                        help='number of worker processes, which share '
+                             'the ---jobs slots (default: %d)'
+                             % const.DEFAULT_JOBS)
+    batch_args, common = parser.parse_known_args()
+    try:
+        options = cli.parse_cli_options(document.Document().options, common)
+        if options['pandoc']['input']:
+            raise error.SetupError('give source documents in the manifest, '
+                                   'not on the command line')
+        info.start_logger(options)
+        util.check_support_directory(options)
+        jobs = read_manifest(batch_args.manifest, common)
+    except error.SetupError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    global_styledef = load.load_styledef(options)
+    failures = run_jobs(jobs, options, global_styledef, batch_args.workers)
+    sys.exit(1 if failures else 0)
+
+def read_manifest(filename, common):
+    """ return list of (name, arguments) of jobs listed in manifest file """
+    try:
+        with open(filename, 'r', encoding=const.ENCODING) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as err:
+        raise error.SetupError('cannot read manifest "%s": %s'
+                               % (filename, err))
+    if not isinstance(manifest, list):
+        raise error.SetupError('manifest must be a list of jobs')
+    jobs = list()
+    for i, job in enumerate(manifest):
+        if not isinstance(job, dict) or 'input' not in job \
+        or 'output' not in job:
+            raise error.SetupError('job %d: "input" and "output" needed'
+                                   % (i + 1))
+        inputs = job['input']
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if '-' in inputs or job['output'] == '-':
+            raise error.SetupError('job %d: cannot use stdin or stdout'
+                                   % (i + 1))
+        arguments = list(common)
+        arguments += job.get('arguments', list())
+        arguments += ['--output', job['output']]
+        if job.get('write'):
+            arguments += ['--write', job['write']]
+        arguments += inputs
+        name = '%s -> %s' % (' '.join(inputs), job['output'])
+        jobs.append((name, arguments))
+    return jobs
+
+def run_jobs(jobs, options, global_styledef, workers):
+    """ run jobs in pool of worker processes, return number that failed """
+    info.log('INFO', 'panzer', info.pretty_title('batch'))
+    info.log('INFO', 'panzer', '%d jobs, %d workers' % (len(jobs), workers))
+    start = time.time()
+    failures = 0
+    # - ---jobs counts external processes across the whole batch
+    size = worker_slots(options['panzer']['jobs'], workers)
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=start_worker,
+            initargs=(options, global_styledef, size)) as executor:
+        futures = {executor.submit(run_chunk,
+                                   [arguments for _, arguments in chunk]):
+                   chunk
+                   for chunk in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            chunk = futures[future]
+            try:
+                results = future.result()
+            except Exception as err:        # pylint: disable=W0703
+                # - one chunk that crashes must not stop the others
+                # disable pylint warnings:
+                #     + Catching too general exception
+                results = [(const.FAILED, 0.0, repr(err))] * len(chunk)
+            for (name, _), (status, seconds, message) in zip(chunk, results):
+                if status == const.DONE:
+                    info.log('INFO', 'panzer', '%s %6.2fs  %s'
+                             % (status.ljust(6), seconds, name))
+                else:
+                    failures += 1
+                    info.log('ERROR', 'panzer', '%s %6.2fs  %s: %s'
+                             % (status.ljust(6), seconds, name, message))
+    info.log('INFO', 'panzer', '%d done, %d failed in %.2fs'
+             % (len(jobs) - failures, failures, time.time() - start))
+    return failures
+
+def worker_slots(jobs, workers):
+    """ return number of external processes each of workers may run
+
+    The jobs slots are shared out, but each worker gets at least one.
+    """
+    return max(1, jobs // workers)
+
+def start_worker(options, global_styledef, slots):
+    """ set up worker process with logger, style definitions and slots """
+    worker_options = copy.deepcopy(options)
+    # - only the batch writes the debug log
+    worker_options['panzer']['debug'] = str()
+    info.start_logger(worker_options)
+    WORKER['styledef'] = global_styledef
+    WORKER['key'] = load.styledef_key(options)
+    WORKER['jobs'] = slots
+
+def run_chunk(chunk):
+    """ return list of (status, seconds, message) of jobs in chunk
+
+    chunk is a list of the arguments of each job. Jobs whose style
+    definitions are those loaded by the batch are converted at the same
+    time, then the others, which load their own. Each job is timed, and
+    given the time allowed by ---deadline, from when its group starts.
+    """
+    results = [None] * len(chunk)
+    # - indexes and documents of jobs, by whether they use loaded styles
+    groups = {True: list(), False: list()}
+    for i, arguments in enumerate(chunk):
+        doc = document.Document()
+        try:
+            doc.options = cli.parse_cli_options(doc.options, arguments)
+        except SystemExit:
+            # - argparse exits on arguments it cannot parse
+            results[i] = (const.FAILED, 0.0, 'invalid arguments')
+            continue
+        loaded = load.styledef_key(doc.options) == WORKER['key']
+        groups[loaded].append((i, doc))
+    for loaded in (True, False):
+        if not groups[loaded]:
+            continue
+        indexes = [i for i, _ in groups[loaded]]
+        start = time.time()
+        for _, doc in groups[loaded]:
+            if doc.options['panzer']['deadline']:
+                doc.options['panzer']['deadline_time'] = \
+                    start + doc.options['panzer']['deadline']
+        def done(j, outcome, indexes=indexes, start=start):
+            """ record result of jth document of group as it ends """
+            results[indexes[j]] = job_result(outcome, time.time() - start)
+        asyncio.run(engine.convert_all(
+            [doc for _, doc in groups[loaded]],
+            WORKER['styledef'] if loaded else None,
+            WORKER['jobs'],
+            done))
+    return results
+
+def job_result(outcome, seconds):
+    """ return (status, seconds, message) of job with outcome
+
+    outcome is the document converted or the exception that stopped it, as
+    given by `engine.convert_all`. The job fails if panzer stops with an
+    error, if pandoc fails, or if any executable on its run list fails.
+    """
+    if isinstance(outcome, ((error.SetupError, subprocess.CalledProcessError)
+                            + panzer.FATAL_ERRORS)):
+        return const.FAILED, seconds, str(outcome)
+    if isinstance(outcome, Exception):
+        return const.FAILED, seconds, repr(outcome)
+    if outcome.pandoc_failed:
+        return const.FAILED, seconds, 'pandoc failed'
+    failed = [entry['command'] for entry in outcome.runlist
+              if entry['status'] == const.FAILED]
+    if failed:
+        return const.FAILED, seconds, 'failed to run %s' % ', '.join(failed)
+    return const.DONE, seconds, str()
+
+if __name__ == '__main__':
+    main()
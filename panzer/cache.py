@@ -0,0 +1,145 @@
+""" on-disk cache of data derived from running pandoc """
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from . import const
+from . import info
+
+def cache_dir(options):
+    """ return path to cache directory inside panzer support directory """
+    return os.path.join(options['panzer']['panzer_support'], const.CACHE_DIR)
+
+def hash_bytes(*chunks):
+    """ return hex digest of the byte strings in chunks """
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        # - prefix each chunk with its length so that boundaries count
+        digest.update(str(len(chunk)).encode(const.ENCODING) + b':')
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_file(filename):
+    """ return hex digest of contents of filename """
+    with open(filename, 'rb') as input_file:
+        return hash_bytes(input_file.read())
+
+def pandoc_key():
+    """ return string identifying the pandoc executable on PATH
+
+    The path, size and modification time of the executable change whenever
+    pandoc is upgraded, so they stand in for its version without spawning
+    `pandoc --version`.
+    """
+    path = shutil.which('pandoc')
+    if not path:
+        return 'pandoc-not-found'
+    stat = os.stat(path)
+    return '%s:%d:%d' % (os.path.realpath(path), stat.st_size,
+                         stat.st_mtime_ns)
+
+def read(options, kind, key):
+    """ return json data cached under kind and key, or None if absent """
+    filename = os.path.join(cache_dir(options), kind, key + '.json')
+    try:
+        with open(filename, 'r', encoding=const.ENCODING) as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    try:
+        # - mark entry as recently used
+        os.utime(filename)
+    except OSError:
+        pass
+    info.log('DEBUG', 'panzer', 'cache hit: %s' % info.pretty_path(filename))
+    return data
+
+def write(options, kind, key, data):
+    """ store json data under kind and key
+
+    Data is written to a temporary file that is then renamed into place, so
+    concurrent panzer processes never see a partially written entry. Failure
+    to write the cache is not an error: panzer carries on without it.
+    """
+    directory = os.path.join(cache_dir(options), kind)
+    filename = os.path.join(directory, key + '.json')
+    temp_filename = str()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w',
+                                         encoding=const.ENCODING,
+                                         dir=directory,
+                                         prefix='.tmp-',
+                                         delete=False) as temp_file:
+            temp_filename = temp_file.name
+            json.dump(data, temp_file)
+            temp_file.flush()
+        os.replace(temp_filename, filename)
+    except OSError as err:
+        info.log('DEBUG', 'panzer', 'cannot write cache: %s' % err)
+        if temp_filename and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return
+    info.log('DEBUG', 'panzer', 'cache written: %s'
+             % info.pretty_path(filename))
+
+def remove(options, kind, key):
+    """ remove entry of kind and key, if it exists """
+    filename = os.path.join(cache_dir(options), kind, key + '.json')
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+def purge(options, kind, keep):
+    """ remove entries of kind except for those whose key is in keep """
+    directory = os.path.join(cache_dir(options), kind)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        key, ext = os.path.splitext(name)
+        if ext != '.json' or key in keep:
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            # - another panzer process may have removed it first
+            pass
+
+def trim(options, kind, max_entries, max_bytes=None):
+    """ remove least recently used entries of kind
+
+    Entries are removed until at most max_entries remain and, if max_bytes
+    is given, their total size is at most max_bytes.
+    """
+    directory = os.path.join(cache_dir(options), kind)
+    try:
+        entries = [os.path.join(directory, name)
+                   for name in os.listdir(directory)
+                   if name.endswith('.json')]
+    except OSError:
+        return
+    if len(entries) <= max_entries and max_bytes is None:
+        return
+    stats = dict()
+    for entry in entries:
+        try:
+            stats[entry] = os.stat(entry)
+        except OSError:
+            # - another panzer process may have removed it first
+            continue
+    total = sum(stat.st_size for stat in stats.values())
+    remaining = len(stats)
+    for entry in sorted(stats, key=lambda entry: stats[entry].st_mtime):
+        if remaining <= max_entries \
+        and (max_bytes is None or total <= max_bytes):
+            break
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+        remaining -= 1
+        total -= stats[entry].st_size
@@ -4,6 +4,7 @@ import os
 import shutil
 import sys
 import tempfile
+import time
 from . import const
 from . import version
 
@@ -64,8 +65,8 @@ PANDOC_WRITER_MAPPING = {
     ".9"        : "man"
 }
 
-def parse_cli_options(options):
-    """ parse command line options """
+def parse_cli_options(options, args=None):
+    """ parse command line options, or list of arguments args if given """
     #
     # disable pylint warnings:
     #     + Too many local variables (too-many-locals)
@@ -74,12 +75,16 @@ def parse_cli_options(options):
     # pylint: disable=R0914
     #
     # 1. Parse options specific to panzer
-    panzer_known, unknown = panzer_parse()
+    panzer_known, unknown = panzer_parse(args)
     # 2. Update options with panzer-specific values
     for field in panzer_known:
         val = panzer_known[field]
         if val:
             options['panzer'][field] = val
+    # - time by which whole conversion must finish
+    if options['panzer']['deadline']:
+        options['panzer']['deadline_time'] = (time.time()
+                                              + options['panzer']['deadline'])
     # 3. Parse options specific to pandoc
     pandoc_known, unknown = pandoc_parse(unknown)
     # 2. Update options with pandoc-specific values
@@ -128,9 +133,10 @@ def parse_cli_options(options):
     options['pandoc']['options'] = unknown
     return options
 
-def panzer_parse():
+def panzer_parse(args=None):
     """ return list of arguments recognised by panzer + unknowns """
     panzer_parser = argparse.ArgumentParser(
+        prog='panzer',
         description=PANZER_DESCRIPTION,
         epilog=PANZER_EPILOG,
         formatter_class=argparse.RawTextHelpFormatter,
@@ -146,12 +152,87 @@ def panzer_parse():
                                help='only print errors and warnings')
     panzer_parser.add_argument("---panzer-support",
                                help='directory of support files')
+    panzer_parser.add_argument("---plain-styledef",
+                               action='store_true',
+                               help='convert styles.yaml without pandoc,\n'
+                                    'reading strings as plain text')
+    panzer_parser.add_argument("---cache-ast",
+                               action='store_true',
+                               help='reuse ast of unchanged source documents')
+    panzer_parser.add_argument("---incremental",
+                               action='store_true',
+                               help='do nothing if output is up to date')
+    panzer_parser.add_argument("---watch",
+                               action='store_true',
+                               help='convert again whenever source, styles,\n'
+                                    'template or executables change')
+    panzer_parser.add_argument("---stream",
+                               action='store_true',
+                               help='connect filters and postprocessors\n'
+                                    'directly to each other')
+    panzer_parser.add_argument("---parallel",
+                               type=kind_list,
+                               help='kinds of scripts to run at the same time,\n'
+                                    'comma separated (%s)'
+                                    % ', '.join(const.PARALLEL_KIND))
+    panzer_parser.add_argument("---jobs",
+                               type=job_count,
+                               help='maximum number of executables to run\n'
+                                    'at the same time (default: %d)'
+                                    % const.DEFAULT_JOBS)
+    panzer_parser.add_argument("---stderr-lines",
+                               type=line_count,
+                               help='maximum number of messages kept from\n'
+                                    'each executable (default: %d)'
+                                    % const.STDERR_MAX_LINES)
+    panzer_parser.add_argument("---deadline",
+                               type=seconds,
+                               help='seconds the whole conversion may take')
     panzer_parser.add_argument("---debug",
                                help='filename to write .log and .json debug files')
-    panzer_known_raw, unknown = panzer_parser.parse_known_args()
+    panzer_known_raw, unknown = panzer_parser.parse_known_args(args)
     panzer_known = vars(panzer_known_raw)
     return (panzer_known, unknown)
 
+def kind_list(value):
+    """ return list of runlist kinds in comma separated value """
+    kinds = [kind.strip() for kind in value.split(',') if kind.strip()]
+    for kind in kinds:
+        if kind not in const.PARALLEL_KIND:
+            raise argparse.ArgumentTypeError('cannot run "%s" in parallel'
+                                             % kind)
+    return kinds
+
+def job_count(value):
+    """ return value as a number of jobs, at least 1 """
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('"%s" is not a number' % value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError('need at least 1 job')
+    return jobs
+
+def line_count(value):
+    """ return value as a number of lines, at least 1 """
+    try:
+        lines = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('"%s" is not a number' % value)
+    if lines < 1:
+        raise argparse.ArgumentTypeError('need at least 1 line')
+    return lines
+
+def seconds(value):
+    """ return value as a positive number of seconds """
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('"%s" is not a number' % value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('need a positive number of seconds')
+    return number
+
 def pandoc_parse(args):
     """ return list of arguments recognised by pandoc + unknowns """
     pandoc_parser = argparse.ArgumentParser(prog='pandoc')
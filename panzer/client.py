@@ -0,0 +1,93 @@
+""" panzer-client: run panzer through panzer-daemon
+
+syntax: panzer-client [OPTIONS]
+
+OPTIONS are the same as for panzer. The document is converted by the
+panzer-daemon listening on the socket in PANZER_SOCKET, or the default
+socket if not set. If no daemon is listening, panzer is run as usual.
+
+The client sends one frame (see `resident`) with the request:
+
+    {"arguments": ARGUMENTS, "cwd": DIRECTORY, "environment": VARIABLES}
+
+The daemon replies with frames of these kinds, as the conversion goes on:
+
+- {"stdout": DATA}  : write DATA to stdout
+- {"stderr": DATA}  : write DATA to stderr
+- {"stdin": true}   : send back {"stdin": DATA} with all of stdin
+- {"exit": STATUS}  : conversion done, exit with STATUS
+
+DATA is base64 encoded bytes.
+"""
+import base64
+import json
+import os
+import socket
+import sys
+from . import const
+from . import error
+from . import resident
+
+def main():
+    """ the main function of panzer-client """
+    try:
+        connection = connect(socket_path())
+    except OSError:
+        # - no daemon listening, so run panzer here
+        from . import panzer
+        return panzer.main()
+    with connection:
+        sys.exit(request(connection, sys.argv[1:]))
+
+def socket_path():
+    """ return path of socket that panzer-daemon listens on """
+    return os.environ.get('PANZER_SOCKET', const.DAEMON_SOCKET)
+
+def connect(path):
+    """ return socket connected to daemon at path """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('unix sockets not available')
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+def request(connection, arguments):
+    """ return exit status of daemon converting with arguments """
+    rfile = connection.makefile('rb', buffering=0)
+    wfile = connection.makefile('wb', buffering=0)
+    send(wfile, {'arguments': arguments,
+                 'cwd': os.getcwd(),
+                 'environment': dict(os.environ)})
+    while True:
+        try:
+            reply = json.loads(resident.read_frame(rfile)
+                               .decode(const.ENCODING))
+        except error.ProtocolError:
+            print('panzer-daemon stopped before conversion finished',
+                  file=sys.stderr)
+            return 1
+        if 'stdout' in reply:
+            sys.stdout.buffer.write(base64.b64decode(reply['stdout']))
+            sys.stdout.flush()
+        elif 'stderr' in reply:
+            sys.stderr.buffer.write(base64.b64decode(reply['stderr']))
+            sys.stderr.flush()
+        elif 'stdin' in reply:
+            send(wfile, {'stdin': encode(sys.stdin.buffer.read())})
+        elif 'exit' in reply:
+            return reply['exit']
+
+def send(stream, message):
+    """ write message to stream as a frame """
+    resident.write_frame(stream, json.dumps(message).encode(const.ENCODING))
+
+def encode(data):
+    """ return bytes data as base64 string """
+    return base64.b64encode(data).decode('ascii')
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,68 @@ DEFAULT_SUPPORT_DIR = os.path.join(os.path.expanduser('~'), '.panzer')
 
 ENCODING = 'utf8'
 
+# subdirectory of panzer support directory that holds cached data
+CACHE_DIR = 'cache'
+
+# format of cached style definitions, change if format or conversion changes
+STYLEDEF_CACHE_FORMAT = 'styleindex-2'
+
+# maximum number of outcomes of applying styles kept in memory
+STYLE_OUTCOMES_SIZE = 64
+
+# maximum number of entries kept in a cache of documents
+CACHE_MAX_ENTRIES = 100
+
+# maximum number of outputs of cacheable filters kept, and their total size
+FILTER_CACHE_MAX_ENTRIES = 500
+FILTER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# maximum number of dependency manifests of outputs kept
+DEPENDS_MAX_ENTRIES = 1000
+
+# seconds between checks of files watched by ---watch
+WATCH_INTERVAL = 0.25
+
+# seconds files watched must stay unchanged before converting again
+WATCH_DEBOUNCE = 0.2
+
+# panzer options that cannot change an output
+# - changing these does not make ---incremental convert again
+DEPENDS_IGNORED_OPTIONS = ['silent', 'debug', 'cache_ast', 'stream',
+                           'parallel', 'jobs', 'deadline', 'deadline_time',
+                           'stderr_lines', 'stdin_temp_file', 'incremental',
+                           'watch']
+
+# pandoc options that only affect pandoc's writer
+# - these are ignored when deciding whether a cached ast can be used
+WRITER_ONLY_OPTIONS = ['-s', '--standalone',
+                       '--toc', '--table-of-contents', '--toc-depth',
+                       '-N', '--number-sections', '--number-offset',
+                       '--no-highlight', '--highlight-style',
+                       '-H', '--include-in-header',
+                       '-B', '--include-before-body',
+                       '-A', '--include-after-body',
+                       '--self-contained', '--html-q-tags', '--ascii',
+                       '--reference-links', '--atx-headers', '--chapters',
+                       '--listings', '-i', '--incremental', '--slide-level',
+                       '--section-divs', '--email-obfuscation', '--id-prefix',
+                       '-T', '--title-prefix', '-c', '--css',
+                       '--reference-odt', '--reference-docx',
+                       '--epub-stylesheet', '--epub-cover-image',
+                       '--epub-metadata', '--epub-embed-font',
+                       '--epub-chapter-level', '--latex-engine',
+                       '--latex-engine-opt', '--no-wrap',
+                       '--wrap', '--dpi', '-V', '--variable',
+                       '-m', '--latexmathml', '--mathml', '--jsmath',
+                       '--mathjax', '--gladtex', '--mimetex', '--webtex',
+                       '--katex', '--katex-stylesheet']
+
+# socket that panzer-daemon listens on, unless PANZER_SOCKET is set
+DAEMON_SOCKET = os.path.join(DEFAULT_SUPPORT_DIR, 'daemon.sock')
+
+# subdirectory of panzer support directory with extra style definition files
+STYLES_DIR = 'styles.d'
+
 # keys to access type and content of metadata fields
 T = 't'
 C = 'c'
@@ -20,6 +82,37 @@ RUNLIST_KIND = ['preflight',
                 'postflight',
                 'cleanup']
 
+# function called on ast by filters run inside panzer
+PYTHON_FILTER_FUNCTION = 'panzer_filter'
+
+# seconds to wait for a resident filter to respond before stopping it
+RESIDENT_TIMEOUT = 300
+
+# maximum number of messages from an executable's stderr kept in its entry
+STDERR_MAX_LINES = 1000
+
+# maximum length in bytes of a line read from an executable's stderr
+STDERR_LINE_LIMIT = 1024 * 1024
+
+# fields of runlist items that limit time (seconds), memory (megabytes) and
+# cpu time (seconds) used by an executable
+LIMIT_FIELDS = ['timeout', 'memory', 'cpu']
+
+# text in an executable's stderr showing it could not get more memory
+MEMORY_ERROR_TEXT = ['MemoryError',
+                     'out of memory',
+                     'Out of memory',
+                     'Cannot allocate memory',
+                     'bad_alloc']
+
+# kinds of items on runlist that may be run at the same time
+PARALLEL_KIND = ['preflight',
+                 'postflight',
+                 'cleanup']
+
+# default maximum number of executables run at the same time
+DEFAULT_JOBS = os.cpu_count() or 1
+
 # 'status' of items on runlist
 QUEUED = 'queued'
 RUNNING = 'running'
@@ -32,3 +125,22 @@ EMPTY_DOCUMENT = [{'unMeta': {}}, []]
 # writers that give binary outputs
 # these cannot be written to stdout
 BINARY_WRITERS = ['odt', 'docx', 'epub', 'epub3']
+
+# extensions of source documents that pandoc reads as markdown by default
+MARKDOWN_EXTENSIONS = ['', '.md', '.markdown', '.text', '.txt']
+
+# writers that output every metadata field, not only those a template uses
+# - panzer's own fields must be removed from the ast for these
+METADATA_WRITERS = ['json',
+                    'native',
+                    'markdown',
+                    'markdown_github',
+                    'markdown_mmd',
+                    'markdown_phpextra',
+                    'markdown_strict']
+
+# characters of a metadata string that every writer outputs unchanged
+# - fields made only of these can be passed to pandoc on its command line
+DIRECT_METADATA_CHARS = set('abcdefghijklmnopqrstuvwxyz'
+                            'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                            '0123456789 .,;:!?()/+=-')
@@ -0,0 +1,237 @@
+""" panzer-daemon: convert documents sent by panzer-client
+
+syntax: panzer-daemon [---socket PATH] [OPTIONS]
+
+The daemon listens on a unix socket, PATH or else the socket in
+PANZER_SOCKET or the default socket, for requests from panzer-client (see
+`client` for the protocol). It converts one document at a time, in the
+client's working directory and environment, and sends back output and log
+messages as they are written.
+
+Style definitions are loaded once for each support directory and kept,
+and loaded again when a styles file changes. Resident filters and the
+outcomes of applying styles are also kept between documents. OPTIONS are
+panzer options for the daemon itself: ---panzer-support sets the style
+definitions loaded on start, ---silent and ---debug set its own logging.
+"""
+import argparse
+import base64
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+from . import cli
+from . import client
+from . import const
+from . import document
+from . import error
+from . import info
+from . import load
+from . import panzer
+from . import resident
+from . import util
+
+# style definitions kept by the daemon
+# - keys are `load.styledef_key` of options, values are
+#   (signature of styles files, style definitions)
+STYLEDEFS = dict()
+
+def main():
+    """ the main function of panzer-daemon """
+    parser = argparse.ArgumentParser(
+        prog='panzer-daemon',
+        description='Convert documents sent by panzer-client. Other '
+                    'arguments are panzer options for the daemon.')
+    parser.add_argument('---socket',
+                        default=client.socket_path(),
+                        help='socket to listen on (default: %s)'
+                             % client.socket_path())
+    daemon_args, rest = parser.parse_known_args()
+    try:
+        options = cli.parse_cli_options(document.Document().options, rest)
+        info.start_logger(options)
+        util.check_support_directory(options)
+        server = start_server(daemon_args.socket, options)
+    except error.SetupError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    # - stop cleanly on kill as on ctrl-c
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    warm_styledef(options)
+    info.log('INFO', 'panzer', 'listening on "%s"' % daemon_args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(daemon_args.socket)
+        info.log('INFO', 'panzer', 'stopped')
+
+def start_server(path, options):
+    """ return server listening on socket at path """
+    if os.path.exists(path):
+        try:
+            client.connect(path).close()
+        except OSError:
+            # - left behind by a daemon that did not stop cleanly
+            os.remove(path)
+        else:
+            raise error.SetupError('panzer-daemon already listening on "%s"'
+                                   % path)
+    # - only the user may connect: requests run commands as the daemon
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, RequestHandler)
+    except OSError as err:
+        raise error.SetupError('cannot listen on "%s": %s' % (path, err))
+    finally:
+        os.umask(old_umask)
+    server.options = options
+    return server
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ handler of one request from panzer-client """
+    # - frames are read from the socket directly, so do not buffer
+    rbufsize = 0
+
+    def handle(self):
+        """ convert document requested, sending back output and status """
+        connection = Connection(self.rfile, self.wfile)
+        try:
+            request = connection.receive()
+        except (error.ProtocolError, ValueError):
+            return
+        status = convert(request, connection)
+        # - restore daemon's own logging
+        info.start_logger(self.server.options)
+        connection.send(exit=status)
+        info.log('DEBUG', 'panzer', 'request done with status %d' % status)
+
+def convert(request, connection):
+    """ return exit status of running panzer on request
+
+    panzer runs in the client's working directory and environment, with
+    stdin, stdout and stderr connected to the client. Requests are served
+    one at a time, so panzer is not let watch or wait for the user.
+    """
+    saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+    saved_cwd = os.getcwd()
+    saved_environment = dict(os.environ)
+    try:
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['environment'])
+        sys.stdin = ClientStdin(connection)
+        sys.stdout = ClientStream(connection, 'stdout')
+        sys.stderr = ClientStream(connection, 'stderr')
+        return panzer.run(request['arguments'], warm_styledef,
+                          interactive=False)
+    except SystemExit as err:
+        # - argparse exits on ---help, ---version and bad arguments
+        return err.code if isinstance(err.code, int) else 1
+    except Exception as err:        # pylint: disable=W0703
+        # - the daemon must keep running whatever the request
+        # disable pylint warnings:
+        #     + Catching too general exception
+        print('panzer-daemon: %r' % err, file=sys.stderr)
+        return 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved_streams
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        os.chdir(saved_cwd)
+
+def warm_styledef(options):
+    """ return style definitions for options, loading them if changed """
+    key = load.styledef_key(options)
+    signature = styles_signature(options)
+    if key in STYLEDEFS and STYLEDEFS[key][0] == signature:
+        info.log('DEBUG', 'panzer', 'reusing loaded style definitions')
+        return STYLEDEFS[key][1]
+    if key in STYLEDEFS:
+        info.log('INFO', 'panzer', 'styles files changed, loading again')
+    STYLEDEFS[key] = (signature, load.load_styledef(options))
+    return STYLEDEFS[key][1]
+
+def styles_signature(options):
+    """ return list of (filename, modification time, size) of styles files """
+    signature = list()
+    for filename in load.styles_files(options):
+        try:
+            status = os.stat(filename)
+        except OSError:
+            continue
+        signature.append((filename, status.st_mtime_ns, status.st_size))
+    return signature
+
+class Connection(object):
+    """ connection to a client, to which any thread may send
+    - rfile : stream read from client
+    - wfile : stream written to client
+    - lock  : held while a frame is sent
+    - open  : False once client has gone
+    """
+    def __init__(self, rfile, wfile):
+        """ new connection on streams """
+        self.rfile = rfile
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.open = True
+
+    def send(self, **message):
+        """ send message to client, dropping it if client has gone """
+        body = json.dumps(message).encode(const.ENCODING)
+        with self.lock:
+            if not self.open:
+                return
+            try:
+                resident.write_frame(self.wfile, body)
+            except OSError:
+                # - finish conversion, but without output
+                self.open = False
+
+    def receive(self):
+        """ return message read from client """
+        return json.loads(resident.read_frame(self.rfile)
+                          .decode(const.ENCODING))
+
+class ClientStream(object):
+    """ stand-in for sys.stdout or sys.stderr that writes to client """
+    def __init__(self, connection, name):
+        """ new stream sending data as frames of kind name """
+        self.connection = connection
+        self.name = name
+        self.buffer = self
+
+    def write(self, data):
+        """ send data, encoding it if text """
+        if isinstance(data, str):
+            data = data.encode(const.ENCODING)
+        self.connection.send(**{self.name: client.encode(data)})
+        return len(data)
+
+    def flush(self):
+        """ nothing to flush """
+        pass
+
+class ClientStdin(object):
+    """ stand-in for sys.stdin that reads client's stdin when asked """
+    def __init__(self, connection):
+        """ new stream reading from connection """
+        self.connection = connection
+        self.buffer = self
+
+    def read(self):
+        """ return all of client's stdin """
+        self.connection.send(stdin=True)
+        try:
+            reply = self.connection.receive()
+        except (error.ProtocolError, ValueError):
+            return bytes()
+        return base64.b64decode(reply.get('stdin', str()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+""" dependency manifests of outputs, used by ---incremental
+
+After an output is written without errors, its manifest is kept in the
+cache. It records what the output was made from:
+
+- files   : source documents, styles files, template and executables on
+            the run list, each as [modification time, size, hash]
+- styles  : list of styles files read
+- output  : [modification time, size] of the output
+- pandoc  : `cache.pandoc_key` of pandoc
+- panzer  : version of panzer
+- cwd     : working directory
+- options : options that can change the output
+
+The output is up to date if none of these have changed. A file whose
+modification time or size has changed, but whose contents have not, does
+not count as changed.
+"""
+import json
+import os
+import shutil
+from . import cache
+from . import const
+from . import info
+from . import load
+from . import version
+
+def up_to_date(options):
+    """ return True if output of options is as its manifest records """
+    if not usable(options):
+        return False
+    manifest = cache.read(options, 'depends', output_key(options))
+    if manifest is None:
+        info.log('DEBUG', 'panzer', 'no record of making output')
+        return False
+    changed = None
+    if manifest.get('panzer') != version.VERSION:
+        changed = 'panzer'
+    elif manifest.get('pandoc') != cache.pandoc_key():
+        changed = 'pandoc'
+    elif manifest.get('cwd') != os.getcwd():
+        changed = 'working directory'
+    elif manifest.get('options') != output_options(options):
+        changed = 'options'
+    elif manifest.get('output') != file_status(options['pandoc']['output']):
+        changed = 'output'
+    elif manifest.get('styles') != load.styles_files(options):
+        changed = 'styles files'
+    else:
+        for filename, record in sorted(manifest.get('files', dict()).items()):
+            if not same_file(filename, record):
+                changed = '"%s"' % info.pretty_path(filename)
+                break
+    if changed:
+        info.log('DEBUG', 'panzer', '%s changed since output was made'
+                 % changed)
+        return False
+    return True
+
+def record(doc):
+    """ keep manifest of output just made from doc """
+    if not usable(doc.options):
+        return
+    files = dict()
+    for filenames in dependencies(doc.options, doc).values():
+        for filename in filenames:
+            files[os.path.abspath(filename)] = file_record(filename)
+    manifest = {'files'   : files,
+                'styles'  : load.styles_files(doc.options),
+                'output'  : file_status(doc.options['pandoc']['output']),
+                'pandoc'  : cache.pandoc_key(),
+                'panzer'  : version.VERSION,
+                'cwd'     : os.getcwd(),
+                'options' : output_options(doc.options)}
+    cache.write(doc.options, 'depends', output_key(doc.options), manifest)
+    cache.trim(doc.options, 'depends', const.DEPENDS_MAX_ENTRIES)
+
+def dependencies(options, doc=None):
+    """ return dict of kinds of files to lists of files output depends on
+
+    Kinds are 'source', 'styles', 'template' and 'executables'. The
+    template and executables are those of doc, once its styles are applied.
+    """
+    files = {'source'      : list(options['pandoc']['input']),
+             'styles'      : load.styles_files(options),
+             'template'    : list(),
+             'executables' : list()}
+    if doc is None:
+        return files
+    template = options['pandoc']['template'] or doc.template
+    if template:
+        files['template'].append(template)
+    for entry in doc.runlist:
+        files['executables'].append(executable_path(entry['command']))
+    return files
+
+def forget(options):
+    """ remove manifest of output, so that it is made again next time """
+    if usable(options):
+        cache.remove(options, 'depends', output_key(options))
+
+def usable(options):
+    """ return True if output of options can be checked with a manifest """
+    if options['pandoc']['output'] == '-' \
+    or options['panzer']['stdin_temp_file'] \
+    or not options['pandoc']['input']:
+        info.log('DEBUG', 'panzer', 'cannot check whether output is up to '
+                 'date when reading stdin or writing stdout')
+        return False
+    return True
+
+def output_key(options):
+    """ return cache key of manifest of output """
+    path = os.path.abspath(options['pandoc']['output'])
+    return cache.hash_bytes(path.encode(const.ENCODING))
+
+def output_options(options):
+    """ return json string of options that can change the output """
+    relevant = {'panzer': {key: options['panzer'][key]
+                           for key in options['panzer']
+                           if key not in const.DEPENDS_IGNORED_OPTIONS},
+                'pandoc': options['pandoc']}
+    return json.dumps(relevant, sort_keys=True)
+
+def executable_path(command):
+    """ return path of executable command, looked up on PATH if needed """
+    if os.path.exists(command):
+        return command
+    return shutil.which(command) or command
+
+def file_status(filename):
+    """ return [modification time, size] of filename, or None if missing """
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return None
+    return [status.st_mtime_ns, status.st_size]
+
+def file_record(filename):
+    """ return [modification time, size, hash] of filename, or None """
+    status = file_status(filename)
+    if status is None:
+        return None
+    try:
+        return status + [cache.hash_file(filename)]
+    except OSError:
+        return None
+
+def same_file(filename, old_record):
+    """ return True if filename has contents recorded in old_record """
+    status = file_status(filename)
+    if status is None or old_record is None:
+        return status is None and old_record is None
+    if status == old_record[:2]:
+        return True
+    try:
+        return cache.hash_file(filename) == old_record[2]
+    except OSError:
+        return False
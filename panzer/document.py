@@ -1,15 +1,46 @@
 """ panzer document class and its methods """
+import asyncio
+import collections
+import contextlib
+import copy
+import importlib.util
+import io
 import json
 import os
 import pandocfilters
+import shutil
 import subprocess
 import sys
+import threading
+from . import cache
 from . import error
 from . import meta
+from . import resident
+from . import styleindex
 from . import util
+from . import yamlmeta
 from . import info
 from . import const
 
+# outcomes of applying styles, shared by documents in this process
+# - keys are json strings of styles, definitions, writer, search paths
+# - values are (metadata, template), whose metadata must not be changed
+STYLE_OUTCOMES = collections.OrderedDict()
+
+# held while STYLE_OUTCOMES is read or changed
+STYLE_OUTCOMES_LOCK = threading.Lock()
+
+# python filters imported into this process
+# - keys are paths, values are (modification time, module)
+PYTHON_FILTERS = dict()
+
+# held while a python filter is imported, not while it runs: filters run
+# at the same time, each in a thread whose stdout and stderr are redirected
+PYTHON_FILTERS_LOCK = threading.Lock()
+
+# held while a thread's stdout or stderr is redirected
+REDIRECT_LOCK = threading.Lock()
+
 class Document(object):
     """ representation of pandoc/panzer documents
     - ast       : pandoc abstract syntax tree of document
@@ -20,6 +51,9 @@ class Document(object):
     - options   : cli options for document
     - template  : template for document
     - output    : string filled with output when processing complete
+    - version   : number increased whenever the document's data changes
+    - processes : asyncio semaphore, a slot of which is held by each
+                  external process run for the document
     """
     #
     # disable pylint warnings:
@@ -29,7 +63,7 @@ class Document(object):
     def __init__(self):
         """ new blank document """
         # - defaults
-        self.ast = const.EMPTY_DOCUMENT
+        self.ast = copy.deepcopy(const.EMPTY_DOCUMENT)
         self.style = list()
         self.stylefull = list()
         self.styledef = dict()
@@ -39,6 +73,16 @@ class Document(object):
                 'panzer_support'  : const.DEFAULT_SUPPORT_DIR,
                 'debug'           : str(),
                 'silent'          : False,
+                'plain_styledef'  : False,
+                'cache_ast'       : False,
+                'incremental'     : False,
+                'watch'           : False,
+                'stream'          : False,
+                'parallel'        : list(),
+                'jobs'            : const.DEFAULT_JOBS,
+                'deadline'        : 0,
+                'deadline_time'   : 0,
+                'stderr_lines'    : const.STDERR_MAX_LINES,
                 'stdin_temp_file' : str()
             },
             'pandoc': {
@@ -54,6 +98,13 @@ class Document(object):
         }
         self.template = None
         self.output = None
+        # - True once pandoc could not be run or exited with an error
+        self.pandoc_failed = False
+        self.version = 0
+        # - (version, head, tail) of last json message built
+        self.message_parts = None
+        # - set when conversion starts, inside its event loop
+        self.processes = None
 
     def populate(self, ast, global_styledef):
         """ populate document with data """
@@ -75,24 +126,32 @@ class Document(object):
             pass
         # - set self.styledef
         self.populate_styledef(global_styledef)
-        # - set self.style and self.stylefull
-        self.populate_style()
-        # - remove any styledef not used in doc
-        self.styledef = {key: self.styledef[key]
-                         for key in self.styledef
-                         if key in self.stylefull}
+        try:
+            # - set self.style and self.stylefull
+            self.populate_style()
+        finally:
+            # - keep only styledefs used in doc
+            # -- others are never looked up, and so never decoded
+            self.styledef = {key: self.styledef[key]
+                             for key in self.stylefull
+                             if key in self.styledef}
+            self.version += 1
 
     def populate_styledef(self, global_styledef):
-        """ populate self.styledef applying global_styledef defaults """
+        """ populate self.styledef applying global_styledef defaults
+
+        Local definitions are layered over global ones without copying
+        either: a global definition is only decoded if it is looked up.
+        """
         info.log('INFO', 'panzer', info.pretty_title('style definitions'))
         # - add global style definitions
         if global_styledef:
             info.log('INFO', 'panzer', 'global:')
-            for line in info.pretty_keys(global_styledef):
-                info.log('INFO', 'panzer', '  ' + line)
-            self.styledef = dict(global_styledef)
+            info.log('INFO', 'panzer', '  %d definitions loaded'
+                     % len(global_styledef))
         else:
             info.log('INFO', 'panzer', 'no global definitions loaded')
+            global_styledef = dict()
         # - add local style definitions in doc
         local_styledef = dict()
         try:
@@ -107,11 +166,15 @@ class Document(object):
             for key in overridden:
                 info.log('INFO', 'panzer',
                          'local definition "%s" overrides global' % key)
-            (self.styledef).update(local_styledef)
         except error.MissingField as err:
             info.log('DEBUG', 'panzer', err)
         except error.WrongType as err:
             info.log('ERROR', 'panzer', err)
+        if local_styledef:
+            self.styledef = collections.ChainMap(local_styledef,
+                                                 global_styledef)
+        else:
+            self.styledef = global_styledef
 
     def populate_style(self):
         """ populate self.style and stylefull, expanding style hierarchy """
@@ -129,7 +192,13 @@ class Document(object):
         info.log('INFO', 'panzer', 'style:')
         info.log('INFO', 'panzer', info.pretty_list(self.style))
         # - expand the style hierarchy
-        self.stylefull = meta.expand_style_hierarchy(self.style, self.styledef)
+        # -- reuse expansions stored on global styledef if no local ones
+        memo = None
+        if isinstance(self.styledef, styleindex.StyleIndex):
+            memo = self.styledef.linear
+        self.stylefull = meta.expand_style_hierarchy(self.style,
+                                                     self.styledef,
+                                                     memo)
         info.log('INFO', 'panzer', 'full hierarchy:')
         info.log('INFO', 'panzer', info.pretty_list(self.stylefull))
 
@@ -188,20 +257,33 @@ class Document(object):
 
     def json_message(self):
         """ return json message to pass to executables
-            and inject json message into `panzer_reserved` field """
+            and inject json message into `panzer_reserved` field
+
+        Everything except the runlist is serialized once for each version of
+        the document. Only the runlist, whose status fields change as each
+        executable runs, is serialized on every call.
+        """
         metadata = self.get_metadata()
-        # - delete old 'panzer_reserved' key
-        if 'panzer_reserved' in metadata:
-            del metadata['panzer_reserved']
+        # - rebuild serialized data if document has changed
+        if not self.message_parts or self.message_parts[0] != self.version:
+            # -- leave out old 'panzer_reserved' key
+            message_metadata = {key: metadata[key]
+                                for key in metadata
+                                if key != 'panzer_reserved'}
+            head = ('[{"metadata": %s, "template": %s, "style": %s, '
+                    '"stylefull": %s, "styledef": %s, "runlist": '
+                    % (json.dumps(message_metadata),
+                       json.dumps(self.template),
+                       json.dumps(self.style),
+                       json.dumps(self.stylefull),
+                       json.dumps(self.styledef)))
+            tail = ', "options": %s}]' % json.dumps(self.options)
+            self.message_parts = (self.version, head, tail)
         # - build new json_message
-        data = [{'metadata':  metadata,
-                 'template':  self.template,
-                 'style':     self.style,
-                 'stylefull': self.stylefull,
-                 'styledef':  self.styledef,
-                 'runlist':   self.runlist,
-                 'options':   self.options}]
-        json_message = json.dumps(data)
+        # -- same as json.dumps of list with a dict of the fields above
+        json_message = (self.message_parts[1]
+                        + json.dumps(self.runlist)
+                        + self.message_parts[2])
         # - inject into metadata
         content = [{"t": "CodeBlock",
                     "c": [["", [], []], json_message]}]
@@ -210,17 +292,26 @@ class Document(object):
         # - return json_message
         return json_message
 
+    def cache_context(self):
+        """ return json string of what cached filter outputs depend on
+
+        These are the parts of the json message that stay the same from one
+        run to the next: the writer and the styles applied.
+        """
+        return json.dumps([self.options['pandoc']['write'],
+                           self.template,
+                           self.style,
+                           self.stylefull])
+
     def purge_style_fields(self):
         """ remove metadata fields specific to panzer """
-        kill_list = const.RUNLIST_KIND
-        kill_list += ['style']
-        kill_list += ['styledef']
-        kill_list += ['template']
+        kill_list = const.RUNLIST_KIND + ['style', 'styledef', 'template']
         metadata = self.get_metadata()
         new_metadata = {key: metadata[key]
                         for key in metadata
                         if key not in kill_list}
         self.set_metadata(new_metadata)
+        self.version += 1
 
     def get_metadata(self):
         """ return metadata of ast """
@@ -239,6 +330,116 @@ class Document(object):
         info.log('INFO', 'panzer', 'writer:')
         info.log('INFO', 'panzer', '  %s' % writer)
         # 1. Do transform
+        # - start with metadata of styles merged for writer
+        new_metadata, style_template = self.style_outcome(writer)
+        # - add local metadata in document
+        local_data = self.get_metadata()
+        # -- add items from additive fields in local metadata
+        new_metadata = meta.update_additive_lists(new_metadata, local_data)
+        # -- add all other (non-additive) fields in
+        local_lists = list()
+        for key in local_data:
+            if key in const.RUNLIST_KIND:
+                local_lists.append(key)
+            else:
+                new_metadata[key] = local_data[key]
+        # 2. Apply kill rules to trim lists
+        # - lists from styles alone are already trimmed
+        meta.trim_runlists(new_metadata, local_lists)
+        # 3. Set template
+        # - template from styles already resolved
+        if 'template' in local_data:
+            self.template = self.resolve_template(new_metadata)
+        else:
+            self.template = style_template
+        if self.template:
+
+            info.log('INFO', 'panzer', info.pretty_title('template'))
+            info.log('INFO', 'panzer', '  %s' % info.pretty_path(self.template))
+        # 4. Update document
+        self.set_metadata(new_metadata)
+        self.version += 1
+
+    def direct_options(self, front, global_styledef):
+        """ return options for pandoc to apply styles to source directly
+
+        front is the raw metadata of the source documents. Styles are
+        applied to a document holding only their 'style' field. If no
+        filter or script then needs the ast, and each field set by styles
+        can be given to pandoc as a string, returns '--metadata' options
+        setting those fields. Otherwise returns None.
+        """
+        if not self.may_run_directly(front):
+            return None
+        panzer_fields = const.RUNLIST_KIND + ['style', 'styledef', 'template']
+        stub = dict()
+        if 'style' in front:
+            stub['style'] = yamlmeta.to_meta(front['style'], list(), False)
+        self.populate([{'unMeta': stub}, []], global_styledef)
+        self.transform()
+        metadata = self.get_metadata()
+        for kind in const.RUNLIST_KIND:
+            if kind in metadata and kind != 'postprocess':
+                return None
+        options = list()
+        for key in sorted(metadata):
+            if key in panzer_fields or key in front:
+                continue
+            option = metadata_option(key, metadata[key])
+            if option is None:
+                info.log('DEBUG', 'panzer', 'cannot give field "%s" to '
+                         'pandoc---reading source into ast' % key)
+                return None
+            options += ['--metadata', option]
+        if 'style' in front:
+            # - as if removed by `purge_style_fields`: pandoc's templates
+            # - treat a false field as one not set
+            options += ['--metadata', 'style=false']
+        return options
+
+    def may_run_directly(self, front):
+        """ return False if pandoc cannot read source directly, whatever styles
+
+        front is as for `direct_options`, which also needs the styles to
+        decide. This needs only the document and options.
+        """
+        if self.options['pandoc']['filter']:
+            return False
+        # - fields of document that need panzer to read its ast
+        if front.keys() & set(const.RUNLIST_KIND
+                              + ['styledef', 'template', 'panzer_reserved']):
+            return False
+        # - the 'style' field can only be hidden from templates
+        writer = self.options['pandoc']['write']
+        if 'style' in front \
+        and writer.split('+')[0].split('-')[0] in const.METADATA_WRITERS:
+            return False
+        return True
+
+    def style_outcome(self, writer):
+        """ return (metadata, template) from applying styles for writer
+
+        Runlists in metadata are trimmed by kill rules and template is
+        resolved to a path. The outcome depends only on the styles applied,
+        their definitions, writer, and where templates are searched for, so
+        it is kept in STYLE_OUTCOMES and reused for documents that match.
+        """
+        key = json.dumps([self.stylefull,
+                          self.styledef,
+                          writer,
+                          os.getcwd(),
+                          self.options['panzer']['panzer_support']],
+                         sort_keys=True)
+        with STYLE_OUTCOMES_LOCK:
+            outcome = STYLE_OUTCOMES.get(key)
+            if outcome is not None:
+                STYLE_OUTCOMES.move_to_end(key)
+        # - template file may have been moved since
+        if outcome is not None \
+        and (not outcome[1] or os.path.exists(outcome[1])):
+            info.log('DEBUG', 'panzer', 'reusing outcome of styles')
+            # - values are shared, never changed in place; copy top level
+            return dict(outcome[0]), outcome[1]
         # - start with blank metadata
         new_metadata = dict()
         # - add styles one by one
@@ -253,56 +454,35 @@ class Document(object):
                                                     self.styledef,
                                                     [style, writer],
                                                     'MetaMap'))
-        # - add local metadata in document
-        local_data = self.get_metadata()
-        # -- add items from additive fields in local metadata
-        new_metadata = meta.update_additive_lists(new_metadata, local_data)
-        # -- delete those fields
-        local_data = {key: local_data[key]
-                      for key in local_data
-                      if key not in const.RUNLIST_KIND}
-        # -- add all other (non-additive) fields in
-        new_metadata.update(local_data)
-        # 2. Apply kill rules to trim lists
-        for field in const.RUNLIST_KIND:
-            try:
-                original_list = meta.get_content(new_metadata,
-                                                 field, 'MetaList')
-                trimmed_list = meta.apply_kill_rules(original_list)
-                if trimmed_list:
-                    meta.set_content(new_metadata, field,
-                                     trimmed_list, 'MetaList')
-                else:
-                    # if all items killed, delete field
-                    del new_metadata[field]
-            except error.MissingField:
-                continue
-            except error.WrongType as err:
-                info.log('WARNING', 'panzer', err)
-                continue
-        # 3. Set template
+        meta.trim_runlists(new_metadata, const.RUNLIST_KIND)
+        template = self.resolve_template(new_metadata)
+        with STYLE_OUTCOMES_LOCK:
+            STYLE_OUTCOMES[key] = (new_metadata, template)
+            while len(STYLE_OUTCOMES) > const.STYLE_OUTCOMES_SIZE:
+                STYLE_OUTCOMES.popitem(last=False)
+        return dict(new_metadata), template
+
+    def resolve_template(self, metadata):
+        """ return path to template in metadata, or None if not set """
         try:
-            template_raw = meta.get_content(new_metadata, 'template',
+            template_raw = meta.get_content(metadata, 'template',
                                             'MetaInlines')
             template_str = pandocfilters.stringify(template_raw)
-            self.template = util.resolve_path(template_str, 'template',
-                                              self.options)
+            return util.resolve_path(template_str, 'template', self.options)
         except (error.MissingField, error.WrongType) as err:
             info.log('DEBUG', 'panzer', err)
-        if self.template:
-
-            info.log('INFO', 'panzer', info.pretty_title('template'))
-            info.log('INFO', 'panzer', '  %s' % info.pretty_path(self.template))
-        # 4. Update document
-        self.set_metadata(new_metadata)
+            return None
 
-    def run_scripts(self, kind, do_not_stop=False):
+    async def run_scripts(self, kind, do_not_stop=False):
         """ execute commands of kind listed in runlist """
         # - check if no run list to run
         to_run = [entry for entry in self.runlist if entry['kind'] == kind]
         if not to_run:
             return
         info.log('INFO', 'panzer', info.pretty_title(kind))
+        if kind in self.options['panzer']['parallel']:
+            await self.run_scripts_parallel(kind, do_not_stop)
+            return
         # - maximum number of executables to run
         for i, entry in enumerate(self.runlist):
             # - skip entries that are not of the right kind
@@ -317,21 +497,15 @@ class Document(object):
                                                ' '.join(command)))
             info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
             # - run the command
-            stderr = str()
             try:
                 entry['status'] = const.RUNNING
-                process = subprocess.Popen(command,
-                                           stdin=subprocess.PIPE,
-                                           stderr=subprocess.PIPE)
                 # send panzer's json message to scripts via stdin
                 in_pipe = self.json_message()
                 in_pipe_bytes = in_pipe.encode(const.ENCODING)
-                stderr_bytes = process.communicate(input=in_pipe_bytes)[1]
+                write_stdout(await run_script(entry, self.options,
+                                              in_pipe_bytes, self.processes))
                 entry['status'] = const.DONE
-                stderr = stderr_bytes.decode(const.ENCODING)
-                if stderr:
-                    entry['stderr'] = info.decode_stderr_json(stderr)
-            except OSError as err:
+            except (OSError, error.LimitError) as err:
                 entry['status'] = const.FAILED
                 info.log('ERROR', filename, err)
                 continue
@@ -345,18 +519,113 @@ class Document(object):
                     continue
                 else:
                     raise
-            finally:
-                info.log_stderr(stderr, filename)
 
-    def pipe_through(self, kind):
-        """ pipe through external command listed in runlist """
+    async def run_scripts_parallel(self, kind, do_not_stop=False):
+        """ execute commands of kind listed in runlist at the same time
+
+        Up to options['panzer']['jobs'] commands run at once. A command
+        whose entry has an 'after' field waits until the earlier commands
+        it names have finished. Messages, and then any error, of each
+        command are logged once all commands have finished, in runlist
+        order, so that the log is the same whichever finishes first. So is
+        what each command writes to stdout.
+        """
+        entries = [i for i, entry in enumerate(self.runlist)
+                   if entry['kind'] == kind]
+        waits_for = self.script_dependencies(entries)
+        tasks = dict()
+        logs = {i: info.Log() for i in entries}
+        outputs = dict()
+        async def run_entry(i):
+            """ run entry i of runlist once those it waits for finish """
+            if waits_for[i]:
+                await asyncio.wait([tasks[j] for j in waits_for[i]])
+            entry = self.runlist[i]
+            command = [entry['command']] + entry['arguments']
+            info.log('INFO', 'panzer',
+                     info.pretty_runlist_entry(i,
+                                               len(self.runlist),
+                                               ' '.join(command)))
+            info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
+            entry['status'] = const.RUNNING
+            # send panzer's json message to scripts via stdin
+            in_pipe_bytes = self.json_message().encode(const.ENCODING)
+            try:
+                outputs[i] = await run_script(entry, self.options,
+                                              in_pipe_bytes, self.processes)
+            except Exception:
+                entry['status'] = const.FAILED
+                raise
+            entry['status'] = const.DONE
+        # - entries only wait for earlier entries, whose tasks exist
+        for i in entries:
+            tasks[i] = asyncio.ensure_future(info.keep_log_of(run_entry(i),
+                                                              logs[i]))
+        await asyncio.wait(tasks.values())
+        # - report messages and errors in runlist order
+        first_error = None
+        for i in entries:
+            entry = self.runlist[i]
+            filename = os.path.basename(entry['command'])
+            logs[i].replay()
+            write_stdout(outputs.get(i))
+            try:
+                tasks[i].result()
+            except (OSError, error.LimitError) as err:
+                info.log('ERROR', filename, err)
+            except Exception as err:        # pylint: disable=W0703
+                # disable pylint warnings:
+                #     + Catching too general exception
+                info.log('ERROR', filename, err)
+                if not first_error:
+                    first_error = err
+        if first_error and not do_not_stop:
+            raise first_error
+
+    def script_dependencies(self, entries):
+        """ return dict of runlist index to indices of entries it waits for
+
+        Names in an entry's 'after' field are matched against the command
+        of earlier entries in entries, with or without file extension.
+        """
+        waits_for = dict()
+        for position, i in enumerate(entries):
+            waits_for[i] = set()
+            for name in self.runlist[i].get('after', list()):
+                matches = set()
+                for j in entries[:position]:
+                    basename = os.path.basename(self.runlist[j]['command'])
+                    if name in [basename, os.path.splitext(basename)[0],
+                                self.runlist[j]['command']]:
+                        matches.add(j)
+                if not matches:
+                    info.log('WARNING', 'panzer',
+                             '"%s" waits for "%s", which is not an earlier '
+                             '%s---ignoring it'
+                             % (self.runlist[i]['command'], name,
+                                self.runlist[i]['kind']))
+                waits_for[i] |= matches
+        return waits_for
+
+    async def pipe_through(self, kind):
+        """ pipe through external command listed in runlist
+
+        Filters whose entry sets 'inprocess' are python modules run inside
+        panzer on the ast itself. Filters whose entry sets 'resident' are
+        kept running and sent requests (see resident.py). The ast is only
+        serialized to json, or parsed from it, when a filter needs it. With
+        ---stream, other commands next to each other are run as a pipeline.
+        """
         to_run = [entry for entry in self.runlist if entry['kind'] == kind]
         if not to_run:
             return
         info.log('INFO', 'panzer', info.pretty_title(kind))
         # 1. Set up incoming pipe
         if kind == 'filter':
-            in_pipe = json.dumps(self.ast)
+            # - filters see json message injected into ast here
+            self.json_message()
+            # - serialized when first needed by an external filter
+            in_pipe = self.ast
         elif kind == 'postprocess':
             in_pipe = self.output
         else:
@@ -365,9 +634,25 @@ class Document(object):
         # 2. Set up outgoing pipe in case of failure
         out_pipe = in_pipe
         # 3. Run commands
+        # - with ---stream, consecutive external commands are collected
+        # - into one pipeline that is run when a different command is met
+        stream = list()
+        # - ast before the current run of consecutive inprocess filters, as
+        # - json, and entries of that run done so far; filters of a run
+        # - change one ast in place, which goes back to snapshot if one fails
+        snapshot = None
+        done_in_run = list()
         for i, entry in enumerate(self.runlist):
             if entry['kind'] != kind:
                 continue
+            if not (kind == 'filter' and entry.get('inprocess')):
+                snapshot = None
+            if self.options['panzer']['stream'] and streamable(entry):
+                stream.append((i, entry))
+                continue
+            if stream:
+                in_pipe = out_pipe = await self.run_stream(stream, in_pipe)
+                stream = list()
             # - add debugging info
             command = [entry['command']] + entry['arguments']
             filename = os.path.basename(command[0])
@@ -377,36 +662,149 @@ class Document(object):
                                                ' '.join(command)))
             info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
             # - run the command and log any errors
+            # -- stderr returned by filters run without a process
+            # -- messages kept from stderr
             stderr = str()
+            messages = list()
+            max_lines = self.options['panzer']['stderr_lines']
             try:
                 entry['status'] = const.RUNNING
-                self.json_message()
-                process = subprocess.Popen(command,
-                                           stderr=subprocess.PIPE,
-                                           stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE)
-                in_pipe_bytes = in_pipe.encode(const.ENCODING)
-                out_pipe_bytes, stderr_bytes = \
-                    process.communicate(input=in_pipe_bytes)
-                entry['status'] = const.DONE
-                out_pipe = out_pipe_bytes.decode(const.ENCODING)
-                stderr = stderr_bytes.decode(const.ENCODING)
+                timeout = util.entry_timeout(entry, self.options)
+                # - reuse output of cacheable filter run on same input
+                key = None
+                cached = None
+                if kind == 'filter' and entry.get('cacheable'):
+                    source, reserved = without_reserved(in_pipe)
+                    key = filter_cache_key(entry, self.cache_context(),
+                                           source)
+                    if key:
+                        cached = cache.read(self.options, 'filter', key)
+                if cached is not None:
+                    info.log('DEBUG', 'panzer', 'reuse cached output of "%s"'
+                             % filename)
+                    # - cached without the json message, so add this run's
+                    out_pipe = with_reserved(cached['ast'], reserved)
+                    stderr = cached['stderr']
+                    snapshot = None
+                elif kind == 'filter' and entry.get('inprocess'):
+                    if snapshot is None:
+                        # - first of a run: keep ast to go back to, and give
+                        # - the filters their own; metadata values of
+                        # - self.ast are shared with STYLE_OUTCOMES and the
+                        # - style index, its blocks are only the document's
+                        if isinstance(in_pipe, str):
+                            snapshot = in_pipe
+                            in_pipe = json.loads(in_pipe)
+                        else:
+                            snapshot = json.dumps(in_pipe)
+                            if in_pipe is self.ast:
+                                in_pipe = ([copy.deepcopy(in_pipe[0])]
+                                           + in_pipe[1:])
+                        done_in_run = list()
+                    ast = in_pipe
+                    # - run without the event loop, as other conversions
+                    # - and stderr logs share it
+                    # - a thread cannot be killed, so one that times out is
+                    # - left to finish on its own, its output thrown away
+                    async with self.processes:
+                        try:
+                            out_pipe, stderr = await asyncio.wait_for(
+                                util.in_daemon_thread(run_python_filter,
+                                                      entry['command'],
+                                                      ast,
+                                                      entry['arguments']),
+                                timeout)
+                        except asyncio.TimeoutError:
+                            raise error.LimitError('timed out after %.1f '
+                                                   'seconds' % timeout)
+                elif kind == 'filter' and entry.get('resident'):
+                    # - requests are sent and read without the event loop
+                    async with self.processes:
+                        out_pipe, stderr = await util.in_thread(
+                            resident.run,
+                            entry['command'],
+                            in_pipe,
+                            entry['arguments'],
+                            self.json_message(),
+                            util.environment(self.options),
+                            timeout or const.RESIDENT_TIMEOUT)
+                else:
+                    if kind == 'filter' and not isinstance(in_pipe, str):
+                        in_pipe = json.dumps(in_pipe)
+                    limits = entry.get('limits')
+                    async with self.processes:
+                        process = await util.start_process(
+                            command,
+                            limits,
+                            group=timeout is not None,
+                            env=util.environment(self.options),
+                            stderr=subprocess.PIPE,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+                        stderr_log = util.drain_stderr(process, filename,
+                                                       max_lines)
+                        in_pipe_bytes = in_pipe.encode(const.ENCODING)
+                        try:
+                            out_pipe_bytes = (await util.finish_process(
+                                process,
+                                in_pipe_bytes,
+                                timeout,
+                                limits,
+                                stderr_log))[0]
+                        finally:
+                            messages = await stderr_log.join()
+                    out_pipe = out_pipe_bytes.decode(const.ENCODING)
                 if stderr:
-                    entry['stderr'] = info.decode_stderr_json(stderr)
+                    messages = info.decode_stderr_json(stderr)
+                    messages = messages[max(0, len(messages) - max_lines):]
+                if key and cached is None:
+                    if isinstance(out_pipe, str):
+                        out_pipe = json.loads(out_pipe)
+                    cached_stderr = stderr or info.encode_stderr_json(messages)
+                    cache.write(self.options, 'filter', key,
+                                {'ast': without_reserved(out_pipe)[0],
+                                 'stderr': cached_stderr})
+                    cache.trim(self.options, 'filter',
+                               const.FILTER_CACHE_MAX_ENTRIES,
+                               const.FILTER_CACHE_MAX_BYTES)
+                entry['status'] = const.DONE
+                if snapshot is not None:
+                    done_in_run.append(filename)
                 in_pipe = out_pipe
-            except OSError as err:
+            except (OSError, error.FilterError, error.LimitError) as err:
                 entry['status'] = const.FAILED
                 info.log('ERROR', filename, err)
+                if snapshot is not None:
+                    # - failed inprocess filter may have changed the ast
+                    in_pipe = out_pipe = json.loads(snapshot)
+                    if done_in_run:
+                        info.log('WARNING', 'panzer',
+                                 'changes made by "%s" thrown away too'
+                                 % '", "'.join(done_in_run))
+                        done_in_run = list()
                 continue
+            except ValueError:
+                entry['status'] = const.FAILED
+                info.log('ERROR', 'panzer',
+                         'failed to receive json object from filters'
+                         '---ignoring all filters')
+                return
             except Exception:
                 entry['status'] = const.FAILED
                 raise
             finally:
+                if messages:
+                    entry['stderr'] = messages
                 info.log_stderr(stderr, filename)
+        if stream:
+            out_pipe = await self.run_stream(stream, in_pipe)
         # 4. Update document's data with output from commands
         if kind == 'filter':
             try:
-                self.ast = json.loads(out_pipe)
+                if isinstance(out_pipe, str):
+                    out_pipe = json.loads(out_pipe)
+                self.ast = out_pipe
+                self.version += 1
             except ValueError:
                 info.log('ERROR', 'panzer',
                          'failed to receive json object from filters'
@@ -415,18 +813,126 @@ class Document(object):
         elif kind == 'postprocess':
             self.output = out_pipe
 
-    def pandoc(self):
+    async def run_stream(self, stream, in_pipe):
+        """ return output of commands in stream run as one pipeline
+
+        stream is a list of (position in runlist, entry). Each command's
+        stdout is connected to the next command's stdin, as in a shell
+        pipeline, so the commands run at the same time and only the output
+        of the last is held in memory. Each command's stderr is read, and its
+        messages logged, as the commands run. The pipeline holds one slot of
+        self.processes.
+        """
+        if not isinstance(in_pipe, str):
+            in_pipe = json.dumps(in_pipe)
+        async with self.processes:
+            return await self.run_pipeline(stream, in_pipe)
+
+    async def run_pipeline(self, stream, in_pipe):
+        """ return output of commands in stream run on in_pipe """
+        # 1. Start commands, each reading from the one before
+        # - each command with a timeout has a timer to kill it
+        # - output of last command started is read from file descriptor
+        started = list()
+        stderr_logs = list()
+        timers = list()
+        out_fd = None
+        loop = asyncio.get_event_loop()
+        for i, entry in stream:
+            command = [entry['command']] + entry['arguments']
+            info.log('INFO', 'panzer',
+                     info.pretty_runlist_entry(i,
+                                               len(self.runlist),
+                                               ' '.join(command)))
+            info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
+            entry['status'] = const.RUNNING
+            stdin = subprocess.PIPE
+            if out_fd is not None:
+                stdin = out_fd
+            read_fd, write_fd = os.pipe()
+            try:
+                timeout = util.entry_timeout(entry, self.options)
+                process = await util.start_process(command,
+                                                   entry.get('limits'),
+                                                   group=timeout is not None,
+                                                   env=util.environment(
+                                                       self.options),
+                                                   stderr=subprocess.PIPE,
+                                                   stdin=stdin,
+                                                   stdout=write_fd)
+            except (OSError, error.LimitError) as err:
+                # - leave command out of pipeline
+                os.close(read_fd)
+                entry['status'] = const.FAILED
+                info.log('ERROR', os.path.basename(command[0]), err)
+                continue
+            finally:
+                os.close(write_fd)
+            if out_fd is not None:
+                # - only the next command reads this output now
+                os.close(out_fd)
+            out_fd = read_fd
+            started.append((entry, process))
+            stderr_logs.append(util.drain_stderr(
+                process,
+                os.path.basename(entry['command']),
+                self.options['panzer']['stderr_lines']))
+            if timeout is not None:
+                timers.append(loop.call_later(timeout, time_out,
+                                              entry, process, timeout))
+        if not started:
+            return in_pipe
+        # 2. Feed input to first command while output of last is read
+        in_pipe_bytes = in_pipe.encode(const.ENCODING)
+        feeder = asyncio.ensure_future(feed(started[0][1].stdin,
+                                            in_pipe_bytes))
+        out_pipe_bytes = await loop.run_in_executor(None, read_all, out_fd)
+        await feeder
+        for entry, process in started:
+            await process.wait()
+        for timer in timers:
+            timer.cancel()
+        # 3. Record how each command finished
+        for (entry, process), stderr_log in zip(started, stderr_logs):
+            messages = await stderr_log.join()
+            if messages:
+                entry['stderr'] = messages
+            filename = os.path.basename(entry['command'])
+            try:
+                if 'timed_out' in entry:
+                    raise error.LimitError('timed out after %.1f seconds'
+                                           % entry.pop('timed_out'))
+                util.check_limits(process, entry.get('limits'), messages)
+                entry['status'] = const.DONE
+            except error.LimitError as err:
+                entry['status'] = const.FAILED
+                info.log('ERROR', filename, err)
+        return out_pipe_bytes.decode(const.ENCODING)
+
+    async def pandoc(self, source_options=None):
         """ run pandoc on document
 
         Normally, input to pandoc is passed via stdin and output received via
         stout. Exception is when the output file has .pdf extension or a binary
         writer selected. Then, output is simply the binary file that panzer
         does not process further, and internal document not updated by pandoc.
+
+        If source_options is given, pandoc reads the source documents itself
+        instead of the ast, with source_options added to its options.
+
+        If pandoc cannot be run or exits with an error, this is logged and
+        self.pandoc_failed set.
         """
         # 1. Build pandoc command
         command = ['pandoc']
-        command += ['-']
-        command += ['--read', 'json']
+        if source_options is None:
+            command += ['-']
+            command += ['--read', 'json']
+        else:
+            command += self.options['pandoc']['input']
+            if self.options['pandoc']['read']:
+                command += ['--read', self.options['pandoc']['read']]
+            command += source_options
         command += ['--write', self.options['pandoc']['write']]
         if self.options['pandoc']['pdf_output'] \
         or self.options['pandoc']['write'] in const.BINARY_WRITERS:
@@ -441,11 +947,16 @@ class Document(object):
         # - remaining options
         command += self.options['pandoc']['options']
         # 2. Prefill input and output pipes
-        in_pipe = json.dumps(self.ast)
+        self.pandoc_failed = False
+        in_pipe = str()
+        if source_options is None:
+            in_pipe = json.dumps(self.ast)
         out_pipe = str()
-        stderr = str()
+        stderr_log = None
         # 3. Run pandoc command
         info.log('INFO', 'panzer', info.pretty_title('pandoc'))
+        if source_options is not None:
+            info.log('INFO', 'panzer', 'reading source document(s) directly')
         if self.options['pandoc']['options']:
             info.log('INFO', 'panzer', 'running with options:')
             info.log('INFO', 'panzer',
@@ -454,23 +965,37 @@ class Document(object):
         else:
             info.log('INFO', 'panzer', 'running')
         info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
+        await self.processes.acquire()
         try:
             info.time_stamp('ready to do popen')
-            process = subprocess.Popen(command,
-                                       stderr=subprocess.PIPE,
-                                       stdin=subprocess.PIPE,
-                                       stdout=subprocess.PIPE)
+            timeout = util.time_left(self.options)
+            process = await util.start_process(command,
+                                               group=timeout is not None,
+                                               stderr=subprocess.PIPE,
+                                               stdin=subprocess.PIPE,
+                                               stdout=subprocess.PIPE)
+            stderr_log = util.drain_stderr(
+                process,
+                str(),
+                self.options['panzer']['stderr_lines'])
             info.time_stamp('popen done')
             in_pipe_bytes = in_pipe.encode(const.ENCODING)
-            out_pipe_bytes, stderr_bytes = \
-                process.communicate(input=in_pipe_bytes)
+            out_pipe_bytes = (await util.finish_process(process,
+                                                        in_pipe_bytes,
+                                                        timeout))[0]
             info.time_stamp('communicate done')
             out_pipe = out_pipe_bytes.decode(const.ENCODING)
-            stderr = stderr_bytes.decode(const.ENCODING)
+            if process.returncode != 0:
+                self.pandoc_failed = True
+                info.log('ERROR', 'pandoc', 'failed with exit status %d'
+                         % process.returncode)
         except OSError as err:
+            self.pandoc_failed = True
             info.log('ERROR', 'pandoc', err)
         finally:
-            info.log_stderr(stderr)
+            if stderr_log:
+                await stderr_log.join()
+            self.processes.release()
         # 4. Deal with output of pandoc
         if self.options['pandoc']['pdf_output'] \
         or self.options['pandoc']['write'] in const.BINARY_WRITERS:
@@ -507,3 +1032,248 @@ class Document(object):
             info.log('INFO', 'panzer', 'output written to "%s"'
                      % self.options['pandoc']['output'])
 
+
+def metadata_option(key, value):
+    """ return 'KEY=VALUE' setting metadata field, or None if cannot
+
+    pandoc reads a value given on its command line as a string, or as a
+    boolean if it looks like one. Only booleans, and strings whose every
+    writer output is the same as the string, can be given this way.
+    """
+    if set(key) & set('=:'):
+        return None
+    if value[const.T] == 'MetaBool':
+        return '%s=%s' % (key, 'true' if value[const.C] else 'false')
+    if value[const.T] == 'MetaString':
+        text = value[const.C]
+    elif value[const.T] == 'MetaInlines' \
+    and all(item[const.T] in ('Str', 'Space') for item in value[const.C]):
+        text = pandocfilters.stringify(value[const.C])
+    else:
+        return None
+    if not text or not set(text) <= const.DIRECT_METADATA_CHARS \
+    or '--' in text or text != text.strip() \
+    or text.lower() in ('true', 'false', 'yes', 'no', 'on', 'off', 'y', 'n'):
+        return None
+    return '%s=%s' % (key, text)
+
+def streamable(entry):
+    """ return True if entry can be run as part of a pipeline """
+    if entry['kind'] != 'filter':
+        return True
+    return not any(entry.get(field)
+                   for field in ['inprocess', 'resident', 'cacheable'])
+
+def time_out(entry, process, timeout):
+    """ kill process of entry in pipeline that has run for timeout seconds """
+    if process.returncode is None:
+        entry['timed_out'] = timeout
+        util.kill_group(process)
+
+async def feed(stream, data):
+    """ write data to asyncio stream and close it """
+    # - command may exit without reading all its input
+    with contextlib.suppress(OSError):
+        stream.write(data)
+        await stream.drain()
+    with contextlib.suppress(OSError):
+        stream.close()
+
+def read_all(fd):
+    """ return all bytes read from file descriptor fd, then close it """
+    with open(fd, 'rb') as stream:
+        return stream.read()
+
+def filter_cache_key(entry, context, source):
+    """ return cache key for output of filter entry run on source
+
+    source is the ast without its json message, which holds values that
+    change on every run, such as ---deadline's time; context stands for the
+    parts of the message that a filter may rely on. The key covers the
+    contents of the filter's executable, so editing the filter invalidates
+    its cached outputs. Returns None if the executable cannot be read.
+    """
+    path = entry['command']
+    if not os.path.exists(path):
+        path = shutil.which(path) or path
+    try:
+        with open(path, 'rb') as executable:
+            executable_bytes = executable.read()
+    except OSError as err:
+        info.log('DEBUG', 'panzer', 'cannot cache filter output: %s' % err)
+        return None
+    arguments = json.dumps(entry['arguments'])
+    return cache.hash_bytes(executable_bytes,
+                            arguments.encode(const.ENCODING),
+                            context.encode(const.ENCODING),
+                            json.dumps(source,
+                                       sort_keys=True).encode(const.ENCODING))
+
+def without_reserved(ast):
+    """ return (ast without 'panzer_reserved' field, content of field)
+
+    ast may be a json string. The content is None if the field is not set.
+    """
+    if isinstance(ast, str):
+        ast = json.loads(ast)
+    metadata = meta.get_metadata(ast)
+    if 'panzer_reserved' not in metadata:
+        return ast, None
+    source_metadata = {key: metadata[key]
+                       for key in metadata
+                       if key != 'panzer_reserved'}
+    return ([{'unMeta': source_metadata}] + list(ast[1:]),
+            metadata['panzer_reserved'])
+
+def with_reserved(ast, reserved):
+    """ return ast with 'panzer_reserved' field set to reserved, if not None """
+    if reserved is None:
+        return ast
+    metadata = dict(meta.get_metadata(ast))
+    metadata['panzer_reserved'] = reserved
+    return [{'unMeta': metadata}] + list(ast[1:])
+
+async def run_script(entry, options, in_pipe_bytes, processes):
+    """ return bytes written to stdout by script of entry run on in_pipe_bytes
+
+    The script runs holding a slot of processes, an asyncio semaphore.
+    Messages the script writes to stderr are logged as they arrive, and the
+    last of them kept in entry['stderr']. Its stdout is returned rather
+    than inherited, so that under panzer-daemon it reaches the client.
+    """
+    command = [entry['command']] + entry['arguments']
+    async with processes:
+        timeout = util.entry_timeout(entry, options)
+        limits = entry.get('limits')
+        process = await util.start_process(command,
+                                           limits,
+                                           group=timeout is not None,
+                                           env=util.environment(options),
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+        stderr_log = util.drain_stderr(process,
+                                       os.path.basename(command[0]),
+                                       options['panzer']['stderr_lines'])
+        try:
+            stdout, _ = await util.finish_process(process, in_pipe_bytes,
+                                                  timeout, limits,
+                                                  stderr_log)
+        finally:
+            messages = await stderr_log.join()
+            if messages:
+                entry['stderr'] = messages
+    return stdout
+
+def write_stdout(data):
+    """ write bytes data, if any, to stdout, which may be a client's """
+    if not data:
+        return
+    sys.stdout.buffer.write(data)
+    sys.stdout.flush()
+
+def run_python_filter(path, ast, arguments):
+    """ return (ast, stderr) from running python filter at path on ast
+
+    The module at path must define a function `panzer_filter(ast,
+    arguments)` returning the new ast, a list of metadata and blocks; it may
+    change the ast it is given and return that. arguments are those the
+    filter would get on the command line, starting with the writer. Anything
+    the filter writes to stderr is returned, to be logged like the stderr of
+    an external filter; anything written to stdout is discarded. Only what
+    the calling thread writes is redirected, so other threads, such as the
+    event loop's, keep their stdout and stderr.
+    """
+    stderr = io.StringIO()
+    stdout = io.StringIO()
+    with PYTHON_FILTERS_LOCK:
+        module = load_python_filter(path)
+    function = getattr(module, const.PYTHON_FILTER_FUNCTION, None)
+    if not callable(function):
+        raise error.FilterError('"%s" does not define "%s"'
+                                % (path, const.PYTHON_FILTER_FUNCTION))
+    try:
+        with redirect_thread('stderr', stderr), \
+             redirect_thread('stdout', stdout):
+            new_ast = function(ast, list(arguments))
+    except Exception as err:        # pylint: disable=W0703
+        # disable pylint warnings:
+        #     + Catching too general exception
+        raise error.FilterError('%s: %s' % (type(err).__name__, err))
+    if not meta.is_ast(new_ast):
+        raise error.FilterError('"%s" returned %s, not an ast of metadata '
+                                'and blocks'
+                                % (const.PYTHON_FILTER_FUNCTION,
+                                   type(new_ast).__name__))
+    if stdout.getvalue():
+        info.log('DEBUG', 'panzer', 'ignored output to stdout by "%s"'
+                 % os.path.basename(path))
+    return new_ast, stderr.getvalue()
+
+@contextlib.contextmanager
+def redirect_thread(name, target):
+    """ send what this thread writes to sys.stdout or sys.stderr to target
+
+    name is 'stdout' or 'stderr'. One ThreadStream is installed in its
+    place and shared by every thread redirected, so threads may start and
+    stop redirecting in any order.
+    """
+    with REDIRECT_LOCK:
+        stream = getattr(sys, name)
+        if not isinstance(stream, ThreadStream):
+            stream = ThreadStream(stream)
+            setattr(sys, name, stream)
+        stream.targets[threading.get_ident()] = target
+    try:
+        yield target
+    finally:
+        stream.targets.pop(threading.get_ident(), None)
+
+class ThreadStream(object):
+    """ stand-in for sys.stdout or sys.stderr, redirecting some threads
+    - stream  : stream written to by threads not redirected
+    - targets : streams written to by redirected threads, keyed by their
+                identifiers
+    """
+    def __init__(self, stream):
+        """ new stream with no thread redirected """
+        self.stream = stream
+        self.targets = dict()
+
+    def current(self):
+        """ return stream for thread writing """
+        return self.targets.get(threading.get_ident(), self.stream)
+
+    def write(self, text):
+        """ write text to stream for thread """
+        return self.current().write(text)
+
+    def flush(self):
+        """ flush stream for thread """
+        self.current().flush()
+
+    def __getattr__(self, name):
+        """ return other attributes, such as buffer, of stream for thread """
+        return getattr(self.current(), name)
+
+def load_python_filter(path):
+    """ return python module at path, imported once while it is unchanged """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as err:
+        raise error.FilterError(err)
+    if path in PYTHON_FILTERS and PYTHON_FILTERS[path][0] == mtime:
+        return PYTHON_FILTERS[path][1]
+    name = 'panzer_filter_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None:
+        raise error.FilterError('"%s" is not a python module' % path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception as err:        # pylint: disable=W0703
+        # disable pylint warnings:
+        #     + Catching too general exception
+        raise error.FilterError('cannot import "%s": %s' % (path, err))
+    PYTHON_FILTERS[path] = (mtime, module)
+    return module
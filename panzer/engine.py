@@ -0,0 +1,168 @@
+""" asyncio engine that runs panzer's conversions
+
+pandoc, scripts, filters and postprocessors are run as asyncio
+subprocesses, so one python process can drive many conversions at once.
+Each external process holds a slot of a semaphore, `processes`, while it
+runs, which caps the number running at the same time. A pipeline of
+commands run with ---stream holds one slot.
+
+Conversions run together share the process's working directory, logging
+and standard streams: give documents paths that do not depend on the
+working directory, and outputs other than stdout.
+"""
+import asyncio
+import json
+from . import const
+from . import depends
+from . import document
+from . import info
+from . import load
+from . import util
+
+async def convert(doc, global_styledef=None, processes=None):
+    """ convert source documents using options already set in doc.options
+
+    global_styledef is used if given, otherwise style definitions are loaded
+    from the support directory. processes is the semaphore shared with
+    other conversions, or None for one with ---jobs slots. Returns the
+    document once converted: this may be a new Document if the one given
+    could not be used. Errors that stop the conversion are raised.
+    """
+    if processes is None:
+        processes = asyncio.Semaphore(doc.options['panzer']['jobs'])
+    doc.processes = processes
+    incremental = doc.options['panzer']['incremental']
+    if incremental and depends.up_to_date(doc.options):
+        info.log('INFO', 'panzer', 'output "%s" is up to date'
+                 % doc.options['pandoc']['output'])
+        return doc
+    styledef = None
+    try:
+        # - load styles in a thread while the source is scanned
+        if global_styledef is None:
+            styledef = asyncio.ensure_future(
+                util.in_thread(load.load_styledef, doc.options))
+        # - run pandoc only once if no executable needs the ast
+        direct_options = None
+        front = None
+        if not doc.options['panzer']['debug']:
+            front = load.scan_metadata(doc.options)
+        if front is not None and doc.may_run_directly(front):
+            if styledef is not None:
+                global_styledef = await styledef
+                styledef = None
+                info.time_stamp('global styledef loaded')
+            # - styles applied to stub are logged only if it is used;
+            # - otherwise their outcome is reused from STYLE_OUTCOMES
+            stub_log = info.Log()
+            try:
+                with info.keep_log(stub_log):
+                    direct_options = doc.direct_options(front,
+                                                        global_styledef)
+            except BaseException:
+                stub_log.replay()
+                raise
+            if direct_options is not None:
+                stub_log.replay()
+            else:
+                # - start again with a document read by pandoc
+                options = doc.options
+                doc = document.Document()
+                doc.options = options
+                doc.processes = processes
+        if direct_options is None:
+            # - run pandoc on source while styles are loaded
+            # - its messages are logged after those of loading styles
+            reader_log = info.Log()
+            source = asyncio.ensure_future(
+                info.keep_log_of(load.load(doc.options, processes),
+                                 reader_log))
+            try:
+                if styledef is not None:
+                    global_styledef = await styledef
+                    styledef = None
+                    info.time_stamp('global styledef loaded')
+            finally:
+                await asyncio.wait([source])
+                reader_log.replay()
+            ast = source.result()
+            info.time_stamp('document loaded')
+            doc.populate(ast, global_styledef)
+            doc.transform()
+        doc.build_runlist()
+        doc.purge_style_fields()
+        info.time_stamp('document transformed')
+        await run_filters(doc)
+        await make_output(doc, direct_options)
+    except BaseException:
+        if incremental:
+            depends.forget(doc.options)
+        raise
+    finally:
+        if styledef is not None:
+            # - stopped before styles were needed
+            styledef.cancel()
+        await doc.run_scripts('cleanup', do_not_stop=True)
+        # - write json message to file if ---debug set
+        if doc.options['panzer']['debug']:
+            filename = doc.options['panzer']['debug'] + '.json'
+            content = info.pretty_json_repr(json.loads(doc.json_message()))
+            with open(filename, 'w', encoding='utf8') as output_file:
+                output_file.write(content)
+                output_file.flush()
+    if incremental:
+        # - make output again next time if anything failed
+        if doc.pandoc_failed \
+        or any(entry['status'] == const.FAILED for entry in doc.runlist):
+            depends.forget(doc.options)
+        else:
+            depends.record(doc)
+    return doc
+
+async def run_filters(doc):
+    """ run preflight scripts and filters of doc, whose styles are applied """
+    await doc.run_scripts('preflight')
+    info.time_stamp('preflight scripts done')
+    await doc.pipe_through('filter')
+    info.time_stamp('filters done')
+
+async def make_output(doc, direct_options=None):
+    """ run pandoc's writer and postprocessors on doc, write output
+
+    Postflight scripts are run once the output is written. direct_options
+    are passed to `Document.pandoc`.
+    """
+    await doc.pandoc(direct_options)
+    info.time_stamp('pandoc done')
+    await doc.pipe_through('postprocess')
+    info.time_stamp('postprocess done')
+    doc.write()
+    info.time_stamp('output written')
+    await doc.run_scripts('postflight')
+    info.time_stamp('postflight scripts done')
+
+async def convert_all(docs, global_styledef=None, jobs=const.DEFAULT_JOBS,
+                      done=None):
+    """ return list of outcomes of converting docs at the same time
+
+    Each outcome is the document converted, as returned by `convert`, or
+    the exception that stopped its conversion. At most jobs external
+    processes run at once, across all the conversions. done, if given, is
+    called with the index of each document and its outcome as soon as its
+    conversion ends.
+    """
+    processes = asyncio.Semaphore(jobs)
+    async def convert_one(i, doc):
+        """ return outcome of converting doc, the ith """
+        try:
+            outcome = await convert(doc, global_styledef, processes)
+        except Exception as err:        # pylint: disable=W0703
+            # - one conversion that fails must not stop the others
+            # disable pylint warnings:
+            #     + Catching too general exception
+            outcome = err
+        if done is not None:
+            done(i, outcome)
+        return outcome
+    return await asyncio.gather(*[convert_one(i, doc)
+                                  for i, doc in enumerate(docs)])
@@ -20,6 +20,22 @@ class WrongType(PanzerError):
     """ looked for value of a type, encountered different type """
     pass
 
+class StyleCycleError(PanzerError):
+    """ style definition is its own ancestor """
+    pass
+
+class FilterError(PanzerError):
+    """ filter run inside panzer failed """
+    pass
+
+class ProtocolError(PanzerError):
+    """ frame not read or written: stream ended or timed out """
+    pass
+
+class LimitError(PanzerError):
+    """ executable ran out of time or exceeded a resource limit """
+    pass
+
 class InternalError(PanzerError):
     """ function invoked with invalid parameters """
     pass
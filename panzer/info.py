@@ -1,4 +1,8 @@
 """ functions for logging and printing info """
+import asyncio
+import collections
+import contextlib
+import contextvars
 import datetime
 import json
 import logging
@@ -8,6 +12,13 @@ import sys
 import time
 from . import const
 
+# log kept by the conversion running in the current context, see `Log`
+# - None to send messages to this module's logger, set up by `start_logger`
+CURRENT_LOG = contextvars.ContextVar('panzer_log', default=None)
+
+# times of first and previous `time_stamp` calls in the current context
+TIMING = contextvars.ContextVar('panzer_timing', default=None)
+
 def start_logger(options):
     """ start the logger """
     config = {
@@ -103,8 +114,56 @@ def log(level_str, sender, message):
     output += pretty_level_str
     output += sender_str
     output += message_str
+    current_log = CURRENT_LOG.get()
+    if current_log is not None:
+        current_log.add(level_str, sender, message, level, output)
+        return
     my_logger.log(level, output)
 
+class Log(object):
+    """ messages logged by one conversion, kept instead of sent to the logger
+
+    Messages go to the Log that is the value of CURRENT_LOG in the context
+    where they are logged.
+    - messages : list of {'level': LEVEL, 'sender': SENDER, 'message': TEXT}
+    - logger   : logging.Logger each message is also sent to, or None
+    """
+    def __init__(self, logger=None):
+        """ new empty log """
+        self.messages = list()
+        self.logger = logger
+
+    def add(self, level_str, sender, message, level, output):
+        """ keep message, and send output at level to logger if any """
+        self.messages.append({'level'   : level_str,
+                              'sender'  : sender,
+                              'message' : message})
+        if self.logger is not None:
+            self.logger.log(level, output)
+
+    def replay(self):
+        """ log messages kept, as if logged now """
+        for item in self.messages:
+            log(item['level'], item['sender'], item['message'])
+
+@contextlib.contextmanager
+def keep_log(kept):
+    """ keep messages logged inside with block in Log kept """
+    token = CURRENT_LOG.set(kept)
+    try:
+        yield kept
+    finally:
+        CURRENT_LOG.reset(token)
+
+async def keep_log_of(coroutine, kept):
+    """ return result of coroutine, keeping messages it logs in Log kept
+
+    For a coroutine run as its own task: messages from tasks and threads
+    it starts are kept too, so they can be replayed in a fixed order.
+    """
+    with keep_log(kept):
+        return await coroutine
+
 def decode_stderr_json(stderr):
     """ return a list of decoded json messages in stderr """
     # - check for blank input
@@ -114,18 +173,31 @@ def decode_stderr_json(stderr):
     # - split the input (based on newlines) into list of json strings
     output = list()
     for line in stderr.split('\n'):
-        if not line:
-            # - skip blank lines: no valid json or message to decode
-            continue
-        json_message = list()
-        try:
-            json_message = json.loads(line)
-        except ValueError:
-            # - if json cannot be decoded, just log as ERROR prefixed by '!'
-            json_message = {'level': 'ERROR', 'message': '!' + line}
-        output.append(json_message)
+        json_message = decode_stderr_line(line)
+        if json_message:
+            output.append(json_message)
     return output
 
+def decode_stderr_line(line):
+    """ return json message decoded from line, or None if line blank """
+    line = line.rstrip('\r\n')
+    if not line:
+        # - skip blank lines: no valid json or message to decode
+        return None
+    try:
+        json_message = json.loads(line)
+    except ValueError:
+        # - if json cannot be decoded, just log as ERROR prefixed by '!'
+        return {'level': 'ERROR', 'message': '!' + line}
+    if not isinstance(json_message, dict) \
+    or not {'level', 'message'} <= json_message.keys():
+        return {'level': 'ERROR', 'message': '!' + line}
+    return json_message
+
+def encode_stderr_json(messages):
+    """ return stderr that `decode_stderr_json` decodes to messages """
+    return ''.join(json.dumps(item) + '\n' for item in messages)
+
 def log_stderr(stderr, sender=str()):
     """ send a log from external executable """
     # 1. check for blank input
@@ -143,6 +215,60 @@ def log_stderr(stderr, sender=str()):
         message = item['message']
         log(level, sender, message)
 
+class StderrLog(object):
+    """ messages from an executable's stderr, logged as they arrive
+
+    A task reads stream, an asyncio stream, line by line, logging each
+    message as soon as it is read, so that stderr never fills up and
+    messages are seen while the executable runs. A line longer than
+    const.STDERR_LINE_LIMIT is read in pieces of that length, each taken as
+    a line. Only the last max_lines messages are kept.
+    - messages : last max_lines messages decoded
+    - dropped  : number of earlier messages not kept
+    """
+    def __init__(self, stream, sender, max_lines):
+        """ start reading stream, logging messages as from sender """
+        if sender:
+            # - remove file extension from sender's name if present
+            sender = os.path.splitext(sender)[0]
+        self.messages = collections.deque(maxlen=max_lines)
+        self.dropped = 0
+        self.task = asyncio.ensure_future(self.read(stream, sender))
+
+    async def read(self, stream, sender):
+        """ log and keep each message in stream until it ends """
+        while True:
+            try:
+                line_bytes = await stream.readuntil(b'\n')
+            except asyncio.IncompleteReadError as err:
+                # - last line, not ended by newline
+                line_bytes = err.partial
+            except asyncio.LimitOverrunError:
+                # - line longer than stream's limit, still in its buffer
+                line_bytes = await stream.read(const.STDERR_LINE_LIMIT)
+            if not line_bytes:
+                break
+            line = line_bytes.decode(const.ENCODING, errors='replace')
+            item = decode_stderr_line(line)
+            if not item:
+                continue
+            log(item['level'], sender, item['message'])
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(item)
+
+    async def wait(self):
+        """ wait for stream to end """
+        await self.task
+
+    async def join(self):
+        """ wait for stream to end, return list of messages kept """
+        await self.wait()
+        if self.dropped:
+            log('DEBUG', 'panzer', 'kept last %d of %d messages'
+                % (len(self.messages), len(self.messages) + self.dropped))
+        return list(self.messages)
+
 def pretty_keys(dictionary):
     """ return pretty printed list of dictionary keys, num per line """
     if not dictionary:
@@ -237,15 +363,12 @@ def time_stamp(text):
     """
     if not const.DEBUG_TIMING:
         return
-    try:
-        now = time.time() - time_stamp.start
-    except AttributeError:
-        time_stamp.start = time.time()
-        now = 0
-    try:
-        elapsed = now - time_stamp.last
-    except AttributeError:
-        elapsed = 0
+    timing = TIMING.get()
+    if timing is None:
+        timing = {'start': time.time(), 'last': 0}
+        TIMING.set(timing)
+    now = time.time() - timing['start']
+    elapsed = now - timing['last']
     now_str = str(round(now * 1000)).rjust(7)
     now_str += ' msec'
     now_str += '    '
@@ -255,6 +378,6 @@ def time_stamp(text):
         now_str += ' msec'
     else:
         now_str += ' ' * 12
-    time_stamp.last = now
+    timing['last'] = now
     print(now_str)
 
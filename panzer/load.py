@@ -3,13 +3,20 @@
 import os
 import json
 import subprocess
+from . import cache
 from . import error
 from . import info
 from . import const
-from . import meta
+from . import styleindex
+from . import util
+from . import yamlmeta
 
-def load(options):
-    """ return ast from running pandoc on input documents """
+async def load(options, processes):
+    """ return ast from running pandoc on input documents
+
+    pandoc runs holding a slot of processes, an asyncio semaphore. Its
+    messages are logged as they arrive.
+    """
     # 1. Build pandoc command
     command = ['pandoc']
     command += options['pandoc']['input'].copy()
@@ -18,77 +25,200 @@ def load(options):
     command += ['--write', 'json', '--output', '-']
     command += options['pandoc']['options']
     info.log('DEBUG', 'panzer', 'loading source document(s)')
+    # - use cached ast if inputs, reader and pandoc unchanged
+    key = str()
+    if options['panzer']['cache_ast']:
+        key = ast_key(options)
+        ast = None
+        if key:
+            ast = cache.read(options, 'ast', key)
+        if ast is not None:
+            return ast
     info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
-    out_pipe = str()
-    stderr = str()
-    ast = None
-    try:
-        process = subprocess.Popen(command,
-                                   stderr=subprocess.PIPE,
-                                   stdout=subprocess.PIPE)
-        out_pipe_bytes, stderr_bytes = process.communicate()
-        out_pipe = out_pipe_bytes.decode(const.ENCODING)
-        stderr = stderr_bytes.decode(const.ENCODING)
-    except OSError as err:
-        info.log('ERROR', 'pandoc', err)
-    finally:
-        info.log_stderr(stderr)
+    # 2. Run pandoc
+    out_pipe_bytes = bytes()
+    async with processes:
+        timeout = util.time_left(options)
+        try:
+            process = await util.start_process(command,
+                                               group=timeout is not None,
+                                               stderr=subprocess.PIPE,
+                                               stdout=subprocess.PIPE)
+        except OSError as err:
+            info.log('ERROR', 'pandoc', err)
+            process = None
+        if process:
+            stderr_log = util.drain_stderr(process, str(),
+                                           options['panzer']['stderr_lines'])
+            try:
+                out_pipe_bytes = (await util.finish_process(process, None,
+                                                            timeout))[0]
+            except error.LimitError:
+                # - ---deadline passed while pandoc was reading
+                raise error.LimitError('pandoc ran past deadline '
+                                       'reading source document(s)')
+            finally:
+                await stderr_log.join()
+    # 3. Read ast from pandoc's output
+    out_pipe = out_pipe_bytes.decode(const.ENCODING)
     try:
         ast = json.loads(out_pipe)
     except ValueError:
         raise error.BadASTError('failed to receive valid '
                                 'json object from pandoc')
+    if key:
+        cache.write(options, 'ast', key, ast)
+        cache.trim(options, 'ast', const.CACHE_MAX_ENTRIES)
     return ast
 
+def scan_metadata(options):
+    """ return raw metadata of source documents read without pandoc
+
+    Only yaml metadata blocks in markdown are understood. Returns None if
+    the metadata cannot be found this way: if pyyaml is not installed, the
+    reader is not markdown, a source document cannot be read, a source
+    document starts with a pandoc title block ('%' lines), or metadata is
+    also given on the command line.
+    """
+    if not yamlmeta.available() or not options['pandoc']['input']:
+        return None
+    reader = options['pandoc']['read']
+    if reader:
+        if reader.split('+')[0].split('-')[0] != 'markdown' \
+        or 'yaml_metadata_block' in reader:
+            return None
+    else:
+        for filename in options['pandoc']['input']:
+            ext = os.path.splitext(filename)[1].lower()
+            if ext not in const.MARKDOWN_EXTENSIONS:
+                return None
+    for option in options['pandoc']['options']:
+        if option.startswith(('-M', '--metadata')):
+            return None
+    title_block = '-pandoc_title_block' not in reader
+    metadata = dict()
+    for filename in options['pandoc']['input']:
+        try:
+            with open(filename, 'r', encoding=const.ENCODING) as input_file:
+                text = input_file.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+        if title_block and text.startswith('%'):
+            # - title, author and date are set by title block
+            return None
+        blocks = yamlmeta.metadata_blocks(text)
+        if blocks is None:
+            return None
+        for key in blocks:
+            # - pandoc keeps the first value set for a field
+            metadata.setdefault(key, blocks[key])
+    return metadata
+
+def ast_key(options):
+    """ return cache key for ast of input documents
+
+    Key covers contents and extensions of the input files, the reader, the
+    pandoc executable, and all pandoc options except those that only affect
+    pandoc's writer. Returns an empty string, so that the cache is not
+    used, if an input file cannot be read: pandoc reports this itself.
+    """
+    chunks = list()
+    for filename in options['pandoc']['input']:
+        chunks.append(os.path.splitext(filename)[1].encode(const.ENCODING))
+        try:
+            with open(filename, 'rb') as input_file:
+                chunks.append(input_file.read())
+        except OSError:
+            return str()
+    reader_options = [opt for opt in options['pandoc']['options']
+                      if opt.split('=')[0] not in const.WRITER_ONLY_OPTIONS]
+    chunks.append(options['pandoc']['read'].encode(const.ENCODING))
+    chunks.append(cache.pandoc_key().encode(const.ENCODING))
+    chunks.append(json.dumps(reader_options).encode(const.ENCODING))
+    return cache.hash_bytes(*chunks)
+
 def load_styledef(options):
-    """ return metadata branch of styles.yaml as dict """
+    """ return index of style definitions in styles.yaml and styles.d/
+
+    Style definitions are read first from styles.yaml, then from the yaml
+    files in styles.d/ in order of filename. Where more than one file
+    defines the same style, the definition read last wins.
+    """
     info.log('DEBUG', 'panzer', 'loading global style definitions file')
-    filename = os.path.join(options['panzer']['panzer_support'], 'styles.yaml')
-    if not os.path.exists(filename):
+    filenames = styles_files(options)
+    if not filenames:
         info.log('ERROR', 'panzer',
-                 'default styles file not found: %s' % filename)
-        return dict()
-    # - slurp styles.yaml
-    data = []
-    with open(filename, 'r', encoding=const.ENCODING) as styles_file:
-        data = styles_file.readlines()
-    # - top and tail with metadata markings
-    data.insert(0, "---\n")
-    data.append("...\n")
-    data_string = ''.join(data)
-    # - build pandoc command
-    command = ['pandoc']
-    command += ['-']
-    command += ['--write', 'json']
-    command += ['--output', '-']
-    info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
-    # - send to pandoc to convert to json
-    in_pipe = data_string
-    out_pipe = ''
-    stderr = ''
-    try:
-        process = subprocess.Popen(command,
-                                   stderr=subprocess.PIPE,
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE)
-        in_pipe_bytes = in_pipe.encode(const.ENCODING)
-        out_pipe_bytes, stderr_bytes = process.communicate(input=in_pipe_bytes)
-        out_pipe = out_pipe_bytes.decode(const.ENCODING)
-        stderr = stderr_bytes.decode(const.ENCODING)
-    except OSError as err:
-        info.log('ERROR', 'pandoc', err)
-    finally:
-        info.log_stderr(stderr)
-    # - convert json to python dict
-    ast = None
-    try:
-        ast = json.loads(out_pipe)
-    except ValueError:
-        raise error.BadASTError('failed to receive valid '
-                                'json object from pandoc')
-    # - return metadata branch of dict
-    if not ast:
-        return dict()
+                 'default styles file not found: %s'
+                 % os.path.join(options['panzer']['panzer_support'],
+                                'styles.yaml'))
+        return styleindex.StyleIndex()
+    index = styleindex.StyleIndex()
+    origin = dict()
+    keys = list()
+    for filename in filenames:
+        fragment, key = load_styles_file(filename, options)
+        keys.append(key)
+        for style in fragment:
+            if style in origin:
+                info.log('INFO', 'panzer',
+                         'style "%s" in "%s" overrides definition in "%s"'
+                         % (style, info.pretty_path(filename),
+                            info.pretty_path(origin[style])))
+            origin[style] = filename
+        index.update(fragment)
+    # - drop cache entries for old versions of the styles files
+    cache.purge(options, 'styledef', keep=keys)
+    return index
+
+def styles_files(options):
+    """ return list of files of style definitions, in order to be read """
+    support = options['panzer']['panzer_support']
+    filenames = list()
+    filename = os.path.join(support, 'styles.yaml')
+    if os.path.exists(filename):
+        filenames.append(filename)
+    directory = os.path.join(support, const.STYLES_DIR)
+    if os.path.isdir(directory):
+        filenames += [os.path.join(directory, name)
+                      for name in sorted(os.listdir(directory))
+                      if os.path.splitext(name)[1] in ['.yaml', '.yml']]
+    return filenames
+
+def styledef_key(options):
+    """ return options that decide which style definitions are loaded """
+    return (options['panzer']['panzer_support'],
+            options['panzer']['plain_styledef'])
+
+def load_styles_file(filename, options):
+    """ return (encoded style definitions, cache key) of a styles file """
+    with open(filename, 'rb') as styles_file:
+        data_bytes = styles_file.read()
+    # - use cached conversion if file and pandoc unchanged
+    key = cache.hash_bytes(data_bytes,
+                           cache.pandoc_key().encode(const.ENCODING),
+                           styledef_mode(options).encode(const.ENCODING),
+                           const.STYLEDEF_CACHE_FORMAT.encode(const.ENCODING))
+    encoded = cache.read(options, 'styledef', key)
+    if encoded is not None:
+        return encoded, key
+    info.log('DEBUG', 'panzer', 'converting "%s"'
+             % info.pretty_path(filename))
+    data_string = data_bytes.decode(const.ENCODING)
+    if yamlmeta.available():
+        metadata = yamlmeta.convert(
+            data_string,
+            fallback=not options['panzer']['plain_styledef'])
     else:
-        return meta.get_metadata(ast)
+        metadata = yamlmeta.pandoc_convert(data_string)
+    encoded = styleindex.encode(metadata)
+    cache.write(options, 'styledef', key, encoded)
+    return encoded, key
 
+def styledef_mode(options):
+    """ return name of method used to convert styles.yaml """
+    if not yamlmeta.available():
+        return 'pandoc'
+    elif options['panzer']['plain_styledef']:
+        return 'plain'
+    else:
+        return 'native'
@@ -7,23 +7,33 @@ from . import util
 from . import error
 
 def update_metadata(old, new):
-    """ return old updated with new metadata """
+    """ return old updated with new metadata
+
+    Neither old nor new is changed: the result is a new dict that shares
+    values with them. Metadata values are never changed in place, so style
+    definitions can be shared safely between documents.
+    """
+    merged = dict(old)
     # 1. Update with values in 'metadata' field
     try:
-        old.update(get_content(new, 'metadata', 'MetaMap'))
+        merged.update(get_content(new, 'metadata', 'MetaMap'))
     except (error.MissingField, KeyError):
         pass
     except error.WrongType as err:
         info.log('WARNING', 'panzer', err)
     # 2. Update with values in fields for additive lists
-    old = update_additive_lists(old, new)
+    merged = update_additive_lists(merged, new)
     # 3. 'template' field
     if 'template' in new:
-        old['template'] = new['template']
-    return old
+        merged['template'] = new['template']
+    return merged
 
 def update_additive_lists(old, new):
-    """ return old updated with info from additive lists in new """
+    """ return old updated with info from additive lists in new
+
+    Neither old nor new is changed: lists are joined into new lists.
+    """
+    merged = old
     for field in const.RUNLIST_KIND:
         try:
             try:
@@ -40,13 +50,22 @@ def update_additive_lists(old, new):
             # wrong type of value under field, skip to next list
             info.log('WARNING', 'panzer', err)
             continue
-        old_list.extend(new_list)
-        set_content(old, field, old_list, 'MetaList')
-    return old
+        if merged is old:
+            # - copy only once something changes
+            merged = dict(old)
+        set_content(merged, field, old_list + new_list, 'MetaList')
+    return merged
 
 def apply_kill_rules(old_list):
-    """ return old_list after applying kill rules """
+    """ return old_list after applying kill rules
+
+    Items are indexed by their stringified 'run' command as they are added,
+    so each 'kill' removes its targets without searching the list again.
+    """
+    # - items kept so far, with None in place of killed items
     new_list = list()
+    # - positions in new_list of items for each command
+    index = dict()
     for item in old_list:
         # 1. Sanity checks
         check_c_and_t_exist(item)
@@ -69,6 +88,8 @@ def apply_kill_rules(old_list):
                          '"run" value must be of type "MetaInlines"'
                          '---ignoring 1 item')
                 continue
+            command = pandocfilters.stringify(item_content['run'][const.C])
+            index.setdefault(command, list()).append(len(new_list))
             new_list.append(item)
         elif 'kill' in item_content:
             try:
@@ -76,21 +97,38 @@ def apply_kill_rules(old_list):
             except error.WrongType as err:
                 info.log('WARNING', 'panzer', err)
                 continue
-            new_list = [i for i in new_list
-                        if get_content(i[const.C],
-                                       'run',
-                                       'MetaInlines') != to_be_killed]
+            command = pandocfilters.stringify(to_be_killed)
+            for position in index.pop(command, list()):
+                new_list[position] = None
         elif 'killall' in item_content:
             try:
                 if get_content(item_content, 'killall', 'MetaBool') == True:
                     new_list = list()
+                    index = dict()
             except error.WrongType as err:
                 info.log('WARNING', 'panzer', err)
                 continue
         else:
             # Should never occur, caught by previous syntax check
             continue
-    return new_list
+    return [item for item in new_list if item is not None]
+
+def trim_runlists(metadata, fields):
+    """ apply kill rules to runlists under fields of metadata, in place """
+    for field in fields:
+        try:
+            original_list = get_content(metadata, field, 'MetaList')
+            trimmed_list = apply_kill_rules(original_list)
+            if trimmed_list:
+                set_content(metadata, field, trimmed_list, 'MetaList')
+            else:
+                # if all items killed, delete field
+                del metadata[field]
+        except error.MissingField:
+            continue
+        except error.WrongType as err:
+            info.log('WARNING', 'panzer', err)
+            continue
 
 def get_nested_content(metadata, fields, expected_type_of_leaf=None):
     """ return content of field by traversing a list of MetaMaps
@@ -207,9 +245,78 @@ def get_runlist(metadata, kind, options):
                 # - arguments MetaList
                 arguments_list = get_content(item_content, 'args', 'MetaList')
                 entry['arguments'] = get_runlist_args(arguments_list)
+        # - get whether filter is a python module run inside panzer
+        if 'inprocess' in item_content:
+            try:
+                entry['inprocess'] = get_content(item_content, 'inprocess',
+                                                 'MetaBool')
+            except error.WrongType as err:
+                info.log('WARNING', 'panzer', err)
+        # - get limits on time and resources entry may use
+        limits = get_limits(item_content)
+        if limits:
+            entry['limits'] = limits
+        # - get whether filter's output may be reused for the same input
+        if 'cacheable' in item_content:
+            try:
+                entry['cacheable'] = get_content(item_content, 'cacheable',
+                                                 'MetaBool')
+            except error.WrongType as err:
+                info.log('WARNING', 'panzer', err)
+        # - get whether filter is kept running between documents
+        if 'resident' in item_content:
+            try:
+                entry['resident'] = get_content(item_content, 'resident',
+                                                'MetaBool')
+            except error.WrongType as err:
+                info.log('WARNING', 'panzer', err)
+        # - memory and cpu are limited per process, so not for filters run
+        # - inside panzer or kept running
+        if entry.get('inprocess') or entry.get('resident'):
+            unused = [field for field in ['memory', 'cpu']
+                      if field in entry.get('limits', dict())]
+            if unused:
+                info.log('WARNING', 'panzer',
+                         '"%s" limits cannot be set on "%s" filters'
+                         '---ignoring them'
+                         % ('", "'.join(unused),
+                            'inprocess' if entry.get('inprocess')
+                            else 'resident'))
+        # - get commands entry waits for if run in parallel
+        if 'after' in item_content:
+            try:
+                entry['after'] = get_list_or_inline(item_content, 'after')
+            except error.WrongType as err:
+                info.log('WARNING', 'panzer', err)
         runlist.append(entry)
     return runlist
 
+def get_limits(item_content):
+    """ return dict of limits set by 'timeout', 'memory' and 'cpu' fields """
+    limits = dict()
+    for field in const.LIMIT_FIELDS:
+        if field not in item_content:
+            continue
+        try:
+            if get_type(item_content, field) == 'MetaString':
+                value_str = get_content(item_content, field, 'MetaString')
+            else:
+                value_raw = get_content(item_content, field, 'MetaInlines')
+                value_str = pandocfilters.stringify(value_raw)
+            value = float(value_str)
+            if value <= 0:
+                raise ValueError
+        except error.WrongType as err:
+            info.log('WARNING', 'panzer', err)
+            continue
+        except ValueError:
+            info.log('WARNING', 'panzer',
+                     'value of "%s" must be a positive number---ignoring it'
+                     % field)
+            continue
+        limits[field] = value
+    return limits
+
 def get_runlist_args(arguments_list):
     """ return list of arguments from 'args' MetaList """
     arguments = list()
@@ -246,20 +353,64 @@ def check_c_and_t_exist(item):
         message = 'Value of "%s" corrupt: "T" field missing' % repr(item)
         raise error.BadASTError(message)
 
-def expand_style_hierarchy(stylelist, styledef):
-    """ return stylelist expanded to include all parent styles """
+def is_ast(value):
+    """ return whether value is an ast: a list of metadata and blocks """
+    return (isinstance(value, list) and len(value) == 2
+            and isinstance(value[0], dict) and isinstance(value[1], list))
+
+def expand_style_hierarchy(stylelist, styledef, memo=None):
+    """ return stylelist expanded to include all parent styles
+
+    Parents come before their children, and each style appears once, at the
+    place it first appears in a depth-first walk of the hierarchy. The
+    expansion of each style is stored in memo (if given) and reused.
+    """
+    if memo is None:
+        memo = dict()
     expanded_list = []
+    seen = set()
     for style in stylelist:
-        if style not in styledef:
-            # - style not in styledef tree
-            info.log('ERROR', 'panzer',
-                     'No style definition found for style "%s" --- ignoring it'
-                     % style)
-            continue
-        defcontent = get_content(styledef, style, 'MetaMap')
-        if 'parent' in defcontent:
-            # - non-leaf node
-            parents = get_list_or_inline(defcontent, 'parent')
-            expanded_list.extend(expand_style_hierarchy(parents, styledef))
-        expanded_list.append(style)
+        for ancestor in linearise(style, styledef, memo, []):
+            if ancestor not in seen:
+                seen.add(ancestor)
+                expanded_list.append(ancestor)
+    return expanded_list
+
+def linearise(style, styledef, memo, path):
+    """ return list of style's ancestors and style, parents first
+
+    path is the list of styles whose expansion is in progress, used to
+    detect a style that is its own ancestor. Expansions are stored in memo
+    only if no ancestor is missing, so that a missing style is logged
+    whenever it is used.
+    """
+    if style in memo:
+        return memo[style]
+    if style in path:
+        cycle = path[path.index(style):] + [style]
+        raise error.StyleCycleError('style hierarchy has a cycle: %s'
+                                    % ' -> '.join(cycle))
+    if style not in styledef:
+        # - style not in styledef tree
+        info.log('ERROR', 'panzer',
+                 'No style definition found for style "%s" --- ignoring it'
+                 % style)
+        return list()
+    expanded_list = []
+    seen = set()
+    complete = True
+    defcontent = get_content(styledef, style, 'MetaMap')
+    if 'parent' in defcontent:
+        # - non-leaf node
+        parents = get_list_or_inline(defcontent, 'parent')
+        for parent in parents:
+            for ancestor in linearise(parent, styledef, memo, path + [style]):
+                if ancestor not in seen:
+                    seen.add(ancestor)
+                    expanded_list.append(ancestor)
+            # - only complete expansions are in memo
+            complete = complete and parent in memo
+    expanded_list.append(style)
+    if complete:
+        memo[style] = expanded_list
     return expanded_list
@@ -8,17 +8,18 @@ Copyright : Copyright 2014, Mark Sprevak
 License   : BSD3
 """
 
-import json
+import asyncio
 import os
 import subprocess
 import sys
 from . import cli
 from . import document
+from . import engine
 from . import error
 from . import info
-from . import load
 from . import util
 from . import version
+from . import watch
 
 __version__ = version.VERSION
 
@@ -26,74 +27,81 @@ __version__ = version.VERSION
 
 def main():
     """ the main function """
+    sys.exit(run())
+
+def run(args=None, styledef=None, interactive=True):
+    """ return exit status of running panzer with command line arguments
+
+    args is the list of arguments, or sys.argv if not given. styledef is a
+    function that returns the global style definitions for the options
+    parsed, or None to load them from the support directory. If interactive
+    is False, as under panzer-daemon, panzer neither asks the user to create
+    a support directory nor watches, which never returns.
+    """
     info.time_stamp('panzer started')
     doc = document.Document()
     try:
         # util.check_pandoc_exists()
         ## don't do this as it takes too long
         info.time_stamp('checked pandoc exists')
-        doc.options = cli.parse_cli_options(doc.options)
+        doc.options = cli.parse_cli_options(doc.options, args)
         info.time_stamp('cli options parsed')
         info.start_logger(doc.options)
         info.time_stamp('logger started')
-        util.check_support_directory(doc.options)
+        util.check_support_directory(doc.options, interactive)
         info.time_stamp('support directory checked')
-        global_styledef = load.load_styledef(doc.options)
-        info.time_stamp('global styledef loaded')
-        ast = load.load(doc.options)
-        info.time_stamp('document loaded')
-        doc.populate(ast, global_styledef)
-        doc.transform()
-        doc.build_runlist()
-        doc.purge_style_fields()
-        info.time_stamp('document transformed')
-        doc.run_scripts('preflight')
-        info.time_stamp('preflight scripts done')
-        doc.pipe_through('filter')
-        info.time_stamp('filters done')
-        doc.pandoc()
-        info.time_stamp('pandoc done')
-        doc.pipe_through('postprocess')
-        info.time_stamp('postprocess done')
-        doc.write()
-        info.time_stamp('output written')
-        doc.run_scripts('postflight')
-        info.time_stamp('postflight scripts done')
+        if doc.options['panzer']['watch'] and not interactive:
+            raise error.SetupError('cannot watch from panzer-client---run '
+                                   'panzer ---watch instead')
+        if doc.options['panzer']['watch']:
+            watch.watch(doc.options)
+            return 0
+        global_styledef = None
+        if styledef is not None:
+            global_styledef = styledef(doc.options)
+        convert(doc, global_styledef)
     except error.SetupError as err:
         # - errors that occur before logging starts
         print(err, file=sys.stderr)
-        sys.exit(1)
+        return 1
     except subprocess.CalledProcessError:
         info.log('CRITICAL', 'panzer',
                  'cannot continue because of fatal error')
-        sys.exit(1)
-    except (KeyError,
-            error.MissingField,
-            error.BadASTError,
-            error.WrongType,
-            error.InternalError) as err:
+        return 1
+    except FATAL_ERRORS as err:
         # - panzer exceptions not caught elsewhere, should have been
         info.log('CRITICAL', 'panzer', err)
-        sys.exit(1)
+        return 1
     finally:
-        doc.run_scripts('cleanup', do_not_stop=True)
         # - if temp file created in setup, remove it
         if doc.options['panzer']['stdin_temp_file']:
             os.remove(doc.options['panzer']['stdin_temp_file'])
             info.log('DEBUG', 'panzer', 'deleted temp file: %s'
                      % doc.options['panzer']['stdin_temp_file'])
-        # - write json message to file if ---debug set
-        if doc.options['panzer']['debug']:
-            filename = doc.options['panzer']['debug'] + '.json'
-            content = info.pretty_json_repr(json.loads(doc.json_message()))
-            with open(filename, 'w', encoding='utf8') as output_file:
-                output_file.write(content)
-                output_file.flush()
         info.log('DEBUG', 'panzer', info.pretty_end_log('panzer quits'))
 
     # - successful exit
     info.time_stamp('finished')
-    sys.exit(0)
+    return 0
+
+# errors that stop a conversion
+FATAL_ERRORS = (KeyError,
+                error.MissingField,
+                error.BadASTError,
+                error.WrongType,
+                error.StyleCycleError,
+                error.LimitError,
+                error.InternalError)
+
+def convert(doc, global_styledef=None):
+    """ convert source documents using options already set in doc.options
+
+    global_styledef is used if given, otherwise style definitions are loaded
+    from the support directory. Returns the document once converted: this
+    may be a new Document if the one given could not be used. Errors that
+    stop the conversion are raised. The conversion is run by `engine`.
+    """
+    return asyncio.run(engine.convert(doc, global_styledef))
 
 if __name__ == '__main__':
     main()
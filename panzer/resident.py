@@ -0,0 +1,251 @@
+""" filters kept running between documents, spoken to through frames
+
+A resident filter is started once, with the environment variable
+PANZER_RESIDENT set, and then handles one request after another.
+
+Each request and response is a frame: the length in bytes of a utf8
+encoded json object, as a 4 byte big-endian number, then the object.
+
+- request  : {"arguments": [WRITER, ...], "message": JSON_MESSAGE,
+              "ast": AST}
+- response : {"ast": AST, "stderr": MESSAGES}
+
+MESSAGES is a string of json messages, one per line, as a filter would
+write to stderr. A python filter can use `serve` to handle the protocol.
+"""
+import atexit
+import json
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+from . import const
+from . import error
+from . import info
+from . import meta
+
+# resident filters running
+# - keys are (real path of executable, PANZER_SHARED it runs with)
+RESIDENTS = dict()
+
+# held while RESIDENTS is changed
+RESIDENTS_LOCK = threading.Lock()
+
+class ResidentFilter(object):
+    """ a filter process that handles many requests
+    - command     : path to filter executable
+    - environment : environment the process runs in
+    - process     : running process, or None if not started
+    - lock        : held while a request is handled, one at a time
+    """
+    def __init__(self, command, environment):
+        """ new resident filter, not yet started """
+        self.command = command
+        self.environment = environment
+        self.process = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """ start the filter process """
+        info.log('DEBUG', 'panzer', 'start resident filter "%s"'
+                 % self.command)
+        environment = dict(self.environment)
+        environment['PANZER_RESIDENT'] = '1'
+        self.process = subprocess.Popen([self.command],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        env=environment)
+
+    def stop(self):
+        """ stop the filter process """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process = None
+
+    def request(self, in_pipe, arguments, message, timeout):
+        """ return (ast, stderr) of filter run on in_pipe
+
+        in_pipe is the ast, or a json string of it. If the filter does not
+        take the request and reply within timeout seconds, or exits, it is
+        stopped and error.FilterError raised; it is started again on the
+        next request.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.stop()
+            self.start()
+        if not isinstance(in_pipe, str):
+            in_pipe = json.dumps(in_pipe)
+        # - ast already serialized, so splice it in
+        body = ('{"arguments": %s, "message": %s, "ast": %s}'
+                % (json.dumps(arguments), json.dumps(message), in_pipe))
+        deadline = time.time() + timeout
+        try:
+            write_frame(self.process.stdin, body.encode(const.ENCODING),
+                        timeout)
+            reply = read_frame(self.process.stdout,
+                               max(deadline - time.time(), 0))
+        except (OSError, error.ProtocolError) as err:
+            self.stop()
+            raise error.FilterError('resident filter failed: %s' % err)
+        try:
+            response = json.loads(reply.decode(const.ENCODING))
+            ast = response['ast']
+            stderr = response.get('stderr', str())
+        except (ValueError, KeyError, TypeError):
+            raise error.FilterError('resident filter sent invalid response')
+        if not meta.is_ast(ast):
+            raise error.FilterError('resident filter sent %s, not an ast of '
+                                    'metadata and blocks'
+                                    % type(ast).__name__)
+        return ast, stderr
+
+def run(command, in_pipe, arguments, message, environment=None,
+        timeout=const.RESIDENT_TIMEOUT):
+    """ return (ast, stderr) from resident filter command run on in_pipe
+
+    The filter runs in environment, or panzer's own if not given. command
+    may be relative to the working directory, and conversions in one
+    process may use different working directories and support directories,
+    so one process is kept for each executable and PANZER_SHARED. May be
+    called from many threads: requests to the same filter wait for each
+    other.
+    """
+    if environment is None:
+        environment = dict(os.environ)
+    path = os.path.realpath(command)
+    key = (path, environment.get('PANZER_SHARED'))
+    with RESIDENTS_LOCK:
+        if key not in RESIDENTS:
+            RESIDENTS[key] = ResidentFilter(path, environment)
+        resident_filter = RESIDENTS[key]
+    with resident_filter.lock:
+        return resident_filter.request(in_pipe, arguments, message, timeout)
+
+def stop_all():
+    """ stop all resident filters """
+    with RESIDENTS_LOCK:
+        for resident in RESIDENTS.values():
+            resident.stop()
+        RESIDENTS.clear()
+
+atexit.register(stop_all)
+
+def write_frame(stream, body, timeout=None):
+    """ write body to stream as a frame
+
+    Raises error.ProtocolError if timeout (in seconds) is given and the frame
+    is not written in time, as when the reader has stopped reading.
+    """
+    frame = struct.pack('>I', len(body)) + body
+    if timeout is None:
+        stream.write(frame)
+        stream.flush()
+        return
+    stream.flush()
+    write_exactly(stream, frame, time.time() + timeout)
+
+def read_frame(stream, timeout=None):
+    """ return body of frame read from stream
+
+    Raises error.ProtocolError if stream ends, or if timeout (in seconds) is
+    given and the frame is not read in time.
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    header = read_exactly(stream, 4, deadline)
+    length = struct.unpack('>I', header)[0]
+    return read_exactly(stream, length, deadline)
+
+def read_exactly(stream, size, deadline):
+    """ return size bytes read from stream before deadline """
+    chunks = list()
+    remaining = size
+    while remaining:
+        if deadline is not None:
+            wait = deadline - time.time()
+            if wait <= 0 or not select.select([stream], [], [], wait)[0]:
+                raise error.ProtocolError('timed out')
+        chunk = os.read(stream.fileno(), remaining)
+        if not chunk:
+            raise error.ProtocolError('connection closed')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def write_exactly(stream, data, deadline):
+    """ write all of data to stream before deadline
+
+    The stream is made non-blocking while it is written, since a blocking
+    write of more than the pipe holds waits for the reader however long.
+    """
+    descriptor = stream.fileno()
+    os.set_blocking(descriptor, False)
+    try:
+        remaining = memoryview(data)
+        while remaining:
+            wait = deadline - time.time()
+            if wait <= 0 or not select.select([], [stream], [], wait)[1]:
+                raise error.ProtocolError('timed out')
+            try:
+                written = os.write(descriptor, remaining)
+            except BlockingIOError:
+                continue
+            remaining = remaining[written:]
+    finally:
+        os.set_blocking(descriptor, True)
+
+def serve(function):
+    """ handle requests from panzer with function(ast, arguments)
+
+    For use by python filters: function returns the new ast. Anything the
+    function writes to stderr is sent back to panzer with the response.
+    Returns when panzer closes the connection.
+    """
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    real_stderr = sys.stderr
+    real_stdout = sys.stdout
+    while True:
+        try:
+            body = read_frame(stdin)
+        except error.ProtocolError:
+            return
+        request = json.loads(body.decode(const.ENCODING))
+        # - stdout carries frames, so discard anything else written to it
+        sys.stderr = StderrBuffer()
+        sys.stdout = StderrBuffer()
+        try:
+            ast = function(request['ast'], request['arguments'])
+        finally:
+            stderr = ''.join(sys.stderr.lines)
+            sys.stderr = real_stderr
+            sys.stdout = real_stdout
+        response = json.dumps({'ast': ast, 'stderr': stderr})
+        write_frame(stdout, response.encode(const.ENCODING))
+
+class StderrBuffer(object):
+    """ stand-in for sys.stderr or sys.stdout that keeps what is written """
+    def __init__(self):
+        """ new empty buffer """
+        self.lines = list()
+        self.buffer = self
+
+    def write(self, text):
+        """ keep text, decoding it if bytes """
+        if isinstance(text, bytes):
+            text = text.decode(const.ENCODING)
+        self.lines.append(text)
+        return len(text)
+
+    def flush(self):
+        """ nothing to flush """
+        pass
@@ -0,0 +1,49 @@
+""" index of style definitions decoded only when looked up """
+import collections.abc
+import json
+
+class StyleIndex(collections.abc.Mapping):
+    """ mapping of style names to style definitions
+
+    Each definition is held as a json string and only decoded the first time
+    it is looked up, so styles that a document does not use are never
+    decoded.
+    - encoded : dict of style names to json strings
+    - decoded : dict of style names to definitions already decoded
+    - linear  : dict of style names to their expanded style hierarchy
+    """
+    def __init__(self, encoded=None):
+        """ new index of encoded style definitions """
+        self.encoded = dict(encoded or dict())
+        self.decoded = dict()
+        self.linear = dict()
+
+    def __getitem__(self, style):
+        """ return definition of style, decoding it if needed """
+        if style not in self.decoded:
+            self.decoded[style] = json.loads(self.encoded[style])
+        return self.decoded[style]
+
+    def __contains__(self, style):
+        """ return True if style is defined, without decoding it """
+        return style in self.encoded
+
+    def __iter__(self):
+        """ iterate over style names """
+        return iter(self.encoded)
+
+    def __len__(self):
+        """ return number of styles defined """
+        return len(self.encoded)
+
+    def update(self, encoded):
+        """ add encoded style definitions, replacing any of the same name """
+        for style in encoded:
+            self.encoded[style] = encoded[style]
+            self.decoded.pop(style, None)
+        # - any expansion may depend on a replaced definition
+        self.linear = dict()
+
+def encode(metadata):
+    """ return dict of style names to json strings of their definitions """
+    return {style: json.dumps(metadata[style]) for style in metadata}
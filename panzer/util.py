@@ -1,10 +1,20 @@
 """ Support functions for non-core operations """
+import asyncio
+import contextvars
 import os
+import signal
 import subprocess
+import threading
+import time
 from . import const
 from . import error
 from . import info
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 def check_pandoc_exists():
     """ check pandoc exists """
     try:
@@ -28,8 +38,13 @@ def versiontuple(version_string):
     # disable warning for using builtin 'map'
     return tuple(map(int, (version_string.split("."))))
 
-def check_support_directory(options):
-    """ check support directory exists """
+def check_support_directory(options, interactive=True):
+    """ check support directory exists
+
+    If the default support directory is missing, the user is asked before a
+    blank one is created; unless interactive is False, when
+    error.SetupError is raised instead.
+    """
     if options['panzer']['panzer_support'] != const.DEFAULT_SUPPORT_DIR:
         if not os.path.exists(options['panzer']['panzer_support']):
             info.log('ERROR', 'panzer',
@@ -40,6 +55,9 @@ def check_support_directory(options):
                      % const.DEFAULT_SUPPORT_DIR)
             options['panzer']['panzer_support'] = const.DEFAULT_SUPPORT_DIR
     if not os.path.exists(const.DEFAULT_SUPPORT_DIR):
+        if not interactive:
+            raise error.SetupError('default panzer support directory "%s" '
+                                   'not found' % const.DEFAULT_SUPPORT_DIR)
         info.log('WARNING', 'panzer',
                  'default panzer support directory "%s" not found'
                  % const.DEFAULT_SUPPORT_DIR)
@@ -48,8 +66,22 @@ def check_support_directory(options):
                  % const.DEFAULT_SUPPORT_DIR)
         input("    Press Enter to continue...")
         create_default_support_dir()
-    os.environ['PANZER_SHARED'] = \
-        os.path.join(options['panzer']['panzer_support'], 'shared')
+    os.environ['PANZER_SHARED'] = shared_directory(options)
+
+def shared_directory(options):
+    """ return path of directory for files shared between executables """
+    return os.path.join(options['panzer']['panzer_support'], 'shared')
+
+def environment(options):
+    """ return environment that executables are run in
+
+    This is panzer's own environment, with PANZER_SHARED set for the support
+    directory of options, so that conversions with different support
+    directories can run in one process.
+    """
+    variables = dict(os.environ)
+    variables['PANZER_SHARED'] = shared_directory(options)
+    return variables
 
 def create_default_support_dir():
     """ create a blank panzer support directory """
@@ -84,3 +116,186 @@ def resolve_path(filename, kind, options):
             return path
     return filename
 
+
+def time_left(options):
+    """ return seconds left before ---deadline, or None if no deadline """
+    if not options['panzer']['deadline_time']:
+        return None
+    return max(0.0, options['panzer']['deadline_time'] - time.time())
+
+def entry_timeout(entry, options):
+    """ return seconds runlist entry may run for, or None if no limit
+
+    The entry's own 'timeout' limit is shortened to fit before ---deadline.
+    Raises error.LimitError if the deadline has already passed.
+    """
+    timeout = entry.get('limits', dict()).get('timeout')
+    left = time_left(options)
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise error.LimitError('deadline passed---not run')
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+async def start_process(command, limits=None, group=False, **kwargs):
+    """ return asyncio process of command, with limits on its resources
+
+    limits may give 'memory' (megabytes of address space) and 'cpu'
+    (seconds of processor time). These are set on the process once it has
+    started, with prlimit, as a function run in the child before it execs
+    is not safe while other threads run. If group is set, or there are
+    limits, the process is started in its own process group, so that
+    `kill_group` can stop it with any processes it started.
+    """
+    limits = limits or dict()
+    rlimits = list()
+    if hasattr(resource, 'prlimit'):
+        if 'memory' in limits:
+            size = int(limits['memory'] * 1024 * 1024)
+            rlimits.append((resource.RLIMIT_AS, (size, size)))
+        if 'cpu' in limits:
+            seconds = int(limits['cpu'])
+            rlimits.append((resource.RLIMIT_CPU, (seconds, seconds)))
+    elif 'memory' in limits or 'cpu' in limits:
+        info.log('WARNING', 'panzer',
+                 'memory and cpu limits not supported on this system')
+    if group or limits:
+        kwargs['start_new_session'] = True
+    # - lines of stderr are read whole up to this length
+    kwargs['limit'] = const.STDERR_LINE_LIMIT
+    process = await asyncio.create_subprocess_exec(*command, **kwargs)
+    for limit, values in rlimits:
+        try:
+            resource.prlimit(process.pid, limit, values)
+        except ProcessLookupError:
+            # - already finished
+            break
+    return process
+
+async def in_thread(function, *args):
+    """ return function(*args), run in a thread to leave the event loop free
+
+    function runs in the caller's context, so that its messages go to the
+    same log as the caller's.
+    """
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, context.run, function, *args)
+
+async def in_daemon_thread(function, *args):
+    """ return function(*args), run in a daemon thread of its own
+
+    Unlike `in_thread`, nothing waits for the thread to finish once the
+    caller stops waiting for it, as when it times out: neither the event
+    loop as it closes nor panzer as it exits.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()
+    def settle(outcome, is_error):
+        """ set outcome of future, unless the caller stopped waiting """
+        if future.done():
+            return
+        if is_error:
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+    def run():
+        """ run function, handing its outcome to the event loop """
+        try:
+            outcome, is_error = context.run(function, *args), False
+        except Exception as err:        # pylint: disable=W0703
+            # disable pylint warnings:
+            #     + Catching too general exception
+            outcome, is_error = err, True
+        try:
+            loop.call_soon_threadsafe(settle, outcome, is_error)
+        except RuntimeError:
+            # - event loop already closed
+            pass
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+def drain_stderr(process, sender, max_lines):
+    """ return info.StderrLog reading and logging stderr of process
+
+    process.stderr is handed over to the log, so that `finish_process` and
+    process.communicate() no longer read it.
+    """
+    stderr_log = info.StderrLog(process.stderr, sender, max_lines)
+    process.stderr = None
+    return stderr_log
+
+async def finish_process(process, input_bytes=None, timeout=None,
+                         limits=None, stderr_log=None):
+    """ return (stdout, stderr) of process, after sending it input_bytes
+
+    Raises error.LimitError if process does not finish within timeout
+    seconds, in which case its process group is killed, or if a process
+    with limits was stopped by them. stderr_log is the info.StderrLog
+    reading stderr of process, if any, which shows whether it ran out of
+    memory.
+    """
+    communicate = asyncio.ensure_future(process.communicate(input_bytes))
+    try:
+        stdout, stderr = await asyncio.wait_for(asyncio.shield(communicate),
+                                                timeout)
+    except asyncio.TimeoutError:
+        kill_group(process)
+        await communicate
+        raise error.LimitError('timed out after %.1f seconds' % timeout)
+    messages = list()
+    if stderr_log is not None and limits and process.returncode:
+        await stderr_log.wait()
+        messages = list(stderr_log.messages)
+    check_limits(process, limits, messages)
+    return stdout, stderr
+
+def check_limits(process, limits, messages=None):
+    """ raise error.LimitError if process was stopped by its limits
+
+    Only memory and cpu limits are set on the process itself. A process
+    that goes over its cpu limit is killed with SIGXCPU, or SIGKILL once
+    past the hard limit, so only these signals are blamed on a cpu limit.
+    A process over its memory limit is not killed: it cannot get more
+    memory, and exits however it handles that. Its failure is blamed on a
+    memory limit only if it was killed by SIGKILL, SIGSEGV or SIGABRT, or
+    one of messages, those kept from its stderr, says it ran out of memory
+    (see const.MEMORY_ERROR_TEXT). Other exit codes are left alone, as for
+    processes without limits.
+    """
+    set_limits = {key: limits[key] for key in (limits or dict())
+                  if key in ['memory', 'cpu']}
+    if not set_limits or not process.returncode:
+        return
+    shown_limits = ', '.join('%s=%g' % (key, set_limits[key])
+                             for key in sorted(set_limits))
+    names = list()
+    if 'cpu' in set_limits:
+        names += ['SIGXCPU', 'SIGKILL']
+    if 'memory' in set_limits:
+        names += ['SIGKILL', 'SIGSEGV', 'SIGABRT']
+    signals = [getattr(signal, name) for name in names
+               if hasattr(signal, name)]
+    if -process.returncode in signals:
+        raise error.LimitError('killed by signal %d under limits %s'
+                               % (-process.returncode, shown_limits))
+    if 'memory' in set_limits \
+    and any(text in str(message['message'])
+            for message in messages or list()
+            for text in const.MEMORY_ERROR_TEXT):
+        raise error.LimitError('ran out of memory under limits %s'
+                               % shown_limits)
+
+def kill_group(process):
+    """ kill process and any processes in its process group """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # - not leader of its own group, or already gone
+        try:
+            process.kill()
+        except OSError:
+            pass
@@ -0,0 +1,148 @@
+""" ---watch: convert again whenever the output's dependencies change
+
+The files watched are those listed by `depends.dependencies`: source
+documents, styles files, the template and the executables on the run
+list. They are checked every const.WATCH_INTERVAL seconds. Once a change
+is seen, panzer waits until nothing has changed for const.WATCH_DEBOUNCE
+seconds, then converts again from the earliest stage affected:
+
+- source      : read source documents again, then as for styles
+- styles      : load style definitions again and apply them to the source
+                already read, then run scripts, filters, pandoc's writer
+                and postprocessors
+- executables : as for styles
+- template    : run pandoc's writer and postprocessors on the ast already
+                filtered
+"""
+import asyncio
+import copy
+import subprocess
+import time
+from . import const
+from . import depends
+from . import document
+from . import engine
+from . import error
+from . import info
+from . import load
+from . import resident
+
+# stages of conversion, in order, and kinds of files that start each
+STAGES = ['source', 'styles', 'template']
+STAGE_OF_KIND = {'source'      : 'source',
+                 'styles'      : 'styles',
+                 'executables' : 'styles',
+                 'template'    : 'template'}
+
+def watch(options):
+    """ convert, then convert again on every change until interrupted """
+    if options['panzer']['stdin_temp_file'] or not options['pandoc']['input']:
+        raise error.SetupError('cannot watch stdin---give source documents '
+                               'as files')
+    try:
+        asyncio.run(watch_loop(options))
+    except KeyboardInterrupt:
+        info.log('INFO', 'panzer', 'stopped watching')
+
+async def watch_loop(options):
+    """ convert, then wait for changes and convert again, forever """
+    # state kept between conversions
+    # - styledef : style definitions loaded
+    # - ast      : ast of source documents, as read by pandoc
+    # - doc      : document after filters were run, None if they failed
+    state = {'styledef' : None,
+             'ast'      : None,
+             'doc'      : None}
+    processes = asyncio.Semaphore(options['panzer']['jobs'])
+    stage = 'source'
+    changed_at = None
+    while True:
+        started = time.time()
+        try:
+            await rebuild(state, options, stage, processes)
+        except (subprocess.CalledProcessError, error.PanzerError,
+                KeyError) as err:
+            info.log('CRITICAL', 'panzer', err)
+        else:
+            report = 'converted from %s stage in %.2fs' % (stage,
+                                                           time.time()
+                                                           - started)
+            if changed_at is not None:
+                report += ', %.2fs after change' % (time.time() - changed_at)
+            info.log('INFO', 'panzer', report)
+        info.log('INFO', 'panzer', info.pretty_title('watching'))
+        stage, changed_at = await wait_for_change(state, options)
+
+async def rebuild(state, options, stage, processes):
+    """ convert from stage, reusing what state holds of earlier stages """
+    if options['panzer']['deadline']:
+        # - each conversion gets the time allowed
+        options['panzer']['deadline_time'] = (time.time()
+                                              + options['panzer']['deadline'])
+    if stage == 'source' or state['ast'] is None:
+        state['ast'] = None
+        state['ast'] = await load.load(options, processes)
+        info.time_stamp('document loaded')
+        stage = 'styles'
+    if stage == 'styles' or state['doc'] is None:
+        state['doc'] = None
+        state['styledef'] = load.load_styledef(options)
+        doc = document.Document()
+        doc.options = copy.deepcopy(options)
+        doc.processes = processes
+        doc.populate(copy.deepcopy(state['ast']), state['styledef'])
+        doc.transform()
+        doc.build_runlist()
+        doc.purge_style_fields()
+        info.time_stamp('document transformed')
+        await engine.run_filters(doc)
+        state['doc'] = doc
+    doc = state['doc']
+    # - doc kept from an earlier conversion has that conversion's deadline
+    if doc.options['panzer']['deadline_time'] \
+    != options['panzer']['deadline_time']:
+        doc.options['panzer']['deadline_time'] = \
+            options['panzer']['deadline_time']
+        # - options are in the json message kept for this version
+        doc.version += 1
+    try:
+        await engine.make_output(doc)
+    finally:
+        await doc.run_scripts('cleanup', do_not_stop=True)
+
+async def wait_for_change(state, options):
+    """ return (stage, time) of first stage affected by change, once seen """
+    before = snapshot(state, options)
+    while True:
+        await asyncio.sleep(const.WATCH_INTERVAL)
+        after = snapshot(state, options)
+        if after != before:
+            break
+    changed_at = time.time()
+    # - wait for writes to settle, e.g. an editor saving several files
+    while True:
+        await asyncio.sleep(const.WATCH_DEBOUNCE)
+        latest = snapshot(state, options)
+        if latest == after:
+            break
+        after = latest
+    stages = set()
+    for filename in set(before) | set(after):
+        if before.get(filename) != after.get(filename):
+            kind = (before.get(filename) or after.get(filename))[0]
+            info.log('INFO', 'panzer', 'changed: %s'
+                     % info.pretty_path(filename))
+            stages.add(STAGE_OF_KIND[kind])
+            if kind == 'executables':
+                # - resident filters must start again to run new code
+                resident.stop_all()
+    return min(stages, key=STAGES.index), changed_at
+
+def snapshot(state, options):
+    """ return dict of files watched to (kind, [modification time, size]) """
+    files = depends.dependencies(options, state['doc'])
+    status = dict()
+    for kind in files:
+        for filename in files[kind]:
+            status[filename] = (kind, depends.file_status(filename))
+    return status
@@ -0,0 +1,241 @@
+""" convert yaml to pandoc metadata without running pandoc """
+import json
+import re
+import subprocess
+from . import const
+from . import error
+from . import info
+from . import meta
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# words that pandoc's markdown reader turns into a list marker
+LIST_MARKER = re.compile(r'^(\d+|[a-zA-Z]|[ivxlcdmIVXLCDM]+)[.)]$')
+
+# characters that carry no markdown meaning inside a word
+PLAIN_CHARS = set('.,;:!?()/\'"-+=')
+
+def available():
+    """ return True if yaml can be converted without pandoc """
+    return yaml is not None
+
+def convert(yaml_string, fallback=True):
+    """ return metadata dict built from yaml_string
+
+    Strings made only of plain words are turned into 'MetaInlines' here.
+    Other strings need pandoc's markdown reader: if fallback is set they are
+    collected and sent to pandoc in a single run, otherwise they are treated
+    as plain words.
+    """
+    try:
+        data = yaml.load(yaml_string, Loader=Loader)
+    except yaml.YAMLError as err:
+        info.log('WARNING', 'panzer',
+                 'cannot parse styles.yaml natively---using pandoc')
+        info.log('DEBUG', 'panzer', err)
+        return pandoc_convert(yaml_string)
+    if not isinstance(data, dict):
+        return dict()
+    pending = list()
+    metadata = to_meta(data, pending, fallback)[const.C]
+    if pending:
+        info.log('DEBUG', 'panzer',
+                 'sending %d markdown string(s) to pandoc' % len(pending))
+        fields = {'panzer_%d' % i: item[const.C]
+                  for i, item in enumerate(pending)}
+        converted = pandoc_convert(yaml.safe_dump(fields,
+                                                   allow_unicode=True))
+        for i, item in enumerate(pending):
+            # - fill in placeholder in place with pandoc's conversion
+            item.update(converted.get('panzer_%d' % i,
+                                      {const.T: 'MetaString',
+                                       const.C: ''}))
+    return metadata
+
+def metadata_blocks(text):
+    """ return raw metadata of yaml metadata blocks in markdown text
+
+    Blocks are found as pandoc's markdown reader finds them: a line '---'
+    at the start of the text or after a blank line, not followed by a blank
+    line, up to a line '---' or '...'. Lines in fenced code blocks are
+    skipped. If a field is set by several blocks, the first value is kept.
+    Returns None if a block is not a yaml mapping.
+    """
+    metadata = dict()
+    lines = text.splitlines()
+    in_fence = False
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        if line.startswith(('```', '~~~')):
+            in_fence = not in_fence
+        if in_fence or line != '---' \
+        or (i > 0 and lines[i-1].strip()) \
+        or i + 1 == len(lines) or not lines[i+1].strip():
+            i += 1
+            continue
+        end = i + 1
+        while end < len(lines) and lines[end].rstrip() not in ('---', '...'):
+            end += 1
+        if end == len(lines):
+            # - no end to block, so not a metadata block
+            i += 1
+            continue
+        try:
+            data = yaml.load('\n'.join(lines[i+1:end]), Loader=Loader)
+        except yaml.YAMLError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        for key in data:
+            metadata.setdefault(str(key), data[key])
+        i = end + 1
+    return metadata
+
+def to_meta(value, pending, fallback):
+    """ return value converted to a pandoc metadata field
+
+    Follows the rules of pandoc's markdown reader: mappings become
+    'MetaMap' (dropping keys that end in '_'), lists 'MetaList', booleans
+    'MetaBool', numbers and null 'MetaString', and strings are parsed as
+    markdown. A string ending in a newline, as from a '|' block scalar, is
+    'MetaBlocks' even if it is a single paragraph.
+    """
+    if isinstance(value, dict):
+        content = {str(key): to_meta(value[key], pending, fallback)
+                   for key in value
+                   if not str(key).endswith('_')}
+        return {const.T: 'MetaMap', const.C: content}
+    elif isinstance(value, list):
+        content = [to_meta(item, pending, fallback) for item in value]
+        return {const.T: 'MetaList', const.C: content}
+    elif isinstance(value, bool):
+        return {const.T: 'MetaBool', const.C: value}
+    elif isinstance(value, (int, float)):
+        return {const.T: 'MetaString', const.C: str(value)}
+    elif value is None:
+        return {const.T: 'MetaString', const.C: ''}
+    text = str(value)
+    if not text.strip():
+        return {const.T: 'MetaBlocks', const.C: []}
+    if fallback and needs_markdown(text):
+        # - placeholder, content replaced after pandoc is run
+        field = {const.T: 'MetaString', const.C: text}
+        pending.append(field)
+        return field
+    if text.endswith('\n'):
+        paragraph = {const.T: 'Para', const.C: inlines(text)}
+        return {const.T: 'MetaBlocks', const.C: [paragraph]}
+    return {const.T: 'MetaInlines', const.C: inlines(text)}
+
+def needs_markdown(text):
+    """ return True if text may contain markdown syntax
+
+    Newlines at the end of text are not counted: they make a paragraph of
+    text, which `to_meta` handles.
+    """
+    text = text.rstrip('\n')
+    if '\n' in text or text != text.strip():
+        return True
+    words = text.split()
+    if not (words[0][0].isalnum() or words[0][0] in './'):
+        return True
+    if LIST_MARKER.match(words[0]):
+        return True
+    for word in words:
+        for i, char in enumerate(word):
+            if char.isalnum() or char in PLAIN_CHARS:
+                continue
+            # - intraword underscores are literal in pandoc's markdown
+            if char == '_' and 0 < i < len(word) - 1 \
+            and word[i-1].isalnum() and word[i+1].isalnum():
+                continue
+            return True
+    return False
+
+def inlines(text):
+    """ return list of 'Str' and 'Space' inlines for words in text """
+    content = list()
+    for word in text.split():
+        if content:
+            content.append({const.T: 'Space', const.C: []})
+        content.append({const.T: 'Str', const.C: word})
+    return content
+
+def pandoc_convert(yaml_string):
+    """ return metadata dict from running pandoc on yaml_string """
+    # - top and tail with metadata markings
+    data = yaml_string.splitlines(keepends=True)
+    data.insert(0, "---\n")
+    data.append("...\n")
+    data_string = ''.join(data)
+    # - build pandoc command
+    command = ['pandoc']
+    command += ['-']
+    command += ['--write', 'json']
+    command += ['--output', '-']
+    info.log('DEBUG', 'panzer', 'run "%s"' % ' '.join(command))
+    # - send to pandoc to convert to json
+    in_pipe = data_string
+    out_pipe = ''
+    stderr = ''
+    try:
+        process = subprocess.Popen(command,
+                                   stderr=subprocess.PIPE,
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        in_pipe_bytes = in_pipe.encode(const.ENCODING)
+        out_pipe_bytes, stderr_bytes = process.communicate(input=in_pipe_bytes)
+        out_pipe = out_pipe_bytes.decode(const.ENCODING)
+        stderr = stderr_bytes.decode(const.ENCODING)
+    except OSError as err:
+        info.log('ERROR', 'pandoc', err)
+    finally:
+        info.log_stderr(stderr)
+    # - convert json to python dict
+    ast = None
+    try:
+        ast = json.loads(out_pipe)
+    except ValueError:
+        raise error.BadASTError('failed to receive valid '
+                                'json object from pandoc')
+    # - return metadata branch of dict
+    if not ast:
+        return dict()
+    else:
+        return meta.get_metadata(ast)
+
+# numbers as pandoc reads them: decimal integers, leading zeros and all, and
+# decimal floats, but not yaml 1.1's sexagesimal, octal, hexadecimal, binary
+# or underscored forms, which pandoc keeps as text
+DECIMAL_INT = re.compile(r'^[-+]?[0-9]+$')
+DECIMAL_FLOAT = re.compile(r'''^(?:[-+]?[0-9]+\.[0-9]*(?:[eE][-+]?[0-9]+)?
+                             |[-+]?\.[0-9]+(?:[eE][-+]?[0-9]+)?
+                             |[-+]?\.(?:inf|Inf|INF)
+                             |\.(?:nan|NaN|NAN))$''', re.X)
+
+if yaml is not None:
+    class Loader(yaml.SafeLoader):
+        """ yaml loader that reads scalars as pandoc does
+
+        Dates are left as strings, and only decimal numbers are numbers.
+        """
+        def construct_decimal_int(self, node):
+            """ return integer of node, read in base 10 """
+            return int(self.construct_scalar(node), 10)
+    Loader.yaml_implicit_resolvers = {
+        first: [resolver for resolver in resolvers
+                if resolver[0] not in ['tag:yaml.org,2002:timestamp',
+                                       'tag:yaml.org,2002:int',
+                                       'tag:yaml.org,2002:float']]
+        for first, resolvers in yaml.SafeLoader.yaml_implicit_resolvers.items()
+    }
+    Loader.add_implicit_resolver('tag:yaml.org,2002:int', DECIMAL_INT,
+                                 list('-+0123456789'))
+    Loader.add_implicit_resolver('tag:yaml.org,2002:float', DECIMAL_FLOAT,
+                                 list('-+0123456789.'))
+    Loader.add_constructor('tag:yaml.org,2002:int',
+                           Loader.construct_decimal_int)
@@ -14,6 +14,7 @@ setup(name='panzer',
       license='LICENSE.txt',
       packages=['panzer'],
       install_requires=['pandocfilters'],
+      extras_require={'yaml': ['pyyaml']},
       include_package_data=True,
       keywords=['pandoc'],
       classifiers=[
@@ -28,7 +29,10 @@ setup(name='panzer',
         ],
       entry_points = {
           'console_scripts': [
-              'panzer = panzer.panzer:main'
+              'panzer = panzer.panzer:main',
+              'panzer-batch = panzer.batch:main',
+              'panzer-daemon = panzer.daemon:main',
+              'panzer-client = panzer.client:main'
           ]
         },
       zip_safe=False)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Micro-benchmark of panzer's style processing
+
+syntax: benchmark.py [DEPTH] [ENTRIES]
+    DEPTH   : number of styles in chain of parents (default 50)
+    ENTRIES : number of runlist entries per style (default 20)
+
+benchmark.py will:
+
+-   Build a chain of DEPTH styles, each the parent of the next, each adding
+    ENTRIES filters and killing some of those added by its ancestors
+-   Time expanding the style hierarchy, applying the styles to a document,
+    and applying kill rules to the resulting filter list
+
+Does not run pandoc or any filters.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import document
+from panzer import meta
+from panzer import styleindex
+
+from helpers import inlines
+from helpers import metamap
+
+REPEAT = 20
+
+def main():
+    """ the main function """
+    depth = 50
+    entries = 20
+    if len(sys.argv) > 1:
+        depth = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        entries = int(sys.argv[2])
+    definitions = make_styledef(depth, entries)
+    index = styleindex.StyleIndex(styleindex.encode(definitions))
+    leaf = 'Style%d' % (depth - 1)
+    print('* %d styles, %d runlist entries per style' % (depth, entries))
+    # - expanding hierarchy, no memo shared between runs
+    report('expand style hierarchy',
+           lambda: meta.expand_style_hierarchy([leaf], index))
+    # - applying styles, without reusing earlier outcomes
+    def transform():
+        """ populate and transform a new document """
+        document.STYLE_OUTCOMES.clear()
+        doc = document.Document()
+        doc.options['pandoc']['write'] = 'html'
+        doc.populate([{'unMeta': {'style': inlines(leaf)}}, []], index)
+        doc.transform()
+    report('populate and transform', transform)
+    # - kill rules alone, on concatenation of all filter lists
+    filter_list = list()
+    for style in sorted(definitions):
+        filter_list += definitions[style]['c']['all']['c']['filter']['c']
+    report('apply kill rules (%d items)' % len(filter_list),
+           lambda: meta.apply_kill_rules(filter_list))
+
+def make_styledef(depth, entries):
+    """ return style definitions for a chain of depth styles """
+    definitions = dict()
+    for i in range(depth):
+        filters = list()
+        for j in range(entries):
+            filters.append(metamap({'run': inlines('filter_%d_%d.py' % (i, j))}))
+        if i > 0:
+            # - kill every other filter added by parent
+            for j in range(0, entries, 2):
+                filters.append(metamap({'kill': inlines('filter_%d_%d.py'
+                                                        % (i - 1, j))}))
+        content = {'all': metamap({'filter': {'t': 'MetaList',
+                                              'c': filters}})}
+        if i > 0:
+            content['parent'] = inlines('Style%d' % (i - 1))
+        definitions['Style%d' % i] = metamap(content)
+    return definitions
+
+def report(title, function):
+    """ print best time of running function """
+    best = min(timeit.repeat(function, number=1, repeat=REPEAT))
+    print('    %s: %.3f msec' % (title.ljust(40), best * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# encoding: utf-8
+"""
+Pandoc ast values shared by the unit tests and benchmarks
+"""
+
+def metamap(content):
+    """ return content as a MetaMap """
+    return {'t': 'MetaMap', 'c': content}
+
+def inlines(*words):
+    """ return MetaInlines of words """
+    return {'t': 'MetaInlines', 'c': content(words)}
+
+def blocks(*words):
+    """ return MetaBlocks of a paragraph of words """
+    return {'t': 'MetaBlocks', 'c': [{'t': 'Para', 'c': content(words)}]}
+
+def content(words):
+    """ return list of Str and Space inlines of words """
+    result = list()
+    for word in words:
+        if result:
+            result.append({'t': 'Space', 'c': []})
+        result.append({'t': 'Str', 'c': word})
+    return result
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of the on-disk cache
+
+syntax: test_cache.py
+    or: python -m pytest test/
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import cache
+
+class TestTrim(unittest.TestCase):
+    """ least recently used entries removed """
+
+    def setUp(self):
+        """ write entries a to e, a used longest ago, each 100 bytes """
+        self.directory = tempfile.TemporaryDirectory()
+        self.options = {'panzer': {'panzer_support': self.directory.name}}
+        for i, key in enumerate('abcde'):
+            cache.write(self.options, 'test', key, 'x' * 98)
+            os.utime(self.filename(key), (i, i))
+
+    def tearDown(self):
+        """ remove cache """
+        self.directory.cleanup()
+
+    def filename(self, key):
+        """ return path of entry key """
+        return os.path.join(cache.cache_dir(self.options), 'test',
+                            key + '.json')
+
+    def kept(self):
+        """ return keys of entries left """
+        return ''.join(key for key in 'abcde'
+                       if os.path.exists(self.filename(key)))
+
+    def test_entries(self):
+        """ at most max_entries are kept """
+        cache.trim(self.options, 'test', 3)
+        self.assertEqual(self.kept(), 'cde')
+
+    def test_bytes(self):
+        """ at most max_bytes are kept """
+        cache.trim(self.options, 'test', 5, 250)
+        self.assertEqual(self.kept(), 'de')
+
+    def test_read_counts_as_use(self):
+        """ entry read is kept over those used after it was written """
+        self.assertEqual(cache.read(self.options, 'test', 'a'), 'x' * 98)
+        cache.trim(self.options, 'test', 2)
+        self.assertEqual(self.kept(), 'ae')
+
+    def test_within_caps(self):
+        """ nothing is removed while under both caps """
+        cache.trim(self.options, 'test', 5, 500)
+        self.assertEqual(self.kept(), 'abcde')
+        self.assertEqual(os.path.getsize(self.filename('a')), 100)
+
+if __name__ == '__main__':
+    unittest.main()
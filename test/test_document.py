@@ -0,0 +1,653 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of converting documents inside one panzer process
+
+syntax: test_document.py
+    or: python -m pytest test/
+
+Documents are populated directly from ast, so pandoc is not run.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import const
+from panzer import document
+from panzer import info
+from panzer import meta
+from panzer import styleindex
+
+from helpers import inlines
+from helpers import metamap
+
+# python filter that appends '!' to metadata field 'a' in place
+APPEND_FILTER = '''
+def panzer_filter(ast, arguments):
+    ast[0]['unMeta']['a']['c'][0]['c'] += '!'
+    return ast
+'''
+
+# python filter that adds a paragraph in place, then fails
+FAIL_FILTER = """
+def panzer_filter(ast, arguments):
+    ast[1].append({'t': 'Para', 'c': []})
+    raise ValueError('failed')
+"""
+
+# python filter that adds an empty paragraph
+PARA_FILTER = """
+def panzer_filter(ast, arguments):
+    ast[1].append({'t': 'Para', 'c': []})
+    return ast
+"""
+
+# python filter that changes the ast in place but does not return it
+NONE_FILTER = """
+def panzer_filter(ast, arguments):
+    ast[1].append({'t': 'Para', 'c': []})
+"""
+
+# python filter that takes its time, writing to stdout
+SLOW_FILTER = '''
+import time
+def panzer_filter(ast, arguments):
+    for i in range(5):
+        print('slow')
+        time.sleep(0.1)
+    return ast
+'''
+
+# script that sleeps for its first argument in seconds, records its name in
+# file given by its second, and writes its name to stdout and stderr
+SLEEP_SCRIPT = '''#!%s
+import json
+import os
+import sys
+import time
+name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+time.sleep(float(sys.argv[1]))
+with open(sys.argv[2], 'a') as record:
+    record.write(name + '\\n')
+print(name)
+sys.stderr.write(json.dumps({'level': 'INFO', 'message': name}) + '\\n')
+''' % sys.executable
+
+# filter that sleeps for its second argument in seconds, then adds as many
+# paragraphs of 1000 letters as its third
+PARA_SCRIPT = '''#!%s
+import json
+import sys
+import time
+ast = json.load(sys.stdin)
+time.sleep(float(sys.argv[2]))
+for i in range(int(sys.argv[3])):
+    ast[1].append({'t': 'Para', 'c': [{'t': 'Str', 'c': 'x' * 1000}]})
+json.dump(ast, sys.stdout)
+''' % sys.executable
+
+class TestStream(unittest.TestCase):
+    """ filters connected in a pipeline with ---stream """
+
+    def setUp(self):
+        """ write filter """
+        self.directory = tempfile.TemporaryDirectory()
+        self.filter_path = os.path.join(self.directory.name, 'para.py')
+        with open(self.filter_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(PARA_SCRIPT)
+        os.chmod(self.filter_path, 0o755)
+        document.STYLE_OUTCOMES.clear()
+
+    def tearDown(self):
+        """ remove filter """
+        self.directory.cleanup()
+
+    def item(self, sleep, count, timeout=None, path=None):
+        """ return filter item sleeping, then adding count paragraphs """
+        content = {'run': inlines(path or self.filter_path),
+                   'args': inlines(str(sleep), str(count))}
+        if timeout is not None:
+            content['timeout'] = inlines(str(timeout))
+        return metamap(content)
+
+    def run_stream(self, items):
+        """ return document filtered by pipeline of items """
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'filter': {'t': 'MetaList', 'c': items}})})}
+        doc = filter_document(styleindex.StyleIndex(
+            styleindex.encode(definitions)))
+        doc.options['panzer']['stream'] = True
+        with info.keep_log(info.Log()):
+            asyncio.run(doc.pipe_through('filter'))
+        return doc
+
+    def statuses(self, doc):
+        """ return status of each entry of doc's runlist """
+        return [entry['status'] for entry in doc.runlist]
+
+    def test_pipeline(self):
+        """ each filter reads the output of the one before """
+        doc = self.run_stream([self.item(0, 1), self.item(0, 2)])
+        self.assertEqual(self.statuses(doc), [const.DONE, const.DONE])
+        self.assertEqual(len(doc.ast[1]), 3)
+
+    def test_missing_command(self):
+        """ command that cannot be run is left out of the pipeline """
+        missing = os.path.join(self.directory.name, 'missing.py')
+        doc = self.run_stream([self.item(0, 1),
+                               self.item(0, 1, path=missing),
+                               self.item(0, 1)])
+        self.assertEqual(self.statuses(doc),
+                         [const.DONE, const.FAILED, const.DONE])
+        self.assertEqual(len(doc.ast[1]), 2)
+
+    def test_timeout(self):
+        """ command running past its timeout is killed and fails """
+        start = time.time()
+        doc = self.run_stream([self.item(5, 1, timeout=0.2),
+                               self.item(0, 1)])
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(doc.runlist[0]['status'], const.FAILED)
+        # - the next command read no ast, so the document is left alone
+        self.assertEqual(doc.ast[1], [])
+
+    def test_large_output(self):
+        """ output larger than a pipe's buffer passes through whole """
+        doc = self.run_stream([self.item(0, 500), self.item(0, 500)])
+        self.assertEqual(self.statuses(doc), [const.DONE, const.DONE])
+        self.assertEqual(len(doc.ast[1]), 1000)
+        self.assertEqual(doc.ast[1][-1]['c'][0]['c'], 'x' * 1000)
+
+# filter that records that it ran in the file given by its second argument,
+# reports it on stderr, and adds a paragraph of its third argument
+COUNT_SCRIPT = '''#!%s
+import json
+import sys
+ast = json.load(sys.stdin)
+with open(sys.argv[2], 'a') as record:
+    record.write('run\\n')
+sys.stderr.write(json.dumps({'level': 'INFO', 'message': 'counted'}) + '\\n')
+ast[1].append({'t': 'Para', 'c': [{'t': 'Str', 'c': sys.argv[3]}]})
+json.dump(ast, sys.stdout)
+''' % sys.executable
+
+class TestFilterCache(unittest.TestCase):
+    """ outputs of cacheable filters reused """
+
+    def setUp(self):
+        """ write filter, use empty support directory """
+        self.directory = tempfile.TemporaryDirectory()
+        self.filter_path = os.path.join(self.directory.name, 'count.py')
+        self.record = os.path.join(self.directory.name, 'record')
+        with open(self.filter_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(COUNT_SCRIPT)
+        os.chmod(self.filter_path, 0o755)
+        document.STYLE_OUTCOMES.clear()
+
+    def tearDown(self):
+        """ remove filter and cache """
+        self.directory.cleanup()
+
+    def run_filter(self, word='alpha', writer='html', output='-'):
+        """ return (document, runs of filter, log) of filtering with word """
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(self.filter_path),
+                    'args': inlines(self.record, word),
+                    'cacheable': {'t': 'MetaBool', 'c': True}})]}})})}
+        doc = document.Document()
+        doc.options['pandoc']['write'] = writer
+        doc.options['pandoc']['output'] = output
+        doc.options['panzer']['panzer_support'] = self.directory.name
+        doc.processes = asyncio.Semaphore(2)
+        doc.populate([{'unMeta': {'style': inlines('Test')}}, []],
+                     styleindex.StyleIndex(styleindex.encode(definitions)))
+        doc.transform()
+        doc.build_runlist()
+        doc.purge_style_fields()
+        with info.keep_log(info.Log()) as log:
+            asyncio.run(doc.pipe_through('filter'))
+        runs = 0
+        if os.path.exists(self.record):
+            with open(self.record, encoding='utf8') as record:
+                runs = record.read().split().count('run')
+            os.remove(self.record)
+        return doc, runs, log
+
+    def test_hit(self):
+        """ filter run on same input again is not run """
+        first, runs, _ = self.run_filter()
+        self.assertEqual(runs, 1)
+        second, runs, _ = self.run_filter()
+        self.assertEqual(runs, 0)
+        self.assertEqual(second.runlist[0]['status'], const.DONE)
+        self.assertEqual(second.ast[1], first.ast[1])
+
+    def test_reserved(self):
+        """ output reused gets this run's json message """
+        self.run_filter(output='first.html')
+        doc, runs, _ = self.run_filter(output='second.html')
+        self.assertEqual(runs, 0)
+        message = meta.get_content(doc.get_metadata(),
+                                   'panzer_reserved')[0]['c'][1]
+        self.assertIn('second.html', message)
+        self.assertNotIn('first.html', message)
+
+    def test_stderr(self):
+        """ messages of filter are shown again when its output is reused """
+        for _ in range(2):
+            log = self.run_filter()[2]
+            self.assertIn('counted', [message['message']
+                                      for message in log.messages])
+
+    def test_invalidated(self):
+        """ changes to executable, arguments or writer run filter again """
+        self.run_filter()
+        self.assertEqual(self.run_filter(word='beta')[1], 1)
+        self.assertEqual(self.run_filter(writer='latex')[1], 1)
+        with open(self.filter_path, 'a', encoding='utf8') as filter_file:
+            filter_file.write('# edited\n')
+        self.assertEqual(self.run_filter()[1], 1)
+        self.assertEqual(self.run_filter()[1], 0)
+
+class TestJsonMessage(unittest.TestCase):
+    """ json message passed to executables """
+
+    def setUp(self):
+        """ write filter, clear outcomes kept by earlier tests """
+        self.directory = tempfile.TemporaryDirectory()
+        self.filter_path = os.path.join(self.directory.name, 'append.py')
+        with open(self.filter_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(APPEND_FILTER)
+        document.STYLE_OUTCOMES.clear()
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'metadata': metamap({'a': inlines('alpha')}),
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(self.filter_path),
+                    'inprocess': {'t': 'MetaBool', 'c': True}})]}})})}
+        self.index = styleindex.StyleIndex(styleindex.encode(definitions))
+
+    def tearDown(self):
+        """ remove filter """
+        self.directory.cleanup()
+
+    def assert_baseline(self, doc):
+        """ check json message of doc is json.dumps of its fields """
+        metadata = {key: value for key, value in doc.get_metadata().items()
+                    if key != 'panzer_reserved'}
+        expected = json.dumps([{'metadata': metadata,
+                                'template': doc.template,
+                                'style': doc.style,
+                                'stylefull': doc.stylefull,
+                                'styledef': doc.styledef,
+                                'runlist': doc.runlist,
+                                'options': doc.options}])
+        message = doc.json_message()
+        self.assertEqual(message, expected)
+        return message
+
+    def test_follows_document(self):
+        """ message changes with each step of converting document """
+        doc = document.Document()
+        doc.options['pandoc']['write'] = 'html'
+        doc.processes = asyncio.Semaphore(2)
+        doc.populate([{'unMeta': {'style': inlines('Test')}}, []], self.index)
+        messages = [self.assert_baseline(doc)]
+        doc.transform()
+        messages.append(self.assert_baseline(doc))
+        doc.build_runlist()
+        messages.append(self.assert_baseline(doc))
+        doc.purge_style_fields()
+        messages.append(self.assert_baseline(doc))
+        with info.keep_log(info.Log()):
+            asyncio.run(doc.pipe_through('filter'))
+        messages.append(self.assert_baseline(doc))
+        self.assertEqual(len(set(messages)), len(messages))
+        self.assertIn('alpha!', messages[-1])
+
+    def test_runlist_status(self):
+        """ message changes with status of runlist entries alone """
+        doc = filter_document(self.index)
+        before = self.assert_baseline(doc)
+        doc.runlist[0]['status'] = const.DONE
+        after = self.assert_baseline(doc)
+        self.assertNotEqual(before, after)
+        self.assertEqual(before.replace(const.QUEUED, const.DONE), after)
+
+class TestParallelScripts(unittest.TestCase):
+    """ scripts run at the same time with ---parallel """
+
+    def setUp(self):
+        """ write scripts, one per name """
+        self.directory = tempfile.TemporaryDirectory()
+        self.record = os.path.join(self.directory.name, 'record')
+        for name in ('slow', 'fast', 'last'):
+            path = self.script(name)
+            with open(path, 'w', encoding='utf8') as script_file:
+                script_file.write(SLEEP_SCRIPT)
+            os.chmod(path, 0o755)
+        document.STYLE_OUTCOMES.clear()
+
+    def tearDown(self):
+        """ remove scripts """
+        self.directory.cleanup()
+
+    def script(self, name):
+        """ return path of script name """
+        return os.path.join(self.directory.name, name + '.py')
+
+    def item(self, name, sleep, after=None):
+        """ return preflight item running script name for sleep seconds """
+        content = {'run': inlines(self.script(name)),
+                   'args': inlines('%s %s' % (sleep, self.record))}
+        if after is not None:
+            content['after'] = inlines(after)
+        return metamap(content)
+
+    def run_preflight(self, items):
+        """ return (names recorded, log messages, stdout) of running items """
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'preflight': {'t': 'MetaList', 'c': items}})})}
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf8')
+        with info.keep_log(info.Log()) as log:
+            doc = filter_document(styleindex.StyleIndex(
+                styleindex.encode(definitions)))
+            doc.options['panzer']['parallel'] = ['preflight']
+            with contextlib.redirect_stdout(stdout):
+                asyncio.run(doc.run_scripts('preflight'))
+        stdout.flush()
+        with open(self.record, encoding='utf8') as record:
+            names = record.read().split()
+        messages = [(message['sender'], message['message'])
+                    for message in log.messages
+                    if message['level'] in ('WARNING', 'ERROR')
+                    or message['sender'] in ('slow', 'fast', 'last')]
+        return names, messages, stdout.buffer.getvalue().decode('utf8')
+
+    def test_after(self):
+        """ script waits for the one named by 'after', but not for others """
+        names, _, _ = self.run_preflight([self.item('slow', 0.5),
+                                          self.item('fast', 0),
+                                          self.item('last', 0, 'slow')])
+        self.assertEqual(names, ['fast', 'slow', 'last'])
+
+    def test_after_unknown(self):
+        """ 'after' naming no earlier script is warned of, and ignored """
+        names, messages, _ = self.run_preflight([
+            self.item('slow', 0.5, 'last'),
+            self.item('last', 0, 'missing')])
+        self.assertEqual(names, ['last', 'slow'])
+        warnings = [message for sender, message in messages
+                    if sender == 'panzer']
+        self.assertEqual(len(warnings), 2)
+        self.assertIn('waits for "last", which is not an earlier preflight',
+                      warnings[0])
+        self.assertIn('waits for "missing"', warnings[1])
+
+    def test_order_of_output(self):
+        """ logs and stdout are in runlist order, whichever finishes first """
+        names, messages, stdout = self.run_preflight([
+            self.item('slow', 0.5),
+            self.item('fast', 0),
+            self.item('last', 0.2)])
+        self.assertEqual(names, ['fast', 'last', 'slow'])
+        self.assertEqual(messages, [('slow', 'slow'), ('fast', 'fast'),
+                                    ('last', 'last')])
+        self.assertEqual(stdout, 'slow\nfast\nlast\n')
+
+class TestPythonFilter(unittest.TestCase):
+    """ python filters run inside panzer """
+
+    def setUp(self):
+        """ write filter, clear outcomes kept by earlier tests """
+        self.directory = tempfile.TemporaryDirectory()
+        self.filter_path = os.path.join(self.directory.name, 'append.py')
+        with open(self.filter_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(APPEND_FILTER)
+        document.STYLE_OUTCOMES.clear()
+
+    def tearDown(self):
+        """ remove filter """
+        self.directory.cleanup()
+
+    def convert(self, index):
+        """ return metadata field 'a' of document with style Test, filtered """
+        doc = filter_document(index)
+        asyncio.run(doc.pipe_through('filter'))
+        return meta.get_content(doc.get_metadata(), 'a')[0]['c']
+
+    def test_twice_in_one_process(self):
+        """ filter changing ast in place leaves shared metadata alone """
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'metadata': metamap({'a': inlines('alpha')}),
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(self.filter_path),
+                    'inprocess': {'t': 'MetaBool', 'c': True}})]}})})}
+        index = styleindex.StyleIndex(styleindex.encode(definitions))
+        self.assertEqual(self.convert(index), 'alpha!')
+        self.assertEqual(self.convert(index), 'alpha!')
+        self.assertEqual(len(document.STYLE_OUTCOMES), 1)
+
+    def run_broken(self, *texts):
+        """ return document filtered by inprocess filters written with texts """
+        items = list()
+        for i, text in enumerate(texts):
+            path = os.path.join(self.directory.name, 'broken%d.py' % i)
+            with open(path, 'w', encoding='utf8') as filter_file:
+                filter_file.write(text)
+            items.append(metamap({
+                'run': inlines(path),
+                'inprocess': {'t': 'MetaBool', 'c': True}}))
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'filter': {'t': 'MetaList', 'c': items}})})}
+        doc = filter_document(styleindex.StyleIndex(
+            styleindex.encode(definitions)))
+        self.log = info.Log()
+        with info.keep_log(self.log):
+            asyncio.run(doc.pipe_through('filter'))
+        return doc
+
+    def test_failure_discarded(self):
+        """ changes made by filter that fails are thrown away """
+        doc = self.run_broken(FAIL_FILTER)
+        self.assertEqual(doc.runlist[0]['status'], const.FAILED)
+        self.assertEqual(doc.ast[1], [])
+
+    def test_failure_discards_run(self):
+        """ filter that fails throws away changes of earlier ones in its run """
+        doc = self.run_broken(PARA_FILTER, FAIL_FILTER, PARA_FILTER)
+        statuses = [entry['status'] for entry in doc.runlist]
+        self.assertEqual(statuses, [const.DONE, const.FAILED, const.DONE])
+        self.assertEqual(len(doc.ast[1]), 1)
+        self.assertIn('WARNING', [item['level'] for item in self.log.messages])
+
+    def test_returns_none(self):
+        """ filter that returns no ast fails, leaving the document's """
+        doc = self.run_broken(NONE_FILTER)
+        self.assertEqual(doc.runlist[0]['status'], const.FAILED)
+        self.assertEqual(doc.ast[1], [])
+        doc.json_message()
+
+    def test_timeout(self):
+        """ filter running past its timeout fails without waiting for it """
+        slow_path = os.path.join(self.directory.name, 'slow.py')
+        with open(slow_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(SLOW_FILTER)
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(slow_path),
+                    'inprocess': {'t': 'MetaBool', 'c': True},
+                    'timeout': inlines('0.1')})]}})})}
+        doc = filter_document(styleindex.StyleIndex(
+            styleindex.encode(definitions)))
+        start = time.time()
+        with info.keep_log(info.Log()):
+            asyncio.run(doc.pipe_through('filter'))
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(doc.runlist[0]['status'], const.FAILED)
+
+    def test_timed_out_does_not_block(self):
+        """ filter that timed out and runs on leaves others free to run """
+        self.test_timeout()
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'metadata': metamap({'a': inlines('alpha')}),
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(self.filter_path),
+                    'inprocess': {'t': 'MetaBool', 'c': True}})]}})})}
+        start = time.time()
+        self.assertEqual(self.convert(styleindex.StyleIndex(
+            styleindex.encode(definitions))), 'alpha!')
+        self.assertLess(time.time() - start, 0.3)
+
+    def test_event_loop_free(self):
+        """ slow filter leaves event loop, and its stdout, to others """
+        slow_path = os.path.join(self.directory.name, 'slow.py')
+        with open(slow_path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(SLOW_FILTER)
+        definitions = {
+            'Test': metamap({'all': metamap({
+                'filter': {'t': 'MetaList', 'c': [metamap({
+                    'run': inlines(slow_path),
+                    'inprocess': {'t': 'MetaBool', 'c': True}})]}})})}
+        doc = filter_document(styleindex.StyleIndex(
+            styleindex.encode(definitions)))
+        ticks = list()
+        async def tick():
+            """ write to stdout until filter is done """
+            while doc.runlist[0]['status'] != const.DONE:
+                print('tick')
+                ticks.append(1)
+                await asyncio.sleep(0.05)
+        async def run_both():
+            """ run filter while ticking """
+            await asyncio.gather(doc.pipe_through('filter'), tick())
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            asyncio.run(run_both())
+        self.assertGreater(len(ticks), 3)
+        self.assertEqual(stdout.getvalue(), 'tick\n' * len(ticks))
+        self.assertNotIn('slow', stdout.getvalue())
+
+class TestDirect(unittest.TestCase):
+    """ pandoc reading source directly, or falling back to its ast """
+
+    def setUp(self):
+        """ clear outcomes kept by earlier tests """
+        document.STYLE_OUTCOMES.clear()
+
+    def direct_options(self, style, front=None, writer='html'):
+        """ return direct options of document with front, style Test """
+        if front is None:
+            front = {'style': 'Test'}
+        doc = document.Document()
+        doc.options['pandoc']['write'] = writer
+        index = styleindex.StyleIndex(styleindex.encode({
+            'Test': metamap({'all': metamap(style)})}))
+        return doc.direct_options(front, index)
+
+    def test_metadata(self):
+        """ plain fields set by styles are given to pandoc """
+        options = self.direct_options({'metadata': metamap({
+            'a': inlines('alpha'),
+            'b': {'t': 'MetaBool', 'c': True}})})
+        self.assertEqual(options, ['--metadata', 'a=alpha',
+                                   '--metadata', 'b=true',
+                                   '--metadata', 'style=false'])
+
+    def test_field_in_source(self):
+        """ field set by source is left to pandoc's reader """
+        options = self.direct_options(
+            {'metadata': metamap({'a': inlines('alpha')})},
+            front={'style': 'Test', 'a': 'beta'})
+        self.assertEqual(options, ['--metadata', 'style=false'])
+
+    def test_preflight(self):
+        """ style running a preflight script needs the ast """
+        self.assertIsNone(self.direct_options({
+            'preflight': {'t': 'MetaList', 'c': [metamap({
+                'run': inlines('script.py')})]}}))
+
+    def test_postprocess(self):
+        """ style running a postprocessor does not need the ast """
+        self.assertEqual(self.direct_options({
+            'postprocess': {'t': 'MetaList', 'c': [metamap({
+                'run': inlines('sed')})]}}),
+                         ['--metadata', 'style=false'])
+
+    def test_not_plain(self):
+        """ field that is not a plain string needs the ast """
+        emphasis = {'t': 'MetaInlines', 'c': [
+            {'t': 'Emph', 'c': [{'t': 'Str', 'c': 'alpha'}]}]}
+        self.assertIsNone(self.direct_options({'metadata': metamap({
+            'a': emphasis})}))
+        self.assertIsNone(self.direct_options({'metadata': metamap({
+            'a': inlines('a--b')})}))
+
+    def test_metadata_writer(self):
+        """ writer outputting the 'style' field needs the ast """
+        for writer in ('json', 'markdown', 'markdown_github+smart'):
+            self.assertIsNone(self.direct_options(dict(), writer=writer),
+                              writer)
+        self.assertIsNotNone(self.direct_options(dict(), front=dict(),
+                                                 writer='json'))
+
+    def test_document_fields(self):
+        """ template, styledef or runlist set by source needs the ast """
+        for field in ('template', 'styledef', 'filter', 'panzer_reserved'):
+            self.assertIsNone(self.direct_options(
+                dict(), front={'style': 'Test', field: 'x'}), field)
+
+    def test_command_line_filter(self):
+        """ filter given on command line needs the ast """
+        doc = document.Document()
+        doc.options['pandoc']['write'] = 'html'
+        doc.options['pandoc']['filter'] = ['filter.py']
+        self.assertFalse(doc.may_run_directly(dict()))
+
+    def test_metadata_option(self):
+        """ only plain strings and booleans are passed on command line """
+        self.assertEqual(document.metadata_option('a', inlines('x')), 'a=x')
+        self.assertEqual(document.metadata_option(
+            'a', {'t': 'MetaString', 'c': '1.5'}), 'a=1.5')
+        self.assertEqual(document.metadata_option(
+            'a', {'t': 'MetaBool', 'c': False}), 'a=false')
+        for key, value in [('a=b', inlines('x')),
+                           ('a', inlines('true')),
+                           ('a', inlines('x*y')),
+                           ('a', {'t': 'MetaString', 'c': ''}),
+                           ('a', {'t': 'MetaString', 'c': ' x'}),
+                           ('a', {'t': 'MetaList', 'c': [inlines('x')]})]:
+            self.assertIsNone(document.metadata_option(key, value),
+                              (key, value))
+
+def filter_document(index):
+    """ return document with style Test, ready to run filters """
+    doc = document.Document()
+    doc.options['pandoc']['write'] = 'html'
+    doc.processes = asyncio.Semaphore(2)
+    doc.populate([{'unMeta': {'style': inlines('Test')}}, []], index)
+    doc.transform()
+    doc.build_runlist()
+    doc.purge_style_fields()
+    return doc
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of converting documents from start to finish
+
+syntax: test_engine.py
+    or: python -m pytest test/
+
+A stub pandoc, written in python, is put first on PATH, so pandoc itself
+is not needed. It reads the first line of a source document as a single
+paragraph, and writes each paragraph as <p>...</p>. When writing anything
+but json, it writes nothing and exits with the status in environment
+variable STUB_PANDOC_EXIT, if set. If environment variable
+STUB_PANDOC_RECORD is set, it adds 'start' and 'end' lines to the file it
+names as it starts and ends, taking 0.1 seconds in between.
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import api
+from panzer import cli
+from panzer import const
+from panzer import daemon
+from panzer import document
+from panzer import engine
+from panzer import error
+from panzer import info
+from panzer import load
+from panzer import watch
+
+STUB_PANDOC = '''#!%s
+import atexit
+import json
+import os
+import sys
+import time
+args = sys.argv[1:]
+record = os.environ.get('STUB_PANDOC_RECORD')
+if record:
+    def mark(event):
+        """ add event to record """
+        with open(record, 'a') as record_file:
+            record_file.write(event + '\\n')
+    mark('start')
+    atexit.register(mark, 'end')
+    time.sleep(0.1)
+writer = args[args.index('--write') + 1]
+if args[0] == '-':
+    ast = json.load(sys.stdin)
+else:
+    with open(args[0], encoding='utf8') as source:
+        text = source.readline().strip()
+    ast = [{'unMeta': {}}, [{'t': 'Para', 'c': [{'t': 'Str', 'c': text}]}]]
+if writer == 'json':
+    sys.stdout.write(json.dumps(ast))
+    sys.exit(0)
+status = int(os.environ.get('STUB_PANDOC_EXIT', '0'))
+if status:
+    sys.stderr.write('writer failed\\n')
+    sys.exit(status)
+for block in ast[1]:
+    sys.stdout.write('<p>%%s</p>\\n'
+                     %% ' '.join(inline['c'] for inline in block['c']))
+''' % sys.executable
+
+class EngineTestCase(unittest.TestCase):
+    """ conversions run with a stub pandoc and an empty support directory """
+
+    def setUp(self):
+        """ write stub pandoc and support directory, put pandoc on PATH """
+        self.directory = tempfile.TemporaryDirectory()
+        bin_dir = self.path('bin')
+        os.mkdir(bin_dir)
+        write_executable(os.path.join(bin_dir, 'pandoc'), STUB_PANDOC)
+        self.support = self.path('support')
+        os.mkdir(self.support)
+        write_file(os.path.join(self.support, 'styles.yaml'),
+                   'Base:\n  all:\n    metadata:\n      base: true\n')
+        environment = {'PATH': bin_dir + os.pathsep + os.environ['PATH']}
+        self.environment = mock.patch.dict(os.environ, environment)
+        self.environment.start()
+
+    def tearDown(self):
+        """ restore PATH, remove files """
+        self.environment.stop()
+        self.directory.cleanup()
+
+    def path(self, *names):
+        """ return path of names in temporary directory """
+        return os.path.join(self.directory.name, *names)
+
+    def convert(self, source, options=None):
+        """ return api.Result of converting source to html in out.html """
+        return api.convert(self.path(source), 'html', options, self.support,
+                           output=self.path('out.html'))
+
+class TestAstCache(EngineTestCase):
+    """ ---cache-ast """
+
+    def load(self, options=()):
+        """ return (ast, number of times pandoc ran) of loading a.md """
+        options = cli.parse_cli_options(
+            document.Document().options,
+            ['---panzer-support', self.support, '---cache-ast']
+            + list(options) + [self.path('a.md')])
+        record = self.path('record')
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_RECORD': record}), \
+             info.keep_log(info.Log()):
+            ast = asyncio.run(load.load(options, asyncio.Semaphore(1)))
+        runs = 0
+        if os.path.exists(record):
+            runs = read_file(record).split().count('start')
+            os.remove(record)
+        return ast, runs
+
+    def test_hit(self):
+        """ unchanged source is read from the cache """
+        write_file(self.path('a.md'), 'alpha\n')
+        first, runs = self.load()
+        self.assertEqual(runs, 1)
+        second, runs = self.load()
+        self.assertEqual(runs, 0)
+        self.assertEqual(first, second)
+
+    def test_source_changed(self):
+        """ changed source is read again """
+        write_file(self.path('a.md'), 'alpha\n')
+        self.load()
+        write_file(self.path('a.md'), 'beta\n')
+        ast, runs = self.load()
+        self.assertEqual(runs, 1)
+        self.assertEqual(ast[1][0]['c'][0]['c'], 'beta')
+
+    def test_options(self):
+        """ options that change the reader miss, writer's options hit """
+        write_file(self.path('a.md'), 'alpha\n')
+        self.load()
+        self.assertEqual(self.load(['--toc'])[1], 0)
+        self.assertEqual(self.load(['--tab-stop=2'])[1], 1)
+        self.assertEqual(self.load(['--columns=40'])[1], 1)
+        self.assertEqual(self.load(['--read', 'markdown+smart'])[1], 1)
+
+    def test_missing_source(self):
+        """ missing source is left for pandoc to report """
+        with self.assertRaises(error.BadASTError):
+            self.load()
+
+class TestIncremental(EngineTestCase):
+    """ ---incremental """
+
+    def test_unchanged(self):
+        """ output made without errors is not made again """
+        write_file(self.path('a.md'), 'alpha\n')
+        self.assertEqual(self.convert('a.md', ['---incremental']).status,
+                         const.DONE)
+        result = self.convert('a.md', ['---incremental'])
+        self.assertTrue(any('is up to date' in message['message']
+                            for message in result.log))
+
+    def test_pandoc_failed(self):
+        """ output is made again if pandoc failed last time """
+        write_file(self.path('a.md'), 'alpha\n')
+        self.convert('a.md', ['---incremental'])
+        write_file(self.path('a.md'), 'beta\n')
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_EXIT': '43'}):
+            result = self.convert('a.md', ['---incremental'])
+        self.assertTrue(any(message['level'] == 'ERROR'
+                            and message['sender'] == 'pandoc'
+                            and '43' in message['message']
+                            for message in result.log))
+        self.assertEqual(read_file(self.path('out.html')), '<p>alpha</p>\n')
+        result = self.convert('a.md', ['---incremental'])
+        self.assertFalse(any('is up to date' in message['message']
+                             for message in result.log))
+        self.assertEqual(read_file(self.path('out.html')), '<p>beta</p>\n')
+
+class TestConvert(EngineTestCase):
+    """ api.convert """
+
+    def test_pandoc_failed(self):
+        """ conversion whose pandoc fails is failed, with no output """
+        write_file(self.path('a.md'), 'alpha\n')
+        self.assertEqual(self.convert('a.md').status, const.DONE)
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_EXIT': '43'}):
+            result = self.convert('a.md')
+        self.assertEqual(result.status, const.FAILED)
+        self.assertEqual(result.error, 'pandoc failed')
+        self.assertIsNone(result.output)
+
+class TestBatch(EngineTestCase):
+    """ panzer-batch """
+
+    def batch(self, jobs, *arguments):
+        """ return finished process of panzer-batch run on list of jobs """
+        manifest = self.path('manifest.json')
+        write_file(manifest, json.dumps(jobs))
+        # - a default support directory, so that panzer does not ask for one
+        home = self.path('home')
+        os.makedirs(os.path.join(home, '.panzer'), exist_ok=True)
+        environment = dict(os.environ)
+        environment['HOME'] = home
+        return subprocess.run([sys.executable, '-m', 'panzer.batch',
+                               manifest, '---panzer-support', self.support]
+                              + list(arguments),
+                              cwd=os.path.join(os.path.dirname(
+                                  os.path.abspath(__file__)), '..'),
+                              env=environment,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True)
+
+    def test_jobs(self):
+        """ jobs are converted together, each failing on its own """
+        jobs = list()
+        for name in ('a', 'b', 'c', 'missing'):
+            if name != 'missing':
+                write_file(self.path(name + '.md'), name + '\n')
+            jobs.append({'input': self.path(name + '.md'),
+                         'output': self.path(name + '.html')})
+        jobs.append({'input': self.path('a.md'),
+                     'output': self.path('d.html'),
+                     'arguments': ['---jobs', 'x']})
+        process = self.batch(jobs)
+        self.assertEqual(process.returncode, 1)
+        self.assertIn('3 done, 2 failed', process.stderr)
+        self.assertIn('invalid arguments', process.stderr)
+        for name in 'abc':
+            self.assertEqual(read_file(self.path(name + '.html')),
+                             '<p>%s</p>\n' % name)
+
+    def test_pandoc_failed(self):
+        """ job whose pandoc fails is counted as failed """
+        write_file(self.path('a.md'), 'alpha\n')
+        jobs = [{'input': self.path('a.md'), 'output': self.path('a.html')}]
+        self.assertEqual(self.batch(jobs).returncode, 0)
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_EXIT': '43'}):
+            process = self.batch(jobs)
+        self.assertEqual(process.returncode, 1)
+        self.assertIn('0 done, 1 failed', process.stderr)
+
+    def test_slots(self):
+        """ workers share ---jobs slots for external processes """
+        jobs = list()
+        for name in 'abcdef':
+            write_file(self.path(name + '.md'), name + '\n')
+            jobs.append({'input': self.path(name + '.md'),
+                         'output': self.path(name + '.html')})
+        record = self.path('record')
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_RECORD': record}):
+            process = self.batch(jobs, '---jobs', '2', '---workers', '2')
+        self.assertEqual(process.returncode, 0)
+        running = list()
+        for event in read_file(record).split():
+            running.append((running[-1] if running else 0)
+                           + (1 if event == 'start' else -1))
+        self.assertLessEqual(max(running), 2)
+
+class TestDaemon(EngineTestCase):
+    """ requests served by panzer-daemon """
+
+    def serve(self, arguments, default_support):
+        """ return (status, stderr) of request with arguments
+
+        default_support is the default support directory while it runs.
+        """
+        write_file(self.path('a.md'), 'alpha\n')
+        request = {'cwd': self.directory.name,
+                   'environment': dict(os.environ),
+                   'arguments': arguments + ['---panzer-support', self.support,
+                                             '--output', self.path('a.html'),
+                                             self.path('a.md')]}
+        wfile = io.BytesIO()
+        connection = daemon.Connection(io.BytesIO(), wfile)
+        with mock.patch.object(const, 'DEFAULT_SUPPORT_DIR', default_support):
+            status = daemon.convert(request, connection)
+        # - restore logging to the real stderr, as the daemon does
+        info.start_logger(document.Document().options)
+        stderr = bytes()
+        frames = wfile.getvalue()
+        while frames:
+            length = struct.unpack('>I', frames[:4])[0]
+            message = json.loads(frames[4:4 + length].decode('utf8'))
+            stderr += base64.b64decode(message.get('stderr', ''))
+            frames = frames[4 + length:]
+        return status, stderr.decode('utf8')
+
+    def test_watch_rejected(self):
+        """ request to watch fails instead of never returning """
+        status, stderr = self.serve(['---watch'], self.support)
+        self.assertEqual(status, 1)
+        self.assertIn('cannot watch', stderr)
+
+    def test_no_default_support(self):
+        """ missing default support directory fails instead of asking """
+        status, stderr = self.serve(list(), self.path('missing'))
+        self.assertEqual(status, 1)
+        self.assertIn('not found', stderr)
+        self.assertFalse(os.path.exists(self.path('missing')))
+
+class TestWatch(EngineTestCase):
+    """ ---watch """
+
+    def test_template_deadline(self):
+        """ document kept for template rebuild gets the new deadline """
+        write_file(self.path('a.md'), 'alpha\n')
+        options = cli.parse_cli_options(
+            document.Document().options,
+            ['---panzer-support', self.support, '---deadline', '100',
+             '--output', self.path('out.html'), self.path('a.md')])
+        state = {'ast': None, 'doc': None}
+        asyncio.run(watch.rebuild(state, options, 'source',
+                                  asyncio.Semaphore(1)))
+        first = json.loads(state['doc'].json_message())[0]
+        time.sleep(0.01)
+        asyncio.run(watch.rebuild(state, options, 'template',
+                                  asyncio.Semaphore(1)))
+        second = json.loads(state['doc'].json_message())[0]
+        self.assertEqual(second['options']['panzer']['deadline_time'],
+                         options['panzer']['deadline_time'])
+        self.assertGreater(second['options']['panzer']['deadline_time'],
+                           first['options']['panzer']['deadline_time'])
+
+class TestConvertAll(EngineTestCase):
+    """ documents converted at the same time """
+
+    def test_convert_all(self):
+        """ documents are converted sharing jobs, failing on their own """
+        docs = list()
+        for name in ('a', 'b', 'c', 'd', 'missing'):
+            if name != 'missing':
+                write_file(self.path(name + '.md'), name + '\n')
+            doc = document.Document()
+            doc.options = cli.parse_cli_options(
+                doc.options,
+                ['---panzer-support', self.support,
+                 '--output', self.path(name + '.html'),
+                 self.path(name + '.md')])
+            docs.append(doc)
+        record = self.path('record')
+        with mock.patch.dict(os.environ, {'STUB_PANDOC_RECORD': record}), \
+             info.keep_log(info.Log()):
+            outcomes = asyncio.run(engine.convert_all(docs, jobs=2))
+        for name, outcome in zip('abcd', outcomes):
+            self.assertIsInstance(outcome, document.Document)
+            self.assertEqual(read_file(self.path(name + '.html')),
+                             '<p>%s</p>\n' % name)
+        self.assertIsInstance(outcomes[4], error.BadASTError)
+        self.assertFalse(os.path.exists(self.path('missing.html')))
+        # - no more than jobs pandoc processes ran at once
+        running = list()
+        for event in read_file(record).split():
+            running.append((running[-1] if running else 0)
+                           + (1 if event == 'start' else -1))
+        self.assertEqual(max(running), 2)
+
+def write_file(filename, text):
+    """ write text to filename """
+    with open(filename, 'w', encoding='utf8') as output_file:
+        output_file.write(text)
+
+def write_executable(filename, text):
+    """ write text to filename, and make it executable """
+    write_file(filename, text)
+    os.chmod(filename, 0o755)
+
+def read_file(filename):
+    """ return text of filename """
+    with open(filename, encoding='utf8') as input_file:
+        return input_file.read()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of reading metadata of source documents without pandoc, and of
+loading style definitions
+
+syntax: test_load.py
+    or: python -m pytest test/
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import cache
+from panzer import const
+from panzer import document
+from panzer import info
+from panzer import load
+from panzer import yamlmeta
+
+from helpers import inlines
+
+SOURCE = '''---
+title: A title
+style: Test
+...
+
+Some text.
+'''
+
+@unittest.skipUnless(yamlmeta.available(), 'pyyaml not installed')
+class TestScanMetadata(unittest.TestCase):
+    """ metadata of source found, or left for pandoc's reader """
+
+    def setUp(self):
+        """ write source document """
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = self.write_source('source.md', SOURCE)
+
+    def tearDown(self):
+        """ remove source document """
+        self.directory.cleanup()
+
+    def write_source(self, name, text):
+        """ return path of source document name written with text """
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf8') as source_file:
+            source_file.write(text)
+        return path
+
+    def scan(self, inputs, read='', options=()):
+        """ return scanned metadata of inputs """
+        doc_options = document.Document().options
+        doc_options['pandoc']['input'] = inputs
+        doc_options['pandoc']['read'] = read
+        doc_options['pandoc']['options'] = list(options)
+        return load.scan_metadata(doc_options)
+
+    def test_markdown(self):
+        """ yaml metadata block of markdown is read """
+        self.assertEqual(self.scan([self.source]), {'title': 'A title',
+                                                    'style': 'Test'})
+        self.assertEqual(self.scan([self.source], read='markdown+smart'),
+                         {'title': 'A title', 'style': 'Test'})
+
+    def test_first_value_kept(self):
+        """ field set by several sources keeps its first value """
+        second = self.write_source('second.md', '---\ntitle: Other\n...\n')
+        self.assertEqual(self.scan([self.source, second])['title'],
+                         'A title')
+
+    def test_command_line_metadata(self):
+        """ metadata set on command line is left for pandoc """
+        for options in (['-M', 'a=b'], ['-Ma=b'], ['--metadata', 'a=b'],
+                        ['--metadata=a=b']):
+            self.assertIsNone(self.scan([self.source], options=options),
+                              options)
+
+    def test_not_markdown(self):
+        """ sources read by other readers are left for pandoc """
+        self.assertIsNone(self.scan([self.source], read='latex'))
+        self.assertIsNone(self.scan([self.source],
+                                    read='markdown-yaml_metadata_block'))
+        latex = self.write_source('source.tex', SOURCE)
+        self.assertIsNone(self.scan([latex]))
+
+    def test_unreadable(self):
+        """ missing source, or no source, is left for pandoc """
+        self.assertIsNone(self.scan([os.path.join(self.directory.name,
+                                                  'missing.md')]))
+        self.assertIsNone(self.scan([]))
+
+    def test_title_block(self):
+        """ source starting with a pandoc title block is left for pandoc """
+        titled = self.write_source('titled.md',
+                                   '% Real Title\n% Author\n\nBody\n')
+        self.assertIsNone(self.scan([titled]))
+        self.assertIsNone(self.scan([self.source, titled]))
+        self.assertEqual(self.scan([titled],
+                                   read='markdown-pandoc_title_block'),
+                         dict())
+
+    def test_not_mapping(self):
+        """ metadata block that is not a yaml mapping is left for pandoc """
+        listed = self.write_source('list.md', '---\n- a\n- b\n...\n')
+        self.assertIsNone(self.scan([listed]))
+
+@unittest.skipUnless(yamlmeta.available(), 'pyyaml not installed')
+class TestLoadStyledef(unittest.TestCase):
+    """ style definitions read from styles.yaml and styles.d/ """
+
+    def setUp(self):
+        """ write styles.yaml and two files in styles.d/ """
+        self.directory = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self.directory.name, const.STYLES_DIR))
+        self.write_styles('styles.yaml', 'Base: base\nTest: base\n')
+        self.write_styles(os.path.join(const.STYLES_DIR, 'b.yaml'),
+                          'Test: b\n')
+        self.write_styles(os.path.join(const.STYLES_DIR, 'a.yml'),
+                          'Test: a\nOther: a\n')
+        self.options = document.Document().options
+        self.options['panzer']['panzer_support'] = self.directory.name
+
+    def tearDown(self):
+        """ remove support directory """
+        self.directory.cleanup()
+
+    def write_styles(self, name, text):
+        """ write styles file name in support directory with text """
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf8') as styles_file:
+            styles_file.write(text)
+
+    def load(self):
+        """ return (index, number of files converted) of loading styles """
+        with mock.patch.object(yamlmeta, 'convert',
+                               wraps=yamlmeta.convert) as convert, \
+             info.keep_log(info.Log()):
+            index = load.load_styledef(self.options)
+        return index, convert.call_count
+
+    def cached(self):
+        """ return number of entries in the styles cache """
+        directory = os.path.join(cache.cache_dir(self.options), 'styledef')
+        return len([name for name in os.listdir(directory)
+                    if name.endswith('.json')])
+
+    def test_last_read_wins(self):
+        """ styles.d/ is read after styles.yaml, in order of filename """
+        index = self.load()[0]
+        self.assertEqual(index['Base'], inlines('base'))
+        self.assertEqual(index['Other'], inlines('a'))
+        self.assertEqual(index['Test'], inlines('b'))
+
+    def test_fragments_cached(self):
+        """ unchanged files are not converted again """
+        first, converted = self.load()
+        self.assertEqual(converted, 3)
+        second, converted = self.load()
+        self.assertEqual(converted, 0)
+        self.assertEqual(dict(second.encoded), dict(first.encoded))
+
+    def test_edit_invalidates(self):
+        """ edited file alone is converted again, its old entry removed """
+        self.load()
+        self.assertEqual(self.cached(), 3)
+        self.write_styles(os.path.join(const.STYLES_DIR, 'b.yaml'),
+                          'Test: edited\n')
+        index, converted = self.load()
+        self.assertEqual(converted, 1)
+        self.assertEqual(index['Test'], inlines('edited'))
+        self.assertEqual(self.cached(), 3)
+
+    def test_mode_invalidates(self):
+        """ files are converted again when the conversion method changes """
+        self.load()
+        self.options['panzer']['plain_styledef'] = True
+        self.assertEqual(self.load()[1], 3)
+
+if __name__ == '__main__':
+    unittest.main()
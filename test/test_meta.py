@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of metadata handling: style hierarchy and run lists
+
+syntax: test_meta.py
+    or: python -m pytest test/
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import document
+from panzer import error
+from panzer import info
+from panzer import meta
+
+from helpers import inlines
+from helpers import metamap
+
+class TestStyleHierarchy(unittest.TestCase):
+    """ expanding styles to include their parents """
+
+    def test_parents_first(self):
+        """ chain of parents is expanded root first """
+        styledef = {'A': style(),
+                    'B': style('A'),
+                    'C': style('B')}
+        self.assertEqual(meta.expand_style_hierarchy(['C'], styledef),
+                         ['A', 'B', 'C'])
+
+    def test_diamond(self):
+        """ ancestor shared by two parents appears once """
+        styledef = {'Base': style(),
+                    'Left': style('Base'),
+                    'Right': style('Base'),
+                    'Top': style('Left', 'Right')}
+        self.assertEqual(meta.expand_style_hierarchy(['Top'], styledef),
+                         ['Base', 'Left', 'Right', 'Top'])
+
+    def test_diamond_across_stylelist(self):
+        """ styles listed together share their ancestors """
+        styledef = {'Base': style(),
+                    'Left': style('Base'),
+                    'Right': style('Base')}
+        self.assertEqual(meta.expand_style_hierarchy(['Left', 'Right'],
+                                                     styledef),
+                         ['Base', 'Left', 'Right'])
+
+    def test_memo_reused(self):
+        """ expansion kept in memo is used on the next call """
+        styledef = {'A': style(),
+                    'B': style('A')}
+        memo = dict()
+        meta.expand_style_hierarchy(['B'], styledef, memo)
+        self.assertEqual(memo['B'], ['A', 'B'])
+        memo['B'] = ['kept']
+        self.assertEqual(meta.expand_style_hierarchy(['B'], styledef, memo),
+                         ['kept'])
+
+    def test_missing_parent_not_kept(self):
+        """ expansion with a missing ancestor is logged every time """
+        styledef = {'A': style('Missing'),
+                    'B': style('A')}
+        memo = dict()
+        for _ in range(2):
+            log = info.Log()
+            with info.keep_log(log):
+                self.assertEqual(
+                    meta.expand_style_hierarchy(['B'], styledef, memo),
+                    ['A', 'B'])
+            self.assertEqual(len(log.messages), 1)
+            self.assertIn('"Missing"', log.messages[0]['message'])
+        self.assertEqual(memo, dict())
+
+    def test_cycle(self):
+        """ style that is its own ancestor is an error """
+        styledef = {'A': style('C'),
+                    'B': style('A'),
+                    'C': style('B')}
+        with self.assertRaises(error.StyleCycleError) as caught:
+            meta.expand_style_hierarchy(['C'], styledef)
+        self.assertIn('C -> B -> A -> C', str(caught.exception))
+
+    def test_own_parent(self):
+        """ style that is its own parent is an error """
+        styledef = {'A': style('A')}
+        with self.assertRaises(error.StyleCycleError):
+            meta.expand_style_hierarchy(['A'], styledef)
+
+class TestKillRules(unittest.TestCase):
+    """ removing run list items with kill and killall """
+
+    def test_kill(self):
+        """ kill removes earlier items running the command """
+        runlist = [run('a.py'), run('b.py'), run('a.py'), kill('a.py')]
+        self.assertEqual(commands(meta.apply_kill_rules(runlist)), ['b.py'])
+
+    def test_kill_later_run_kept(self):
+        """ kill leaves items added after it """
+        runlist = [run('a.py'), kill('a.py'), run('a.py'), run('b.py')]
+        self.assertEqual(commands(meta.apply_kill_rules(runlist)),
+                         ['a.py', 'b.py'])
+
+    def test_kill_stringified(self):
+        """ kill matches run by text, whatever its inline structure """
+        spaced = {'t': 'MetaInlines',
+                  'c': [{'t': 'Str', 'c': 'my'},
+                        {'t': 'Space', 'c': []},
+                        {'t': 'Str', 'c': 'filter.py'}]}
+        runlist = [metamap({'run': spaced}), run('b.py'),
+                   kill('my filter.py')]
+        self.assertEqual(commands(meta.apply_kill_rules(runlist)), ['b.py'])
+
+    def test_kill_missing(self):
+        """ kill of command not on the list changes nothing """
+        runlist = [run('a.py'), kill('c.py'), run('b.py')]
+        self.assertEqual(commands(meta.apply_kill_rules(runlist)),
+                         ['a.py', 'b.py'])
+
+    def test_killall(self):
+        """ killall removes all earlier items """
+        runlist = [run('a.py'), run('b.py'),
+                   metamap({'killall': {'t': 'MetaBool', 'c': True}}),
+                   run('c.py'), kill('a.py')]
+        self.assertEqual(commands(meta.apply_kill_rules(runlist)), ['c.py'])
+
+class TestRunlist(unittest.TestCase):
+    """ building run list entries from metadata """
+
+    def get_runlist(self, item):
+        """ return (run list of filter item, list of messages logged) """
+        metadata = {'filter': {'t': 'MetaList', 'c': [metamap(item)]}}
+        options = document.Document().options
+        with info.keep_log(info.Log()) as log:
+            runlist = meta.get_runlist(metadata, 'filter', options)
+        return runlist, [message['message'] for message in log.messages]
+
+    def test_limits(self):
+        """ limits are kept in entry """
+        runlist, messages = self.get_runlist({
+            'run': inlines('a.py'),
+            'memory': inlines('100'),
+            'timeout': {'t': 'MetaString', 'c': '2.5'}})
+        self.assertEqual(runlist[0]['limits'], {'memory': 100.0,
+                                                'timeout': 2.5})
+        self.assertEqual(messages, [])
+
+    def test_limits_inprocess(self):
+        """ memory and cpu limits on filter run inside panzer are warned of """
+        _, messages = self.get_runlist({
+            'run': inlines('a.py'),
+            'inprocess': {'t': 'MetaBool', 'c': True},
+            'memory': inlines('100'),
+            'cpu': inlines('1'),
+            'timeout': inlines('1')})
+        self.assertEqual(len(messages), 1)
+        self.assertIn('"memory", "cpu"', messages[0])
+        self.assertIn('inprocess', messages[0])
+
+    def test_limits_resident(self):
+        """ memory and cpu limits on resident filter are warned of """
+        _, messages = self.get_runlist({
+            'run': inlines('a.py'),
+            'resident': {'t': 'MetaBool', 'c': True},
+            'cpu': inlines('1')})
+        self.assertEqual(len(messages), 1)
+        self.assertIn('resident', messages[0])
+
+def run(command):
+    """ return run list item running command """
+    return metamap({'run': inlines(command)})
+
+def kill(command):
+    """ return run list item killing command """
+    return metamap({'kill': inlines(command)})
+
+def commands(runlist):
+    """ return text of 'run' of each item of runlist """
+    return [item['c']['run']['c'][-1]['c'] for item in runlist]
+
+def style(*parents):
+    """ return definition of style with parents """
+    content = {'all': metamap(dict())}
+    if parents:
+        content['parent'] = {'t': 'MetaList',
+                             'c': [inlines(parent) for parent in parents]}
+    return metamap(content)
+
+if __name__ == '__main__':
+    unittest.main()
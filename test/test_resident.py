@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of resident filters and the frames they are spoken to through
+
+syntax: test_resident.py
+    or: python -m pytest test/
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PACKAGE_DIR)
+
+from panzer import error
+from panzer import resident
+
+# resident filter that adds its arguments and pid to the document, using
+# `resident.serve`
+SERVE_FILTER = '''#!%s
+import json
+import os
+import sys
+sys.path.insert(0, %r)
+from panzer import resident
+
+def action(ast, arguments):
+    print('ignored')
+    sys.stderr.write(json.dumps({'level': 'INFO', 'message': 'seen'}) + '\\n')
+    words = arguments + [str(os.getpid())]
+    ast[1].append({'t': 'Para', 'c': [{'t': 'Str', 'c': ' '.join(words)}]})
+    return ast
+
+resident.serve(action)
+''' % (sys.executable, PACKAGE_DIR)
+
+# resident filter that replies with something other than an ast
+NOT_AST_FILTER = '''#!%s
+import sys
+sys.path.insert(0, %r)
+from panzer import resident
+resident.serve(lambda ast, arguments: None)
+''' % (sys.executable, PACKAGE_DIR)
+
+# resident filter that exits after its first request
+EXIT_FILTER = '''#!%s
+import sys
+sys.path.insert(0, %r)
+from panzer import resident
+body = resident.read_frame(sys.stdin.buffer)
+sys.exit(1)
+''' % (sys.executable, PACKAGE_DIR)
+
+# resident filter that never reads its requests
+HANG_FILTER = '''#!%s
+import time
+time.sleep(60)
+''' % sys.executable
+
+class TestFrames(unittest.TestCase):
+    """ frames written to and read from a pipe """
+
+    def setUp(self):
+        """ open pipe """
+        read_end, write_end = os.pipe()
+        self.reader = os.fdopen(read_end, 'rb')
+        self.writer = os.fdopen(write_end, 'wb')
+
+    def tearDown(self):
+        """ close pipe """
+        self.reader.close()
+        if not self.writer.closed:
+            self.writer.close()
+
+    def test_round_trip(self):
+        """ frames are read back as written """
+        resident.write_frame(self.writer, b'first')
+        resident.write_frame(self.writer, b'', timeout=1)
+        self.assertEqual(resident.read_frame(self.reader), b'first')
+        self.assertEqual(resident.read_frame(self.reader, 1), b'')
+
+    def test_end_of_stream(self):
+        """ stream ending inside a frame is an error """
+        self.writer.write(b'\x00\x00\x00\x09part')
+        self.writer.close()
+        with self.assertRaises(error.ProtocolError):
+            resident.read_frame(self.reader)
+
+    def test_read_timeout(self):
+        """ frame not written in time is an error """
+        with self.assertRaises(error.ProtocolError):
+            resident.read_frame(self.reader, 0.1)
+
+    def test_write_timeout(self):
+        """ frame too large for the pipe, and never read, is an error """
+        start = time.time()
+        with self.assertRaises(error.ProtocolError):
+            resident.write_frame(self.writer, b'x' * 1000000, timeout=0.2)
+        self.assertLess(time.time() - start, 5)
+
+class TestResidentFilter(unittest.TestCase):
+    """ resident filters started and sent requests """
+
+    def setUp(self):
+        """ write filters """
+        self.directory = tempfile.TemporaryDirectory()
+        self.serve_filter = self.write_filter('serve.py', SERVE_FILTER)
+        self.exit_filter = self.write_filter('exit.py', EXIT_FILTER)
+        self.hang_filter = self.write_filter('hang.py', HANG_FILTER)
+        self.not_ast_filter = self.write_filter('not_ast.py', NOT_AST_FILTER)
+
+    def tearDown(self):
+        """ stop filters, remove them """
+        resident.stop_all()
+        self.directory.cleanup()
+
+    def write_filter(self, name, text):
+        """ return path of executable name written with text """
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf8') as filter_file:
+            filter_file.write(text)
+        os.chmod(path, 0o755)
+        return path
+
+    def request(self, command, ast, timeout=10):
+        """ return (text of last paragraph, stderr) of command run on ast """
+        ast, stderr = resident.run(command, ast, ['html', 'x'], '[]',
+                                   timeout=timeout)
+        return ast[1][-1]['c'][0]['c'], stderr
+
+    def test_serve(self):
+        """ filter using serve replies, and keeps running between requests """
+        first, stderr = self.request(self.serve_filter, empty_document())
+        self.assertEqual(json.loads(stderr), {'level': 'INFO',
+                                              'message': 'seen'})
+        second, _ = self.request(self.serve_filter, empty_document())
+        self.assertTrue(first.startswith('html x '))
+        self.assertEqual(first, second)
+
+    def test_relative_command(self):
+        """ relative and absolute paths of a filter share its process """
+        first, _ = self.request(self.serve_filter, empty_document())
+        relative = os.path.relpath(self.serve_filter)
+        second, _ = self.request(relative, empty_document())
+        self.assertEqual(first, second)
+
+    def test_exit_restarts(self):
+        """ filter that exits is started again for the next request """
+        with self.assertRaises(error.FilterError):
+            self.request(self.exit_filter, empty_document())
+        with self.assertRaises(error.FilterError):
+            self.request(self.exit_filter, empty_document())
+
+    def test_not_ast(self):
+        """ filter replying with something other than an ast fails """
+        with self.assertRaises(error.FilterError):
+            self.request(self.not_ast_filter, empty_document())
+
+    def test_hang_times_out(self):
+        """ filter that stops reading a large request times out """
+        ast = empty_document()
+        ast[1].append({'t': 'Para', 'c': [{'t': 'Str', 'c': 'x' * 200000}]})
+        start = time.time()
+        with self.assertRaises(error.FilterError):
+            self.request(self.hang_filter, ast, timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+        key = (os.path.realpath(self.hang_filter),
+               os.environ.get('PANZER_SHARED'))
+        self.assertIsNone(resident.RESIDENTS[key].process)
+
+def empty_document():
+    """ return ast of empty document """
+    return [{'unMeta': {}}, []]
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of running processes with limits on time and resources, and of
+reading their stderr
+
+syntax: test_util.py
+    or: python -m pytest test/
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import const
+from panzer import error
+from panzer import info
+from panzer import util
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# whether memory and cpu limits can be set
+HAS_LIMITS = hasattr(resource, 'prlimit')
+
+# python code allocating 500 MB
+ALLOCATE = 'data = bytearray(500 * 1024 * 1024)'
+
+# python code using cpu until stopped
+BURN = 'while True: pass'
+
+def run(code, limits):
+    """ return exit status of python running code under limits """
+    async def run_process():
+        """ start python and wait for it """
+        process = await util.start_process([sys.executable, '-c', code],
+                                           limits,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+        stderr_log = util.drain_stderr(process, 'python', 10)
+        try:
+            await util.finish_process(process, None, limits.get('timeout'),
+                                      limits, stderr_log)
+        finally:
+            await stderr_log.join()
+        return process.returncode
+    with info.keep_log(info.Log()):
+        return asyncio.run(run_process())
+
+def read_stderr(code, max_lines):
+    """ return (messages kept, log) of python running code """
+    async def run_process():
+        """ start python and read its stderr """
+        process = await util.start_process([sys.executable, '-c', code],
+                                           None,
+                                           stderr=subprocess.PIPE)
+        stderr_log = util.drain_stderr(process, 'python', max_lines)
+        await process.wait()
+        return await stderr_log.join()
+    with info.keep_log(info.Log()) as log:
+        return asyncio.run(run_process()), log
+
+class TestStderrLog(unittest.TestCase):
+    """ messages read from stderr as a process runs """
+
+    def test_max_lines(self):
+        """ only the last messages are kept, but all are logged """
+        code = ('import sys\n'
+                'for i in range(10): sys.stderr.write("%d\\n" % i)')
+        messages, log = read_stderr(code, 3)
+        self.assertEqual([item['message'] for item in messages],
+                         ['!7', '!8', '!9'])
+        logged = [item['message'] for item in log.messages]
+        self.assertEqual(logged[:10], ['!%d' % i for i in range(10)])
+        self.assertIn('kept last 3 of 10 messages', logged)
+
+    def test_long_line(self):
+        """ line longer than the limit is read in pieces """
+        size = const.STDERR_LINE_LIMIT * 5 // 2
+        code = 'import sys; sys.stderr.write("x" * %d + "\\n")' % size
+        messages = read_stderr(code, 10)[0]
+        self.assertGreater(len(messages), 1)
+        pieces = [item['message'][1:] for item in messages]
+        self.assertTrue(all(len(piece) <= const.STDERR_LINE_LIMIT
+                            for piece in pieces))
+        self.assertEqual(''.join(pieces), 'x' * size)
+
+    def test_no_final_newline(self):
+        """ last line is read without a newline after it """
+        code = ('import sys; sys.stderr.write('
+                '\'{"level": "INFO", "message": "first"}\\n'
+                '{"level": "WARNING", "message": "last"}\')')
+        messages = read_stderr(code, 10)[0]
+        self.assertEqual(messages, [{'level': 'INFO', 'message': 'first'},
+                                    {'level': 'WARNING', 'message': 'last'}])
+
+class TestLimits(unittest.TestCase):
+    """ processes stopped, or failing, under limits """
+
+    def test_exit_status_ignored(self):
+        """ failure of process under a time limit is not blamed on it """
+        self.assertEqual(run('raise SystemExit(3)', {'timeout': 10}), 3)
+
+    def test_timeout(self):
+        """ process running past its timeout is stopped """
+        with self.assertRaises(error.LimitError):
+            run(BURN, {'timeout': 0.5})
+
+    @unittest.skipIf(not HAS_LIMITS, 'resource limits not supported')
+    def test_memory(self):
+        """ process failing to get memory past its limit is blamed on it """
+        self.assertEqual(run('data = bytearray(1024)', {'memory': 200}), 0)
+        with self.assertRaises(error.LimitError) as caught:
+            run(ALLOCATE, {'memory': 200})
+        self.assertIn('memory=200', str(caught.exception))
+
+    @unittest.skipIf(not HAS_LIMITS, 'resource limits not supported')
+    def test_memory_exit_status_ignored(self):
+        """ failure of process under a memory limit is not blamed on it """
+        self.assertEqual(run('raise SystemExit(3)', {'memory': 200}), 3)
+
+    @unittest.skipIf(not HAS_LIMITS, 'resource limits not supported')
+    def test_cpu(self):
+        """ process killed for using cpu past its limit is blamed on it """
+        with self.assertRaises(error.LimitError) as caught:
+            run(BURN, {'cpu': 1, 'timeout': 30})
+        self.assertIn('cpu=1', str(caught.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Unit tests of converting yaml to pandoc metadata without pandoc
+
+syntax: test_yamlmeta.py
+    or: python -m pytest test/
+
+Expected values are those of pandoc's markdown reader. TestConformance
+compares them with pandoc's own output, and is skipped if pandoc is not on
+PATH.
+"""
+
+import os
+import shutil
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from panzer import info
+from panzer import yamlmeta
+
+from helpers import blocks
+from helpers import inlines
+
+# strings that need no markdown reader
+PLAIN = ['word', 'two words', 'end.', 'a_b', 'it\'s (so)', 'path/to/file.py',
+         'paragraph\n']
+
+@unittest.skipUnless(yamlmeta.available(), 'pyyaml not installed')
+class TestConvert(unittest.TestCase):
+    """ yaml converted to metadata fields """
+
+    def convert(self, yaml_string):
+        """ return metadata of yaml_string, markdown treated as plain """
+        return yamlmeta.convert(yaml_string, fallback=False)
+
+    def test_scalars(self):
+        """ booleans, numbers, null and dates """
+        metadata = self.convert('a: true\nb: 3\nc: 2.5\nd:\ne: 2014-01-02\n')
+        self.assertEqual(metadata['a'], {'t': 'MetaBool', 'c': True})
+        self.assertEqual(metadata['b'], {'t': 'MetaString', 'c': '3'})
+        self.assertEqual(metadata['c'], {'t': 'MetaString', 'c': '2.5'})
+        self.assertEqual(metadata['d'], {'t': 'MetaString', 'c': ''})
+        self.assertEqual(metadata['e'], inlines('2014-01-02'))
+
+    def test_numbers(self):
+        """ only decimal numbers are numbers; yaml 1.1's other forms are text """
+        metadata = self.convert('a: 12:30\nb: 010\nc: 0x1F\nd: 1_000\n'
+                                'e: 1.5e+3\nf: 0o17\n')
+        self.assertEqual(metadata['a'], inlines('12:30'))
+        self.assertEqual(metadata['b'], {'t': 'MetaString', 'c': '10'})
+        self.assertEqual(metadata['c'], inlines('0x1F'))
+        self.assertEqual(metadata['d'], inlines('1_000'))
+        self.assertEqual(metadata['e'], {'t': 'MetaString', 'c': '1500.0'})
+        self.assertEqual(metadata['f'], inlines('0o17'))
+
+    def test_underscore_keys(self):
+        """ keys ending in '_' are dropped, at any depth """
+        metadata = self.convert('a_: 1\nb:\n  c_: 2\n  d: 3\n')
+        self.assertEqual(set(metadata), {'b'})
+        self.assertEqual(set(metadata['b']['c']), {'d'})
+
+    def test_words(self):
+        """ plain words are inlines """
+        self.assertEqual(self.convert('a: two  words\n')['a'],
+                         inlines('two', 'words'))
+
+    def test_block_scalar(self):
+        """ string ending in newline is blocks """
+        metadata = self.convert('a: |\n  inside_verb\nb: >\n  two\n  lines\n')
+        self.assertEqual(metadata['a'], blocks('inside_verb'))
+        self.assertEqual(metadata['b'], blocks('two', 'lines'))
+
+    def test_block_scalar_stripped(self):
+        """ block scalar with its newline stripped is inlines """
+        metadata = self.convert('a: |-\n  inside_verb\n')
+        self.assertEqual(metadata['a'], inlines('inside_verb'))
+
+    def test_list(self):
+        """ lists, and empty strings """
+        metadata = self.convert('a:\n  - one\n  - ""\n')
+        self.assertEqual(metadata['a'], {'t': 'MetaList', 'c': [
+            inlines('one'), {'t': 'MetaBlocks', 'c': []}]})
+
+    def test_markdown_pending(self):
+        """ strings needing markdown are left for pandoc """
+        pending = list()
+        field = yamlmeta.to_meta('*emphasis*', pending, True)
+        self.assertEqual(pending, [field])
+        self.assertEqual(yamlmeta.to_meta('plain', pending, True),
+                         inlines('plain'))
+        self.assertEqual(len(pending), 1)
+
+@unittest.skipUnless(yamlmeta.available(), 'pyyaml not installed')
+@unittest.skipUnless(shutil.which('pandoc'), 'pandoc not found')
+class TestConformance(unittest.TestCase):
+    """ metadata converted natively matches that converted by pandoc """
+
+    def assert_same(self, yaml_string, fallback=True):
+        """ check yaml_string converted natively and by pandoc match """
+        with info.keep_log(info.Log()):
+            native = yamlmeta.convert(yaml_string, fallback)
+            pandoc = yamlmeta.pandoc_convert(yaml_string)
+        self.assertEqual(differences(native, pandoc, list()), list())
+
+    def test_styles(self):
+        """ styles.yaml of the test support directory """
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'dot-panzer', 'styles.yaml')
+        with open(filename, 'r', encoding='utf8') as styles_file:
+            self.assert_same(styles_file.read())
+
+    def test_plain(self):
+        """ strings not sent to pandoc are read as pandoc reads them """
+        # - none of PLAIN has '"' or '\\', so each can be double-quoted
+        yaml_string = ''.join('f%d: "%s"\n' % (i, text)
+                              for i, text in enumerate(PLAIN)
+                              if not text.endswith('\n'))
+        yaml_string += 'block: |\n  paragraph\n'
+        self.assert_same(yaml_string, fallback=False)
+
+class TestNeedsMarkdown(unittest.TestCase):
+    """ strings that pandoc's markdown reader must parse """
+
+    def test_plain(self):
+        """ words, punctuation and intraword underscores are plain """
+        for text in PLAIN:
+            self.assertFalse(yamlmeta.needs_markdown(text), text)
+
+    def test_markdown(self):
+        """ markup, several lines and list markers need markdown """
+        for text in ['*a*', '_a_', '`code`', '# title', '- item',
+                     '1. item', 'a) item', 'iv. item', '[link](x)',
+                     'two\nlines', ' indented', 'a\\b', '$x$']:
+            self.assertTrue(yamlmeta.needs_markdown(text), text)
+
+def differences(native, pandoc, path):
+    """ return list of (path, native, pandoc) where values differ """
+    if isinstance(native, dict) and isinstance(pandoc, dict):
+        found = list()
+        for key in sorted(native.keys() | pandoc.keys()):
+            found += differences(native.get(key), pandoc.get(key),
+                                 path + [key])
+        return found
+    if isinstance(native, list) and isinstance(pandoc, list) \
+    and len(native) == len(pandoc):
+        found = list()
+        for i, (native_item, pandoc_item) in enumerate(zip(native, pandoc)):
+            found += differences(native_item, pandoc_item, path + [str(i)])
+        return found
+    if native != pandoc:
+        return [('/'.join(path), native, pandoc)]
+    return list()
+
+if __name__ == '__main__':
+    unittest.main()